@@ -1,56 +1,196 @@
 from app import App
 from array import array
-from buttons import _num
-from math import radians, tan
 from micropython import const
 from tidal import *
-from tidal3d import *
+import gc
+import random
+import select
+import sys
 import time
+from .native import *
 
-from .buffdisp import BufferedDisplay
-from .object import Mesh
+# When the app's own modules started loading, for measuring startup time
+_load_t = time.ticks_us()
 
-MODE_POINT_CLOUD = const(0)
-MODE_WIREFRAME_FULL = const(1)
-MODE_WIREFRAME_BACK_FACE_CULLING = const(2)
-MODE_SOLID = const(3)
-MODE_SOLID_SHADED = const(4)
+from .bodies import RigidBodies
+from .buffdisp import BufferedDisplay
+from .bundle import Bundle
+from .camera import Camera, sphere_outside
+from .capture import FrameCapture
+from .displaylist import DisplayList, TileBins
+from .input import InputQueue, LatencyHistogram
+from .memory import MemoryReport
+from .object import ASSET_DIR, Mesh, NO_FACE
+from .particles import ParticleSystem
+from .pipeline import Pipeline
+from .resolution import ResolutionController
+from .scene import *
+
+# Models are loaded from this bundle if it has been uploaded and has them in it, which is quicker than
+# loading them from their own files, see tools/pack_bundle.py
+BUNDLE = 'models.bundle'
+
+# Set to True to work out what to draw for the next frame on a second thread while the current frame
+# is being drawn, see pipeline.py; with the badge's global interpreter lock the threads take turns, so
+# this gives no parallel speedup
+PIPELINED = False
+
+# Set to the height of a horizontal strip of the display, which must divide the display's height, to draw
+# the display in tiles that size using a much smaller framebuffer; None uses a framebuffer for the whole
+# display
+TILE_HEIGHT = None
+
+# Set to True to draw into a framebuffer of 8-bit palette indices, which is half the size of an RGB565
+# framebuffer, instead of RGB565 colours; the palette has an entry for each of the model's materials, and
+# a ramp of this many entries for each material for shading, so shading is a little less smooth
+INDEXED_COLOUR = False
+SHADE_LEVELS = const(32)
+
+# Set to a frame time in microseconds to draw the scene at half resolution whenever frames take longer
+# than that on average, and at full resolution again once they are well under it, see ResolutionController;
+# None always draws at full resolution
+FRAME_BUDGET = None
+
+# Set to True to measure how long it takes for joystick presses to be seen on the display, type l into the
+# serial console to show a histogram of the times, see LatencyHistogram
+MEASURE_LATENCY = False
+
+# Set to True to spray a fountain of particles out of the top of the model, to try out particle systems,
+# see ParticleSystem; the fountain has room for this many particles, and sprays this many a second
+PARTICLE_DEMO = False
+SPRAY_CAPACITY = const(300)
+SPRAY_RATE = const(100)
+
+# The joystick directions in the order they are numbered in input events, an event is the direction's
+# number times two, plus one if it was pressed rather than released
+JOYSTICK = (JOY_LEFT, JOY_RIGHT, JOY_UP, JOY_DOWN)
 
 
 class Renderer(App):
 
     def __init__(self):
+        init_t = time.ticks_us()
         super().__init__()
 
         # We'll render the scene to an off-screen buffer and blit it to the display
         # all at once when we're ready
-        self.fb = BufferedDisplay(display)
+        self.fb = BufferedDisplay(display, TILE_HEIGHT, INDEXED_COLOUR)
+
+        # The colour of each material, which is its palette index when drawing into an indexed framebuffer,
+        # and when drawing into an indexed framebuffer, the index of the first entry of each material's
+        # shading ramp, and how many entries the ramps have; these are set whenever a model is loaded
+        self.material_colours = None
+        self.material_ramps = None
+        self.shade_levels = 0
 
-        # Initial render mode and object, see the constants above for other modes
+        # Palette indices of colours that aren't the model's, such as the colours of particles, by colour
+        self.palette_indices = {}
+
+        # Initial render mode and object, see scene.py for other modes
         self.render_mode = MODE_SOLID_SHADED
         self.render_object = 'cube.obj'
 
         # Projection matrix
-        self.m_proj = Renderer.perspective_matrix(90, self.fb.width / self.fb.height,  0.1, 100)
-
-        # Camera position and view transformation matrix
-        # TODO a proper camera system
-        self.v_campos = array('f', [0, 10, 35])
-        self.m_view = Renderer.identity_matrix()
-        m_translate(self.m_view, array('f', [0, -10, -35]))
+        self.m_proj = perspective_matrix(FIELD_OF_VIEW, self.fb.width / self.fb.height, NEAR, FAR)
+
+        # Camera, from which we get the view transformation matrix and the frustum planes
+        self.camera = Camera(self.m_proj, CAMERA_POSITION)
+
+        # Pre-allocated space for the combined model, view and projection matrix, see build_line_list()
+        self.m_mvp = array('f', [0] * 16)
+
+        # Pre-allocated space for building display lists, so that building one allocates nothing, which
+        # matters most when it is done on the pipeline's thread: the inverse of the mesh's rotation, the
+        # light vector and camera position in the mesh's object space, and working space for the depth
+        # sort and for colouring faces, see build_display_list()
+        self.m_inverse = array('f', [0] * 16)
+        self.q_inverse = array('f', [0, 0, 0, 0])
+        self.light_obj = array('f', [0, 0, 0])
+        self.camera_obj = array('f', [0, 0, 0])
+        self.centre = array('f', [0, 0, 0])
+        self.rgb = array('f', [0, 0, 0])
+        self.face_verts = [None, None, None]
 
         # Lighting vector
-        self.v_light = array('f', [-1, -1, -2])
+        self.v_light = array('f', LIGHT)
         v_normalise(self.v_light)
 
-        # Model to render
-        self.mesh = Mesh(self.render_object)
+        # Particle systems, which are moved and drawn over the scene every frame, and how many particles
+        # short the fountain of the particle demo is of its steady rate, see spray()
+        self.particles = []
+        self.spray_due = 0
+        if PARTICLE_DEMO:
+            self.particles.append(ParticleSystem(SPRAY_CAPACITY, color565(255, 160, 0), 2, (0, -20, 0)))
+
+        # Joystick presses and releases waiting to be acted on, and which directions are held, see update()
+        self.events = InputQueue()
+        self.joystick = bytearray(len(JOYSTICK))
+
+        # When measuring input latency, the time of the first press acted on by the frame being built
+        self.latency = LatencyHistogram() if MEASURE_LATENCY else None
+        self.input_t = None
+
+        # Memory accounting, see report_memory()
+        self.memory = MemoryReport()
+        self.memory_frame = False
+
+        # Rigid bodies that move the model, of which there is only the one, see update()
+        self.bodies = RigidBodies(1)
+
+        # Model to render, and the bundle of models, which is kept open to load models from
+        self.bundle = None
+        try:
+            self.bundle = Bundle(ASSET_DIR + BUNDLE)
+        except OSError:
+            pass
+        self.mesh = None
+        self.pipeline = None
+        self.load_mesh()
+
+        # The triangles to draw for a frame; when pipelined, there is a pair of display lists that are
+        # swapped between the thread building them and the thread drawing them
+        self.display_list = DisplayList(len(self.mesh.faces))
+        if PIPELINED:
+            self.pipeline = Pipeline(
+                [self.display_list, DisplayList(len(self.mesh.faces))], self.produce_frame)
+        self.produce_t = 0
+
+        # When drawing in tiles, the triangles of the display list are binned by tile, and we keep track
+        # of which tiles had nothing drawn in them last time so that we don't need to draw them again
+        self.bins = None
+        if self.fb.num_tiles > 1:
+            self.bins = TileBins(self.fb.num_tiles, self.fb.tile_height)
+            self.bins.reserve(len(self.mesh.faces))
+            self.empty_tiles = bytearray(self.fb.num_tiles)
+            self.hud_fps = -1
+            self.hud_scale = 1
+
+        # Resolution to draw the scene at, as the number of display pixels across and down each pixel of
+        # the scene covers, chosen from recent frame times if there is a frame time budget
+        self.scale = 1
+        self.resolution = ResolutionController(FRAME_BUDGET) if FRAME_BUDGET else None
+
+        # How long the last depth sort, or walk of the mesh's BSP tree, took, and whether to sort the faces
+        # of the next frame even if the mesh is convex, to find out how long sorting takes when it is skipped
+        self.sort_t = 0
+        self.sort_sample = True
+
+        # Most memory used in any frame, for comparing tiled and full framebuffer drawing
+        self.peak_heap = 0
+
+        # Frame capture, only allocated when capturing is turned on because it needs as much memory
+        # again as the framebuffer
+        self.capture = None
+        self.capture_t = 0
 
         self.start_t = 0
         self.accum_t = 0
         self.frame_counter = 0
         self.fps = 0
 
+        # Startup timings, shown once the first frame has been rendered
+        self.startup_t = (time.ticks_diff(init_t, _load_t), time.ticks_diff(time.ticks_us(), init_t))
+
     @staticmethod
     def identity_matrix():
         """
@@ -59,43 +199,30 @@ class Renderer(App):
         """
         return array('f', [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1])
 
-    @staticmethod
-    def perspective_matrix(fov, aspect, near, far):
-        """
-        Returns the perspective projection matrix for the given field of view and aspect ratio, multiplication
-        of any vector V with the projection matrix will yield normalised device coordinates
-        """
-        proj_mat = [0] * 16
-        # Set the field of view, accomodating for the aspect ratio of the screen
-        scale = tan(radians(fov * 0.5))
-        proj_mat[0] = 1.0 / (scale * aspect)  # Scale of the x coord of the projected vertex
-        proj_mat[5] = 1.0 / scale  # Scale of the y coord of the projected vertex
-        # Z clipping planes
-        proj_mat[10] = -far / (far - near)
-        proj_mat[14] = -far * near / (far - near)
-        # Setting these following values is how we do the perspective division, by causing w to be set to -z
-        # instead of 1 and then w is used as the normalising divisor during vector-proj_mat multiplication
-        proj_mat[11] = -1
-        proj_mat[15] = 0
-
-        return array('f', proj_mat)
-
     def on_activate(self):
         super().on_activate()
 
         # Register input callbacks
         self.buttons.on_press(BUTTON_A, self.select_mode)
         self.buttons.on_press(BUTTON_B, self.select_object)
-        self.buttons.on_press(JOY_UP, self.button_up, False)
-        self.buttons.on_press(JOY_DOWN, self.button_down, False)
-        self.buttons.on_press(JOY_LEFT, self.button_left, False)
-        self.buttons.on_press(JOY_RIGHT, self.button_right, False)
+        for i in range(len(JOYSTICK)):
+            self.buttons.on_up_down(JOYSTICK[i], self._joystick_callback(i))
+        self.buttons.on_press(JOY_CENTRE, self.toggle_capture)
+
+        # Commands can also be sent over the serial console, see serial_command()
+        self.stdin = select.poll()
+        self.stdin.register(sys.stdin, select.POLLIN)
 
         self.start_t = time.ticks_us()
+        if self.pipeline:
+            self.produce_t = self.start_t
+            self.pipeline.start()
         self.loop()
 
     def on_deactivate(self):
         self.timer.cancel()
+        if self.pipeline:
+            self.pipeline.stop()
         super().on_deactivate()
 
     def select_mode(self):
@@ -112,38 +239,130 @@ class Renderer(App):
             self.render_object = 'teapot.obj'
         elif self.render_object == 'teapot.obj':
             self.render_object = 'cube.obj'
-        # Reload the model
-        self.mesh = Mesh(self.render_object)
-
-    def button_left(self):
-        self.mesh.rotate_y(45)
-
-    def button_right(self):
-        self.mesh.rotate_y(-45)
-
-    def button_up(self):
-        self.mesh.rotate_x(45)
+        # Reload the model, stopping the other thread first if it is running so that it doesn't see the
+        # model, its rigid body or its palette change part way through building a frame; any frames it
+        # built from the old model are dropped when it starts again
+        pipeline = self.pipeline
+        restart = pipeline is not None and pipeline.running
+        if restart:
+            pipeline.stop()
+        self.load_mesh()
+        if restart:
+            self.produce_t = time.ticks_us()
+            pipeline.start()
+
+    def load_mesh(self):
+        # Take snapshots of the heap either side of loading the model, the difference between the last
+        # two shows how much garbage the parsers leave behind, and either side of rendering it
+        # The other thread must not be running, see select_object()
+        memory = self.memory
+
+        # Drop the old model first so that both don't need to fit in memory at once
+        if self.mesh and self.mesh.animation:
+            self.mesh.animation.close()
+        self.mesh = None
+        memory.record("load " + self.render_object, False)
+        self.mesh = Mesh(self.render_object, self.bundle)
+        self.bodies.clear()
+        self.mesh.attach(self.bodies)
+        if self.fb.indexed:
+            self.assign_palette()
+        else:
+            self.material_colours = [color565(int(c[0]), int(c[1]), int(c[2])) for c in self.mesh.colours]
+        self.sort_sample = True
+        memory.record("loaded " + self.render_object)
+        memory.record("collected", False)
+        self.memory_frame = True
+
+    def assign_palette(self):
+        """
+        Sets up the palette of an indexed framebuffer for the current model; the colours used for text
+        are BLACK and WHITE, which an 8-bit framebuffer truncates to entries 0 and 255, so those are black
+        and white, and the entries in between are shared out between the model's materials
+        """
+        fb = self.fb
+        fb.set_palette(0, BLACK)
+        fb.set_palette(255, WHITE)
+        self.palette_indices = {}
+
+        # Each material has an entry for its unshaded colour followed by a ramp for shading it, from
+        # unlit, which is kept a little above black to simulate some ambient light, up to fully lit
+        colours = self.mesh.colours
+        levels = min(SHADE_LEVELS, 254 // len(colours) - 1)
+        if levels < 1:
+            raise ValueError("Too many materials for the palette")
+        self.material_colours = []
+        self.material_ramps = []
+        self.shade_levels = levels
+        index = 1
+        for c in colours:
+            fb.set_palette(index, color565(int(c[0]), int(c[1]), int(c[2])))
+            self.material_colours.append(index)
+            self.material_ramps.append(index + 1)
+            for level in range(levels):
+                f = level / (levels - 1) if levels > 1 else 1
+                fb.set_palette(index + 1 + level, color565(
+                    max(int(c[0] * f), 8), max(int(c[1] * f), 8), max(int(c[2] * f), 8)))
+            index += 1 + levels
+
+    def toggle_capture(self):
+        # Start or stop streaming frames to the host, see tools/capture.py
+        if self.bins:
+            print("Capturing needs a framebuffer for the whole display, set TILE_HEIGHT = None")
+        elif self.fb.indexed:
+            print("Capturing needs an RGB565 framebuffer, set INDEXED_COLOUR = False")
+        elif self.capture:
+            self.capture = None
+        else:
+            self.capture = FrameCapture(self.fb)
+
+    def _joystick_callback(self, direction):
+        # Joystick presses and releases are only queued up here, with the time the callback ran, and acted
+        # on when the simulation is next updated, which may be on the other thread
+        events = self.events
+        return lambda pressed: events.push(direction * 2 + (1 if pressed else 0))
 
-    def button_down(self):
-        self.mesh.rotate_x(-45)
+    def loop(self):
+        # Check for commands on the serial console, ipoll doesn't allocate anything
+        for _ in self.stdin.ipoll(0):
+            self.serial_command(sys.stdin.read(1))
 
-    def _get_button_state(self, pin):
-        # Buttons are active so invert to make truthy mean pressed, which seems more intuitive
-        return not self.buttons._callbacks[_num(pin)].state
+        if self.memory_frame:
+            self.memory.record("render", False)
 
-    def loop(self):
         last_t = self.start_t
         self.start_t = time.ticks_us()
         delta_t = time.ticks_diff(self.start_t, last_t)
 
-        # Update the simulation
-        self.update(delta_t / 1000000)
-
-        # Render the scene
-        self.render_background()
-        self.render_scene(self.render_mode)
-        self.render_foreground()
-        self.fb.blit()
+        if self.pipeline:
+            # The simulation is updated and the display list is built on the other thread, so all we
+            # need to do here is draw the display list once it is ready
+            if not self.pipeline.consume(self.draw_frame):
+                self.start_t = last_t
+                self.timer = self.after(1, self.loop)
+                return
+        else:
+            # Update the simulation
+            self.update(delta_t / 1000000)
+
+            # Render the scene
+            self.build_display_list(self.render_mode, self.display_list)
+            self.build_particles(self.display_list, delta_t / 1000000)
+            self.display_list.input_t = self.input_t
+            self.input_t = None
+            self.draw_frame(self.display_list)
+
+        # Only now that a frame has been drawn is delta_t the whole time of a frame, when pipelined most
+        # calls find no frame ready yet and return above, and their partial times would throw the average
+        # out; the scale chosen applies to the next frame that is built
+        if self.resolution:
+            self.scale = self.resolution.update(delta_t)
+
+        if self.startup_t:
+            self.report_startup()
+        if self.memory_frame:
+            self.memory.record("rendered")
+            self.memory_frame = False
 
         # Calculate frames per second
         self.frame_counter += 1
@@ -152,173 +371,605 @@ class Renderer(App):
             self.accum_t -= 1000000
             self.fps = self.frame_counter
             self.frame_counter = 0
-
-        # Show the time it took to render the frame
-        print("{:,} us".format(delta_t))
+            if self.pipeline:
+                print("utilisation: build {}%, draw {}%".format(*self.pipeline.utilisation()))
+            print("peak heap {:,} bytes".format(self.peak_heap))
+            self.peak_heap = 0
+            if self.render_mode >= MODE_SOLID:
+                if self.mesh.bsp is not None:
+                    print("depth sort replaced by BSP tree walk, {:,} us".format(self.sort_t))
+                elif self.mesh.convex:
+                    print("depth sort skipped for convex mesh, saving {:,} us".format(self.sort_t))
+                else:
+                    print("depth sort {:,} us".format(self.sort_t))
+
+        # Show the time it took to render the frame, and how much of that was spent capturing it
+        if self.capture_t:
+            print("{:,} us (capture {:,} us)".format(delta_t, self.capture_t))
+        else:
+            print("{:,} us".format(delta_t))
+
+        # Stream the frame to the host if we are capturing, the time this takes is included in the
+        # time shown for the next frame
+        self.capture_t = 0
+        if self.capture:
+            self.capture_t = self.capture.capture()
 
         self.timer = self.after(1, self.loop)
 
-    def update(self, delta_t):
-        # Kill velocity if buttons no longer pressed
-        if not self._get_button_state(JOY_LEFT) and not self._get_button_state(JOY_RIGHT):
-            self.mesh.rotate_y(0)
-        if not self._get_button_state(JOY_UP) and not self._get_button_state(JOY_DOWN):
-            self.mesh.rotate_x(0)
+    def produce_frame(self, display_list):
+        # Called on the pipeline's thread, which keeps its own time for updating the simulation
+        last_t = self.produce_t
+        self.produce_t = time.ticks_us()
+        delta_t = time.ticks_diff(self.produce_t, last_t) / 1000000
+        self.update(delta_t)
+        self.build_display_list(self.render_mode, display_list)
+        self.build_particles(display_list, delta_t)
+        display_list.input_t = self.input_t
+        self.input_t = None
+
+    def draw_frame(self, display_list):
+        # Draw the scene at the resolution its display list was built for, scaling it up to the resolution
+        # of the display before drawing the text on top
+        self.fb.set_scale(display_list.scale)
+        if self.bins:
+            self.draw_tiles(display_list)
+        else:
+            self.render_background()
+            self.draw_display_list(display_list)
+            self.fb.upscale()
+            self.render_foreground()
+            self._blit_started(display_list)
+            self.fb.blit()
+        self.peak_heap = max(self.peak_heap, gc.mem_alloc())
+
+    def draw_tiles(self, display_list):
+        fb = self.fb
+        bins = self.bins
+        bins.tile_height = fb.render_height
+        bins.bin(display_list)
+        counts = bins.counts
+        empty_tiles = self.empty_tiles
+
+        # The text on screen only changes when the frame rate or the resolution does
+        hud_changed = self.fps != self.hud_fps or fb.scale != self.hud_scale
+        self.hud_fps = self.fps
+        self.hud_scale = fb.scale
+
+        for tile in range(fb.num_tiles):
+            # A tile with nothing in it that also had nothing in it last time is still showing the
+            # background, so there's nothing to draw
+            if not counts[tile] and not display_list.particles:
+                if empty_tiles[tile] and not hud_changed:
+                    continue
+                empty_tiles[tile] = 1
+            else:
+                empty_tiles[tile] = 0
+
+            fb.tile_y = tile * fb.tile_height
+            self.render_background()
+            self.draw_display_list(display_list, bins.bins, tile * bins.size, counts[tile])
+            fb.upscale()
+            self.render_foreground()
+            self._blit_started(display_list)
+            fb.blit()
+        fb.tile_y = 0
+
+    def _blit_started(self, display_list):
+        # The first frame to act on a joystick press is starting to be sent to the display, so the press
+        # is about to be seen
+        if display_list.input_t is not None:
+            self.latency.record(time.ticks_diff(time.ticks_us(), display_list.input_t))
+            display_list.input_t = None
+
+    def serial_command(self, command):
+        # Single character commands typed into the serial console
+        if command == 'm':
+            self.report_memory()
+        elif command == 'l':
+            self.report_latency()
+        elif command == 'p':
+            self.report_pick()
+
+    def report_memory(self):
+        # Show where the memory is going, and snapshots of the heap from loading and rendering the model
+        self.memory.print_report(self)
+
+    def report_latency(self):
+        # Show how long joystick presses took to be seen on the display since last time, and start again
+        if not self.latency:
+            print("Measuring input latency is turned off, set MEASURE_LATENCY = True")
+            return
+        self.latency.print_report()
+        self.latency.reset()
+
+    def report_pick(self):
+        # Show which face is in the middle of the display, and how long it took to find it
+        start_t = time.ticks_us()
+        picked = self.pick(self.fb.width // 2, self.fb.height // 2)
+        pick_t = time.ticks_diff(time.ticks_us(), start_t)
+        if picked is None:
+            print("pick: nothing in the middle of the display, {:,} us".format(pick_t))
+        else:
+            print("pick: face {} at distance {:.2f}, {:,} us".format(picked[0], picked[1], pick_t))
+
+    def report_startup(self):
+        # Show how long it took to load the app's modules, initialise the app and render the first
+        # frame, and how much heap is left once we have rendered it
+        load_t, init_t = self.startup_t
+        print("startup: load {:,} us, init {:,} us, first frame {:,} us, heap free {:,} bytes".format(
+            load_t, init_t, time.ticks_diff(time.ticks_us(), _load_t), gc.mem_free()))
+        self.startup_t = None
 
+    def update(self, delta_t):
+        # Act on the joystick presses and releases since the last update, in the order they happened;
+        # the model spins for as long as the joystick is held, left and right around the y axis and up
+        # and down around the x axis, and if both ways are held then the most recent wins
+        events = self.events
+        held = self.joystick
+        while (event := events.pop()) >= 0:
+            direction = event >> 1
+            pressed = event & 1
+            held[direction] = pressed
+            speed = -45 if direction & 1 else 45
+            if not pressed:
+                speed = -speed if held[direction ^ 1] else 0
+            if direction >> 1:
+                self.mesh.rotate_x(speed)
+            else:
+                self.mesh.rotate_y(speed)
+            if pressed and self.latency and self.input_t is None:
+                self.input_t = events.time
+
+        # Move every rigid body, and with them the model, and work out their model matrices, and then play
+        # the model's vertex animation
+        self.bodies.update(delta_t)
         self.mesh.update(delta_t)
 
+        if PARTICLE_DEMO:
+            self.spray(delta_t)
+
+    def spray(self, delta_t):
+        # Keep the particle demo's fountain going at a steady rate however long frames take, spraying
+        # particles up and out from the top of the model
+        self.spray_due += SPRAY_RATE * delta_t
+        system = self.particles[0]
+        position = self.mesh.position
+        top = (position[0], position[1] + self.mesh.bounds[3], position[2])
+        while self.spray_due >= 1:
+            self.spray_due -= 1
+            velocity = (random.uniform(-4, 4), random.uniform(10, 16), random.uniform(-4, 4))
+            system.emit(top, velocity, random.uniform(1, 2))
+
+    def palette_index(self, colour):
+        """
+        Returns the index of the palette entry of an indexed framebuffer nearest to the given RGB565
+        colour, for drawing things that aren't part of the model, such as particles
+        """
+        index = self.palette_indices.get(colour)
+        if index is None:
+            fb = self.fb
+            nearest = -1
+            for i in range(256):
+                entry = fb.swap_colour_bytes(fb.palette[i])
+                r = (entry >> 11) - (colour >> 11)
+                g = ((entry >> 5) & 0x3f) - ((colour >> 5) & 0x3f)
+                b = (entry & 0x1f) - (colour & 0x1f)
+                distance = r * r + g * g + b * b
+                if nearest < 0 or distance < nearest:
+                    nearest = distance
+                    index = i
+            self.palette_indices[colour] = index
+        return index
+
+    def screen_ray(self, x, y):
+        """
+        Returns the ray from the camera through the middle of the given pixel of the display, as an array
+        of the x, y, z of its origin and of its normalised direction in world space, and the distance along
+        it to the far clipping plane, see BVH.ray()
+        """
+        # Undo the mapping from normalised device coordinates to the screen, then the projection, which for
+        # a point in the direction x, y, -1 in camera coordinates gives x and y scaled by the first two
+        # diagonal entries of the projection matrix
+        m_proj = self.m_proj
+        ndc_x = (x + 0.5) / self.fb.width * 2 - 1
+        ndc_y = 1 - (y + 0.5) / self.fb.height * 2
+        direction = array('f', [ndc_x / m_proj[0], ndc_y / m_proj[5], -1])
+
+        # The far clipping plane is far along the camera's z axis, and so this far along the direction
+        # before it is normalised, as the projection matrix's z scale and offset give it
+        far = m_proj[14] / (m_proj[10] + 1) * v_magnitude(direction)
+        v_normalise(direction)
+
+        # The view matrix only rotates and translates, so the transpose of its rotation turns the direction
+        # from camera coordinates back to world coordinates, and the camera's position is where its
+        # translation is undone
+        m_view = self.camera.view_matrix()
+        ray = array('f', [0, 0, 0, 0, 0, 0, far])
+        for i in range(3):
+            row = m_view[i * 4:i * 4 + 3]
+            ray[i] = -(m_view[12] * row[0] + m_view[13] * row[1] + m_view[14] * row[2])
+            ray[i + 3] = v_dot(direction, row)
+        return ray
+
+    def pick(self, x, y):
+        """
+        Returns the index of the model's face that is drawn at the given pixel of the display and its
+        distance from the camera, or None if the model isn't drawn there
+        """
+        mesh = self.mesh
+        ray = self.screen_ray(x, y)
+        face = mesh.bvh.ray(mesh.inverse_matrix(), ray)
+        if face < 0:
+            return None
+        return face, ray[6]
+
     def render_background(self):
         fb = self.fb
 
         # Just clear the framebuffer by filling it with a solid colour
-        fb.rect(0, 0, fb.width, fb.height, BLACK, True)
-
-        # Show some instructions on screen
-        fb.text("A = RENDER MODE", 0, 0, WHITE)
-        fb.text("B = NEXT OBJECT", 0, 10, WHITE)
-        fb.text("JOY = ROTATE", 0, 20, WHITE)
+        fb.clear(BLACK)
 
     def render_scene(self, render_mode):
+        self.build_display_list(render_mode, self.display_list)
+        self.draw_display_list(self.display_list)
+
+    def build_display_list(self, render_mode, display_list):
+        """
+        Works out what to draw for the current frame, and writes the triangles to draw into the given
+        display list
+        """
         fb = self.fb
 
         # Cached references to frequently accessed mesh properties
         mesh = self.mesh
         faces = mesh.faces
         verts = mesh.vertices_trans
-        norms = mesh.normals_trans
+        norms = mesh.normals
+        plane_dists = mesh.plane_dists
         depth_map = mesh.depth_map
-
-        # Transform all vertices to their positions in the world by multiplying by the model
-        # transformation matrix, which is specific to the mesh being rendered (create world
-        # coordinates)
-        # Note that translating doesn't mean anything for vectors, so normals are rotated only,
-        # and vertices are both rotated and translated
-        m_model = Renderer.identity_matrix()
-        m_rotate(m_model, mesh.orientation)
-        v_multiply_batch(mesh.normals, m_model, norms)
-        m_translate(m_model, mesh.position)
-        v_multiply_batch(mesh.vertices, m_model, verts)
+        camera = self.camera
+        camera_pos = camera.position
+        m_view = camera.view_matrix()
+
+        # The model transformation matrix is specific to the mesh being rendered, it is used to
+        # transform vertices to their positions in the world (create world coordinates); it is worked out
+        # from the mesh's orientation and position when the rigid bodies are updated
+        m_model = mesh.model_matrix
+
+        # Rather than transform every face normal into the world, transform the camera position and
+        # the light vector into the mesh's object space, where they can be compared directly against
+        # the untransformed normals; the inverse of the model matrix undoes the translation and then
+        # rotates by the conjugate of the orientation quaternion
+        # Note that translating doesn't mean anything for vectors, so the light vector is rotated only
+        m_inverse = self.m_inverse
+        mesh.inverse_rotation(m_inverse, self.q_inverse)
+        light = self.light_obj
+        v_multiply(self.v_light, m_inverse, light)
+        camera_obj = self.camera_obj
+        v_subtract(camera_pos, mesh.position, camera_obj)
+        v_multiply(camera_obj, m_inverse)
+        cull_back_faces = render_mode >= MODE_WIREFRAME_BACK_FACE_CULLING
+        depth_sort = render_mode >= MODE_SOLID
+
+        # Bring the frustum planes into the mesh's object space, so we can test the mesh's bounding
+        # spheres against them without transforming any of its vertices; if the whole mesh is outside
+        # the frustum then there is nothing to do
+        planes = camera.frustum_planes(m_model)
+        display_list.mode = render_mode
+        display_list.count = 0
+        scale = self.scale
+        display_list.scale = scale
+        if sphere_outside(planes, mesh.bounds):
+            return
+
+        # Transform all vertices to their positions in the world, the point cloud and wireframe modes
+        # don't need world positions because they don't sort anything, see build_line_list()
+        if depth_sort:
+            v_multiply_batch(mesh.vertices, m_model, verts)
 
         # Pre-allocated space for intermediate calculations to minimise object instantiations,
         # which really helps with performance sensitive applications like this
-        camera = array('f', [0, 0, 0])
-        centre = array('f', [0, 0, 0])
-        rgb = array('f', [0, 0, 0])
-        coords = array('h', [0] * 6)
-        face_verts = [None, None, None]
-
-        # Generate a list of faces for rendering
+        centre = self.centre
+        rgb = self.rgb
+        face_verts = self.face_verts
+
+        # A mesh with a BSP tree gives the faces that face the camera straight into the depth map in order
+        # from back to front, which takes the place of both culling back faces and sorting them; all of the
+        # faces are walked, rather than skipping clusters outside the frustum, but walking them natively is
+        # quicker than working out their depths
         num_faces = 0
-        for face_index in range(len(faces)):
-            indices, norm_index, _ = faces[face_index]
-
-            # Calculate the point in the centre of the face
-            face_verts[0] = verts[indices[0]]
-            face_verts[1] = verts[indices[1]]
-            face_verts[2] = verts[indices[2]]
-            v_average(face_verts, centre)
-
-            # Calculate the the direction to the camera from the centre of the face
-            v_subtract(self.v_campos, centre, camera)
-            v_normalise(camera)
-
-            # Now we use the dot product to determine if the front of the face is pointing at the
-            # camera; if the angle between the normal vector and the camera vector is greater than
-            # 90 degrees then we are seeing the back of the face, and if we are culling back faces
-            # then we can avoid rendering it
-            dot = v_dot(norms[norm_index], camera)
-            if (dot < 0 and render_mode >= MODE_WIREFRAME_BACK_FACE_CULLING):
+        bsp_order = depth_sort and mesh.bsp is not None
+        if bsp_order:
+            sort_t = time.ticks_us()
+            num_faces = bsp_traverse(mesh.bsp, mesh.sections['normals'], plane_dists, camera_obj, depth_map)
+            self.sort_t = time.ticks_diff(time.ticks_us(), sort_t)
+
+        # Generate a list of faces for rendering, skipping any clusters of faces that are entirely
+        # outside the frustum; only the modes that cull back faces need to know which faces can be seen
+        for cluster_faces, sphere in mesh.clusters if cull_back_faces and not bsp_order else ():
+            if sphere_outside(planes, sphere):
                 continue
 
-            # Record the face for rendering along with its average depth from the camera, the face's
-            # depth is the z component of the centre point transformed by the camera view matrix
-            v_multiply(centre, self.m_view)
-            depth_map[num_faces * 2] = face_index
-            depth_map[num_faces * 2 + 1] = centre[2]
-            num_faces += 1
+            for face_index in cluster_faces:
+                norm_index = faces[face_index][1]
 
-        # A painter's algorithm; use the face's average depth value to order them from back to front,
-        # this ensures far away faces are not drawn on top of near faces
-        z_sort(depth_map, num_faces)
+                # Now we use the dot product to determine if the front of the face is pointing at the
+                # camera; projecting the camera position onto the normal gives its distance along the
+                # normal, and if that is less than the distance of the face's own plane then the camera
+                # is behind the face and we are seeing the back of it, and if we are culling back faces
+                # then we can avoid rendering it
+                # Only the sign of the result matters so there is no need to normalise anything
+                if cull_back_faces and v_dot(norms[norm_index], camera_obj) < plane_dists[face_index]:
+                    continue
 
-        # Since faces can share vertices, and matrix multiplication is expensive, let's not project
-        # a vertex more than once, we'll just keep a list of vertices that we've already projected
-        projected_verts = [False] * len(mesh.vertices)
+                # Record the face for rendering
+                depth_map[num_faces * 2] = face_index
+                num_faces += 1
 
-        # Render faces
-        m_view = self.m_view
+        if not depth_sort:
+            self.build_line_list(render_mode, display_list, mesh, m_model, num_faces)
+            return
+
+        # A painter's algorithm; use the face's average depth value to order them from back to front,
+        # this ensures far away faces are not drawn on top of near faces; the face's depth is the z
+        # component of the point in the centre of the face transformed by the camera view matrix
+        # None of the faces of a convex mesh that face the camera can be in front of each other, so they
+        # can be drawn in any order and there is no need to sort them, except to time how long sorting
+        # would have taken, once after loading the mesh
+        if not bsp_order and (not mesh.convex or self.sort_sample):
+            sort_t = time.ticks_us()
+            for i in range(0, num_faces * 2, 2):
+                indices = faces[int(depth_map[i])][0]
+                face_verts[0] = verts[indices[0]]
+                face_verts[1] = verts[indices[1]]
+                face_verts[2] = verts[indices[2]]
+                v_average(face_verts, centre)
+                v_multiply(centre, m_view)
+                depth_map[i + 1] = centre[2]
+            z_sort(depth_map, num_faces)
+            self.sort_t = time.ticks_diff(time.ticks_us(), sort_t)
+            self.sort_sample = False
+
+        # Since faces can share vertices, and matrix multiplication is expensive, let's not transform
+        # a vertex more than once, we'll just keep a list of vertices that we've already transformed
+        transformed_verts = mesh.vertices_done
+        for i in range(len(transformed_verts)):
+            transformed_verts[i] = 0
+
+        # Make sure there is room in the display list for every face, which only allocates if the mesh
+        # has more faces than any mesh we've rendered before
+        display_list.stride = 6
+        display_list.reserve(len(faces))
+        colours = display_list.colours
+        count = 0
+
+        # Add faces to the display list
         m_proj = self.m_proj
+        width = (fb.width + scale - 1) // scale
+        height = fb.height // scale
+        indexed = fb.indexed
+        material_colours = self.material_colours
+        material_ramps = self.material_ramps
+        shade_scale = self.shade_levels - 1
         for i in range(0, num_faces * 2, 2):
             face_index = int(depth_map[i])
             indices, norm_index, col_index = faces[face_index]
 
-            visible = False
-
-            # Let's go ahead and project the face's vertices
+            # Transform the face's vertices from world coordinates into camera coordinates by
+            # multiplying by the camera view matrix, allowing it be viewed from the camera's point of
+            # view, but only if we've not already done so
             for j in range(3):
                 index = indices[j]
                 vertex = verts[index]
-
-                # Only project a vertex if we've not already done so
-                if not projected_verts[index]:
-                    projected_verts[index] = True
-
-                    # Transform the world coorinates into camera coordinates by multiplying by the
-                    # camera view matrix, allowing it be viewed from the camera's point of view
+                if not transformed_verts[index]:
+                    transformed_verts[index] = 1
                     v_multiply(vertex, m_view)
-
-                    # Project the vertex onto a 2D plane by multiplying by the projection matrix, this
-                    # yields normalised device coords where all points that lie within the viewable
-                    # space defined by the field of view are mapped to between -1.0, 1.0
-                    # The projection matrix multiplication also performs the perspective division,
-                    # which makes more distant points appear further away by making them closer together
-                    # on the x and y axes
-                    v_multiply(vertex, m_proj)
-
-                # If a face's projected vertices all lie outside the viewable space (x or y is more
-                # than 1 or less then -1) then we can cull it because it will not be seen; if at least
-                # one vertex can be seen, we'll render the partial face
-                if vertex[0] > -1 and vertex[0] < 1 and vertex[1] > -1 and vertex[1] < 1:
-                    visible = True
-
                 face_verts[j] = vertex
 
-            # If none of this face's vertices can be seen, continue to the next face
-            if not visible:
-                continue
-
-            # Convert normalised device coordinates (NDCs) to screen coordinates, if an NDC's x and y
-            # components both lie between -1 and 1, it will result in a valid on-screen pixel location
-            # This is implemented in native code for speed reasons, but it just does this:
+            # A clipped face can become several triangles, so grow the display list if it might not
+            # have room for them, which keeps the triangles already in it
+            if count + CLIP_MAX_TRIANGLES > display_list.size:
+                display_list.reserve(display_list.size + len(faces))
+                colours = display_list.colours
+
+            # Project the face onto a 2D plane by multiplying by the projection matrix, which yields
+            # normalised device coords where all points that lie within the viewable space defined by
+            # the field of view are mapped to between -1.0, 1.0, and convert them to screen coordinates
+            # The projection matrix multiplication also performs the perspective division, which
+            # makes more distant points appear further away by making them closer together on the x
+            # and y axes
+            # Before the perspective division, the face is clipped so that no part of it behind the
+            # camera or far off the screen is drawn, so it may become a fan of several triangles, or
+            # nothing at all if none of it can be seen
+            # This is implemented in native code for speed reasons, but screen coordinates are just:
             #        x = (v[0] + 1) * 0.5 * width
             #        y = (1 - (v[1] + 1) * 0.5) * height
             # Obviously the y axis here is inverted because screens tend to have the origin 0,0 at the
             # top left and increases towards the bottom
-            v_ndc_to_screen(face_verts, coords, fb.width, fb.height)
+            n = v_clip_to_screen(face_verts, m_proj, display_list.coords, count, width, height, GUARD_BAND)
+            if not n:
+                continue
 
             colour = WHITE
             if render_mode > MODE_POINT_CLOUD and render_mode < MODE_SOLID_SHADED:
                 # Solid, unshaded colour
-                v_scale(mesh.colours[col_index], 1, rgb)
-                colour = color565(int(rgb[0]), int(rgb[1]), int(rgb[2]))
+                if indexed:
+                    colour = material_colours[col_index]
+                else:
+                    v_scale(mesh.colours[col_index], 1, rgb)
+                    colour = color565(int(rgb[0]), int(rgb[1]), int(rgb[2]))
             elif render_mode >= MODE_SOLID_SHADED:
                 # Scale the color by the angle of incidence of the light vector so a face appears
                 # more brightly lit the closer to orthogonal it is, but clamp to a minimum value
                 # so unlit faces are not totally invisible, simulating a bit of ambient light
-                dot = v_dot(norms[norm_index], self.v_light)
-                v_scale(mesh.colours[col_index], -dot, rgb)
-                colour = color565(max(int(rgb[0]), 8), max(int(rgb[1]), 8), max(int(rgb[2]), 8))
-
-            # Draw to the framebuffer using screen coordinates
-            if render_mode == MODE_POINT_CLOUD:
-                fb.points(coords, colour)
-            elif render_mode == MODE_WIREFRAME_FULL or render_mode == MODE_WIREFRAME_BACK_FACE_CULLING:
-                fb.polygon(coords, colour)
-            elif render_mode >= MODE_SOLID:
-                fb.polygon(coords, colour, True)
+                dot = v_dot(norms[norm_index], light)
+                if indexed:
+                    # The nearest entry of the material's shading ramp, see assign_palette()
+                    level = int(-dot * shade_scale + 0.5)
+                    colour = material_ramps[col_index] + (level if level > 0 else 0)
+                else:
+                    v_scale(mesh.colours[col_index], -dot, rgb)
+                    colour = color565(max(int(rgb[0]), 8), max(int(rgb[1]), 8), max(int(rgb[2]), 8))
+            for j in range(count, count + n):
+                colours[j] = colour
+            count += n
+
+        display_list.count = count
+
+    def build_particles(self, display_list, delta_t):
+        """
+        Moves the particles of every particle system on by the given number of seconds, and writes where
+        they are on the screen into the given display list, which draws them over everything else
+        """
+        fb = self.fb
+        scale = display_list.scale
+        width = (fb.width + scale - 1) // scale
+        height = fb.height // scale
+        self.camera.view_matrix()
+        m_view_proj = self.camera.m_view_proj
+        for i in range(len(self.particles)):
+            system = self.particles[i]
+            batch = display_list.particle_batch(i, system.capacity)
+            batch[1] = system.update(delta_t, m_view_proj, batch[0], width, height)
+            batch[2] = self.palette_index(system.colour) if fb.indexed else system.colour
+            batch[3] = system.size
+        del display_list.particles[len(self.particles):]
+
+    def build_line_list(self, render_mode, display_list, mesh, m_model, num_faces):
+        """
+        Works out what to draw for the point cloud and wireframe modes, where each of the mesh's unique
+        vertices or edges is drawn once rather than once for every face it belongs to, and writes the
+        points or lines to draw into the given display list
+
+        Nothing is filled in these modes, so nothing needs to be sorted; when culling back faces, the
+        first num_faces entries of the mesh's depth map are the faces that can be seen; the mesh is passed
+        in rather than read from self.mesh, so that it is the same mesh the depth map was filled in for
+        """
+        fb = self.fb
+        verts = mesh.vertices_trans
+        screen = mesh.screen_coords
+
+        # Transform every vertex straight to normalised device coordinates in one go, and then to screen
+        # coordinates in another, which is much quicker than transforming them one at a time as they
+        # are needed, even though some of them won't be
+        m_mvp = self.m_mvp
+        for i in range(16):
+            m_mvp[i] = m_model[i]
+        m_multiply(m_mvp, self.camera.m_view_proj)
+        v_multiply_batch(mesh.vertices, m_mvp, verts)
+        scale = display_list.scale
+        v_ndc_to_screen(verts, screen, (fb.width + scale - 1) // scale, fb.height // scale)
+
+        count = 0
+        if render_mode == MODE_POINT_CLOUD:
+            points = mesh.points
+            display_list.stride = 2
+            display_list.reserve(len(points), 2)
+            coords = display_list.coords
+            colours = display_list.colours
+            for index in points:
+                # Skip points that lie outside the viewable space, including behind the camera, where
+                # the perspective division leaves z greater than 1
+                vertex = verts[index]
+                if vertex[0] > -1 and vertex[0] < 1 and vertex[1] > -1 and vertex[1] < 1 and vertex[2] >= 0 and vertex[2] <= 1:
+                    coords[count * 2] = screen[index * 2]
+                    coords[count * 2 + 1] = screen[index * 2 + 1]
+                    colours[count] = WHITE
+                    count += 1
+            display_list.count = count
+            return
+
+        # An edge can be seen if either of the faces either side of it can be seen
+        visible = None
+        if render_mode == MODE_WIREFRAME_BACK_FACE_CULLING:
+            visible = mesh.face_visible
+            for i in range(len(visible)):
+                visible[i] = 0
+            depth_map = mesh.depth_map
+            for i in range(0, num_faces * 2, 2):
+                visible[int(depth_map[i])] = 1
+
+        # Edges are drawn in the solid, unshaded colour of a face they belong to
+        face_colours = self.material_colours
+        col_indices = mesh.col_indices
+
+        edges = mesh.edges
+        edge_faces = mesh.edge_faces
+        display_list.stride = 4
+        display_list.reserve(len(edges) // 2, 4)
+        coords = display_list.coords
+        colours = display_list.colours
+        for e in range(0, len(edges), 2):
+            face = edge_faces[e]
+            if visible is not None and not visible[face]:
+                face = edge_faces[e + 1]
+                if face == NO_FACE or not visible[face]:
+                    continue
+
+            # If neither end of the edge lies within the viewable space, it will not be seen, and if
+            # either end is behind the camera or beyond the far plane then its screen coordinates are
+            # meaningless, so the edge is skipped rather than drawn wildly wrong
+            a = edges[e]
+            b = edges[e + 1]
+            va = verts[a]
+            vb = verts[b]
+            if va[2] < 0 or va[2] > 1 or vb[2] < 0 or vb[2] > 1:
+                continue
+            if not (va[0] > -1 and va[0] < 1 and va[1] > -1 and va[1] < 1) and not (
+                    vb[0] > -1 and vb[0] < 1 and vb[1] > -1 and vb[1] < 1):
+                continue
+
+            k = count * 4
+            coords[k] = screen[a * 2]
+            coords[k + 1] = screen[a * 2 + 1]
+            coords[k + 2] = screen[b * 2]
+            coords[k + 3] = screen[b * 2 + 1]
+            colours[count] = face_colours[col_indices[face]]
+            count += 1
+        display_list.count = count
+
+    def draw_display_list(self, display_list, indices=None, start=0, count=-1):
+        """
+        Draws the primitives in the given display list to the framebuffer, or if a list of indices is given,
+        just the given number of triangles with the indices starting at the given position in the list
+
+        Points and lines are all drawn in a single native call, which clips them to the framebuffer, so
+        drawing them all is quicker than drawing the ones with the given indices one at a time, and so are
+        the particles of each particle system
+        """
+        fb = self.fb
+        render_mode = display_list.mode
+        colours = display_list.colours
+
+        # Draw to the framebuffer using screen coordinates
+        if render_mode == MODE_POINT_CLOUD:
+            fb.pixels(display_list.coords, colours, display_list.count)
+        elif render_mode == MODE_WIREFRAME_FULL or render_mode == MODE_WIREFRAME_BACK_FACE_CULLING:
+            fb.lines(display_list.coords, colours, display_list.count)
+        else:
+            triangles = display_list.triangles
+            if count < 0:
+                count = display_list.count
+            for n in range(count):
+                i = indices[start + n] if indices is not None else n
+                fb.polygon(triangles[i], colours[i], True)
+
+        # Particles are drawn over everything else
+        for coords, num_particles, colour, size in display_list.particles:
+            fb.particles(coords, num_particles, colour, size)
 
     def render_foreground(self):
-        self.fb.text("{0:2d} fps".format(self.fps), 0, self.fb.height - 10, WHITE)
+        fb = self.fb
+
+        # Show some instructions on screen, these are drawn over the scene so that they are always drawn
+        # at the resolution of the display
+        fb.text("A = RENDER MODE", 0, 0, WHITE)
+        fb.text("B = NEXT OBJECT", 0, 10, WHITE)
+        fb.text("JOY = ROTATE", 0, 20, WHITE)
+        fb.text("{0:2d} fps".format(self.fps), 0, fb.height - 10, WHITE)
+        if fb.scale > 1:
+            fb.text("1/{}".format(fb.scale), fb.width - 24, fb.height - 10, WHITE)
 
 
 # Set the entrypoint for the app launcher
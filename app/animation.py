@@ -0,0 +1,107 @@
+from array import array
+from micropython import const
+import struct
+from .native import *
+
+# Marker at the start of every vertex animation file
+MAGIC = b'T3DA'
+VERSION = const(1)
+
+# File header, starting with the magic: format version, number of vertices, number of keyframes and
+# keyframes per second, then the centre x, y, z and radius of a sphere that encloses the mesh in every
+# keyframe; the keyframes follow the header, each one an x, y, z little-endian float per vertex
+HEADER = '<4sHHHHffff'
+HEADER_SIZE = const(28)
+
+# How many keyframes are kept in memory at once: the two being interpolated between and the next one,
+# which is read ahead of time so that it is ready when we reach it
+NUM_BUFFERS = const(3)
+
+
+class VertexAnimation:
+    """
+    Plays back a vertex animation, where the position of every vertex of a mesh is given for each of a
+    sequence of keyframes, interpolating between keyframes so that the animation is smooth whatever the
+    frame rate
+
+    Animations can be far too big to fit in memory, so keyframes are streamed from the file as they are
+    needed; only a few keyframes are held at once, in buffers that are allocated up front and read into
+    directly, so playing an animation allocates nothing
+    """
+
+    def __init__(self, filename, interpolate=True, offset=0):
+        # The animation starts at the given offset into the file, so that it can be a section of a bundle
+        self.offset = offset
+        self.file = open(filename, 'rb')
+        self.file.seek(offset)
+        magic, version, num_vertices, num_frames, fps, x, y, z, r = struct.unpack(
+            HEADER, self.file.read(HEADER_SIZE))
+        if magic != MAGIC or version != VERSION:
+            self.file.close()
+            raise ValueError("not a vertex animation: " + filename)
+        self.num_vertices = num_vertices
+        self.num_frames = num_frames
+        self.fps = fps
+        self.interpolate = interpolate
+
+        # Sphere that encloses the mesh in every keyframe, so it can be used for culling whichever
+        # keyframe is showing
+        self.bounds = array('f', [x, y, z, r])
+
+        # Buffers for keyframes, and which keyframe each one holds
+        self.frame_size = num_vertices * 12
+        self.buffers = [array('f', [0] * (num_vertices * 3)) for _ in range(NUM_BUFFERS)]
+        self.loaded = [-1] * NUM_BUFFERS
+
+        # Current position in the animation in keyframes, and the keyframes we are between
+        self.time = 0
+        self.frame1 = None
+        self.frame2 = None
+        self._seek(0)
+
+    def _buffer(self, frame, keep1, keep2):
+        # Returns the buffer holding the given keyframe, reading it into a buffer that doesn't hold either
+        # of the keyframes we need to keep if it isn't already loaded
+        loaded = self.loaded
+        for i in range(NUM_BUFFERS):
+            if loaded[i] == frame:
+                return self.buffers[i]
+        for i in range(NUM_BUFFERS):
+            if loaded[i] != keep1 and loaded[i] != keep2:
+                f = self.file
+                f.seek(self.offset + HEADER_SIZE + frame * self.frame_size)
+                if f.readinto(self.buffers[i]) != self.frame_size:
+                    raise ValueError("vertex animation is truncated")
+                loaded[i] = frame
+                return self.buffers[i]
+
+    def _seek(self, frame):
+        # Make sure the keyframe and the one after it are loaded, then read ahead the one after that,
+        # this is only done when we move on to another keyframe, so at most one keyframe is read per
+        # frame of playback unless frames are being skipped
+        num_frames = self.num_frames
+        frame2 = (frame + 1) % num_frames
+        self.frame1 = self._buffer(frame, frame, frame2)
+        self.frame2 = self._buffer(frame2, frame, frame2)
+        self._buffer((frame + 2) % num_frames, frame, frame2)
+
+    def update(self, delta_t):
+        """
+        Moves the animation on by the given number of seconds, looping back to the start when the end is
+        reached
+        """
+        frame = int(self.time)
+        self.time = (self.time + delta_t * self.fps) % self.num_frames
+        if int(self.time) != frame:
+            self._seek(int(self.time))
+
+    def apply(self, vertices):
+        """
+        Writes the positions of the vertices at the current point in the animation into the given list of
+        vertices
+        """
+        factor = self.time - int(self.time) if self.interpolate else 0
+        v_lerp_batch(self.frame1, self.frame2, factor, vertices)
+
+    def close(self):
+        self.file.close()
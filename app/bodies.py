@@ -0,0 +1,71 @@
+from array import array
+from micropython import const
+from .native import *
+
+# Number of floats each body takes up in the state array: x, y, z of its position, x, y, z of its velocity,
+# w, x, y, z of its orientation, and x, y, z of its angular velocity, see b_update()
+BODY_SIZE = const(13)
+
+
+class RigidBodies:
+    """
+    The positions and orientations of a number of moving objects, along with their linear and angular
+    velocities, kept together in one array that is allocated up front, so that every object is moved on
+    and has its model matrix worked out with a single native call each frame, instead of several calls
+    for each object
+
+    A body's angular velocity is the axis it spins around, scaled by the number of degrees a second it
+    spins, in the same way as a mesh's; views into the state of each body are handed out so that it can
+    be moved and steered by writing to them, see Mesh.attach()
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.state = array('f', [0] * (capacity * BODY_SIZE))
+        self.matrices = array('f', [0] * (capacity * 16))
+        self.count = 0
+
+    def add(self, position=(0, 0, 0), velocity=(0, 0, 0), orientation=(1, 0, 0, 0), angular=(0, 0, 0)):
+        """
+        Adds a body with the given state, and returns its index
+        """
+        if self.count == self.capacity:
+            raise ValueError("No room for another body")
+        index = self.count
+        state = self.state
+        start = index * BODY_SIZE
+        for values, offset in ((position, 0), (velocity, 3), (orientation, 6), (angular, 10)):
+            for i in range(len(values)):
+                state[start + offset + i] = values[i]
+        self.count += 1
+
+        # Work out the new body's model matrix without moving it, so it is ready before the next update
+        b_update(memoryview(state)[start:], 1, 0, self.matrix(index))
+        return index
+
+    def clear(self):
+        """
+        Removes every body
+        """
+        self.count = 0
+
+    def body(self, index):
+        """
+        Returns views of the position, velocity, orientation and angular velocity of the body with the
+        given index, which change the body's state when written to
+        """
+        view = memoryview(self.state)[index * BODY_SIZE:(index + 1) * BODY_SIZE]
+        return view[0:3], view[3:6], view[6:10], view[10:13]
+
+    def matrix(self, index):
+        """
+        Returns a view of the model matrix of the body with the given index, as of the last update
+        """
+        return memoryview(self.matrices)[index * 16:(index + 1) * 16]
+
+    def update(self, delta_t):
+        """
+        Moves every body on by the given number of seconds, and works out their model matrices; with a
+        delta_t of zero, this just works out the model matrices of bodies whose state has been written to
+        """
+        b_update(self.state, self.count, delta_t, self.matrices)
@@ -1,4 +1,11 @@
-from framebuf import FrameBuffer, RGB565
+from array import array
+from framebuf import FrameBuffer, GS8, RGB565
+from micropython import const
+from .native import *
+
+# Number of rows of an indexed framebuffer that are expanded to RGB565 and sent to the display at a time,
+# or the nearest number of rows below this that divides the height of the framebuffer
+CHUNK_ROWS = const(16)
 
 
 class BufferedDisplay(FrameBuffer):
@@ -8,18 +15,64 @@ class BufferedDisplay(FrameBuffer):
 
     Also wraps drawing calls where it provides extra convenience and provides some extra drawing calls not
     implemented by the underlying framebuffer or display
+
+    If a tile height is given, the framebuffer only covers a horizontal strip (a tile) of the display at a
+    time, which needs much less memory; the scene must then be drawn once for each tile, with tile_y set
+    to the position of the tile on the display, and drawing calls made through this class take screen
+    coordinates and are offset to draw in the right place in the tile
+
+    If indexed is True, the framebuffer holds an 8-bit index into a palette of 256 colours for each pixel
+    instead of an RGB565 colour, which halves the memory it needs and the number of bytes that drawing and
+    clearing it touch; colours given to drawing calls are then palette indices, and the framebuffer is
+    expanded to RGB565 a few rows at a time as it is sent to the display
+
+    The scene can be drawn at half the resolution of the display when it is too slow to draw at full
+    resolution, see set_scale(); scene drawing calls then take coordinates at the lower resolution, and
+    the framebuffer must be scaled up with upscale() before the HUD is drawn over it and it is blitted,
+    so that text is always drawn at full resolution
     """
 
-    def __init__(self, display):
+    def __init__(self, display, tile_height=None, indexed=False):
         self.display = display
 
         # Cache screen dimensions
         self.width = display.width()
         self.height = display.height()
 
-        # Create a framebuffer the same size as the display
-        self.buffer = bytearray(2 * self.width * self.height)
-        super().__init__(self.buffer, self.width, self.height, RGB565)
+        # Create a framebuffer the same size as the display, or the size of one tile
+        self.tile_height = tile_height or self.height
+        if self.height % self.tile_height:
+            raise ValueError("Tile height must divide the display height")
+        self.num_tiles = self.height // self.tile_height
+        self.tile_y = 0
+        self.indexed = indexed
+        if indexed:
+            self.buffer = bytearray(self.width * self.tile_height)
+            super().__init__(self.buffer, self.width, self.tile_height, GS8)
+
+            # Palette colours are kept in the framebuffer's byte order, so they can be copied straight into
+            # the buffer of RGB565 pixels that is sent to the display
+            self.palette = array('H', [0] * 256)
+            self.chunk_rows = CHUNK_ROWS
+            while self.tile_height % self.chunk_rows:
+                self.chunk_rows -= 1
+            self.chunk = bytearray(2 * self.width * self.chunk_rows)
+        else:
+            self.buffer = bytearray(2 * self.width * self.tile_height)
+            super().__init__(self.buffer, self.width, self.tile_height, RGB565)
+            self.palette = None
+            self.chunk = None
+
+        # How many display pixels across and down each pixel of the scene covers, the size of the scene
+        # in its own pixels, and the framebuffer and buffer that the scene is drawn into; at half
+        # resolution that is a smaller framebuffer over the start of the same buffer, which is created
+        # the first time it is needed
+        self.scale = 1
+        self.render_width = self.width
+        self.render_height = self.tile_height
+        self.target = self
+        self.target_buffer = self.buffer
+        self.half = None
 
     @micropython.native
     def swap_colour_bytes(self, colour):
@@ -31,13 +84,52 @@ class BufferedDisplay(FrameBuffer):
         b2 = (colour >> 8) & 0xff
         return (b1<<8) | b2
 
+    def set_scale(self, scale):
+        """
+        Sets whether the scene is drawn at full resolution, when scale is 1, or half resolution, when
+        scale is 2
+        """
+        if scale == self.scale:
+            return
+        if scale == 1:
+            self.target = self
+            self.target_buffer = self.buffer
+        elif scale == 2:
+            if self.tile_height % 2:
+                raise ValueError("Tile height must be even to draw at half resolution")
+            if self.half is None:
+                width = (self.width + 1) // 2
+                height = self.tile_height // 2
+                view = memoryview(self.buffer)[:width * height * (1 if self.indexed else 2)]
+                self.half = (FrameBuffer(view, width, height, GS8 if self.indexed else RGB565), view)
+            self.target, self.target_buffer = self.half
+        else:
+            raise ValueError("Scale must be 1 or 2")
+        self.scale = scale
+        self.render_width = (self.width + scale - 1) // scale
+        self.render_height = self.tile_height // scale
+
+    def upscale(self):
+        """
+        Scales the scene up to the resolution of the display, if it was drawn at a lower resolution
+        """
+        if self.scale == 2:
+            fb_upscale(self.buffer, self.width, self.tile_height)
+
+    def set_palette(self, index, colour):
+        """
+        Sets the RGB565 colour of the given palette index of an indexed framebuffer
+        """
+        self.palette[index] = self.swap_colour_bytes(colour)
+
     def chequerboard(self, size, dark_colour, light_colour):
         """
         Draws a chequerboard pattern to the framebuffer with squares of the given size and alternating
         colours
         """
-        dark_colour = self.swap_colour_bytes(dark_colour)
-        light_colour = self.swap_colour_bytes(light_colour)
+        if not self.indexed:
+            dark_colour = self.swap_colour_bytes(dark_colour)
+            light_colour = self.swap_colour_bytes(light_colour)
         x = 0
         while x < self.width:
             y = 0
@@ -54,20 +146,73 @@ class BufferedDisplay(FrameBuffer):
         """
         Draw the given list of points to the framebuffer
         """
-        colour = self.swap_colour_bytes(colour)
-        self.pixel(points[0], points[1], colour)
-        self.pixel(points[2], points[3], colour)
-        self.pixel(points[4], points[5], colour)
+        if not self.indexed:
+            colour = self.swap_colour_bytes(colour)
+        target = self.target
+        y = self.tile_y // self.scale
+        target.pixel(points[0], points[1] - y, colour)
+        target.pixel(points[2], points[3] - y, colour)
+        target.pixel(points[4], points[5] - y, colour)
 
     def polygon(self, points, colour, fill=False):
         """
         Draw the given list of points to the framebuffer as a closed, optionally filled, polygon
         """
-        colour = self.swap_colour_bytes(colour)
-        self.poly(0, 0, points, colour, fill)
+        if not self.indexed:
+            colour = self.swap_colour_bytes(colour)
+        self.target.poly(0, -(self.tile_y // self.scale), points, colour, fill)
+
+    def lines(self, coords, colours, count):
+        """
+        Draw the given number of lines to the framebuffer in a single native call, coords has four values
+        for each line and colours has one for each line
+        """
+        fb_lines(self.target_buffer, self.render_width, self.render_height, self.tile_y // self.scale,
+                 coords, colours, count)
+
+    def pixels(self, coords, colours, count):
+        """
+        Draw the given number of points to the framebuffer in a single native call, coords has two values
+        for each point and colours has one for each point
+        """
+        fb_points(self.target_buffer, self.render_width, self.render_height, self.tile_y // self.scale,
+                  coords, colours, count)
+
+    def particles(self, coords, count, colour, size=1):
+        """
+        Draw the given number of particles to the framebuffer in a single native call, as squares of the
+        given size in the given colour, coords has two values for each particle
+        """
+        fb_particles(self.target_buffer, self.render_width, self.render_height, self.tile_y // self.scale,
+                     coords, count, colour, size)
+
+    def clear(self, colour):
+        """
+        Fill the part of the framebuffer that the scene is drawn into with the given colour
+        """
+        self.target.fill(colour)
+
+    def rect(self, x, y, w, h, colour, fill=False):
+        super().rect(x, y - self.tile_y, w, h, colour, fill)
+
+    def text(self, s, x, y, colour):
+        # Skip text that can't be in the current tile
+        y -= self.tile_y
+        if y > -8 and y < self.tile_height:
+            super().text(s, x, y, colour)
 
     def blit(self):
         """
-        Send the framebuffer to the display
+        Send the framebuffer to the display, at the position of the current tile
         """
-        self.display.blit_buffer(self.buffer, 0, 0, self.width, self.height)
+        if not self.indexed:
+            self.display.blit_buffer(self.buffer, 0, self.tile_y, self.width, self.tile_height)
+            return
+
+        # Expand an indexed framebuffer a chunk of rows at a time, sending each chunk to the display before
+        # expanding the next into the same buffer
+        width = self.width
+        rows = self.chunk_rows
+        for y in range(0, self.tile_height, rows):
+            fb_expand(self.buffer, y * width, self.palette, self.chunk)
+            self.display.blit_buffer(self.chunk, 0, self.tile_y + y, width, rows)
@@ -0,0 +1,101 @@
+from array import array
+from micropython import const
+import struct
+
+# Marker at the start of every bundle
+MAGIC = b'T3DB'
+VERSION = const(1)
+
+# File header, starting with the magic: format version and number of sections, followed by an index
+# entry for each section: its name padded with zeros, the typecode of the array it holds, and where it
+# is in the file and how many bytes long it is; the data of the sections follows the index
+HEADER = '<4sHH'
+HEADER_SIZE = const(8)
+ENTRY = '<23s1sII'
+ENTRY_SIZE = const(32)
+
+# Size in bytes of an item of each type of array a section can hold
+ITEM_SIZES = {'b': 1, 'B': 1, 'h': 2, 'H': 2, 'i': 4, 'I': 4, 'f': 4}
+
+
+class Bundle:
+    """
+    A file of named sections, each the contents of an array, so that everything needed to load a model,
+    or several models, can be read from a single file that is kept open, see tools/pack_bundle.py
+
+    Section names are an entry name and the name of the section within the entry, separated by a slash,
+    such as 'cube.obj/verts'; only the index is read when the bundle is opened, and a section is read by
+    seeking straight to it and reading it into an array, which the caller can provide
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        magic, version, num_sections = struct.unpack(HEADER, self.file.read(HEADER_SIZE))
+        if magic != MAGIC or version != VERSION:
+            self.file.close()
+            raise ValueError("not a bundle: " + filename)
+
+        # Typecode, offset and size of each section by name, and the names of the entries
+        self.sections = {}
+        self.entries = []
+        index = self.file.read(num_sections * ENTRY_SIZE)
+        for i in range(num_sections):
+            name, typecode, offset, size = struct.unpack_from(ENTRY, index, i * ENTRY_SIZE)
+            name = name.rstrip(b'\0').decode()
+            self.sections[name] = (typecode.decode(), offset, size)
+            entry = name[:name.find('/')]
+            if entry not in self.entries:
+                self.entries.append(entry)
+
+    def __contains__(self, name):
+        """
+        Whether the bundle has the given section, or the given entry if the name has no slash
+        """
+        return name in self.sections if '/' in name else name in self.entries
+
+    def _section(self, name):
+        section = self.sections.get(name)
+        if section is None:
+            raise ValueError("bundle has no section " + name)
+        return section
+
+    def offset(self, name):
+        """
+        Returns where the given section starts in the file, for sections that are read some other way
+        """
+        return self._section(name)[1]
+
+    def count(self, name):
+        """
+        Returns the number of items in the given section
+        """
+        typecode, _, size = self._section(name)
+        return size // ITEM_SIZES[typecode]
+
+    def readinto(self, name, buffer):
+        """
+        Reads the given section into the start of the given array, which must have the section's type and
+        room for all of its items, and returns the number of items read
+        """
+        typecode, offset, size = self._section(name)
+        count = size // ITEM_SIZES[typecode]
+        if len(buffer) < count:
+            raise ValueError("buffer is too small for section " + name)
+        f = self.file
+        f.seek(offset)
+        if f.readinto(memoryview(buffer)[:count]) != size:
+            raise ValueError("bundle is truncated")
+        return count
+
+    def read(self, name):
+        """
+        Returns a new array holding the given section
+        """
+        typecode = self._section(name)[0]
+        buffer = array(typecode, [0] * self.count(name))
+        self.readinto(name, buffer)
+        return buffer
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,144 @@
+from array import array
+from micropython import const
+from .native import *
+
+# Most triangles in a leaf node, splitting further costs more in boxes tested than it saves in triangles
+LEAF_SIZE = const(4)
+
+# Child index of a node that has no such child, which must match the definition in module/tidal3d.c
+NO_NODE = const(0xffff)
+
+# Deepest tree the native queries can walk, which must match the definition in module/tidal3d.c; halving
+# the triangles at each node never gets near it, as there can't be more triangles than fit in a short
+MAX_DEPTH = const(32)
+
+
+class BVH:
+    """
+    A bounding volume hierarchy of a mesh's triangles, which answers which face a ray hits first, for
+    picking faces on the screen, and which faces a sphere touches, for finding collisions, by only testing
+    the triangles in boxes that the ray or sphere reaches, see bvh_ray() and bvh_sphere()
+
+    The tree is kept in arrays rather than objects, so that it can be walked natively and packed into a
+    bundle: four shorts for each node, which are the index of its first triangle and its number of
+    triangles for a leaf node, or zero triangles and its two child nodes; six floats for each node, which
+    are the low and high corners of the box around its triangles; and four shorts for each triangle,
+    which are its three vertex indices and the index of the face it was cut from; the mesh's faces are
+    cut into fans of triangles, and each leaf node's triangles are consecutive
+
+    Queries are made in world space and are transformed into the mesh's object space with the inverse of
+    its model matrix, see Mesh.inverse_matrix(), so the tree is built once and holds however the mesh
+    moves, as long as its vertices don't
+    """
+
+    def __init__(self, vertices, nodes, boxes, triangles):
+        # The vertices are the x, y, z of every vertex of the mesh in one array, which the mesh's
+        # vertices are views into
+        self.vertices = vertices
+        self.nodes = nodes
+        self.boxes = boxes
+        self.triangles = triangles
+
+    @staticmethod
+    def build(vertices, vert_indices, bounds=None):
+        """
+        Builds a tree of the triangles of the faces with the given vertex indices, into the given array of
+        vertices; if a bounding sphere is given, the tree is a single leaf with a box around that sphere
+        instead, for vertices that move around inside it, whose triangles are tested one by one
+        """
+        triangles = array('H')
+        for f in range(len(vert_indices)):
+            face = vert_indices[f]
+            for i in range(1, len(face) - 1):
+                triangles.extend((face[0], face[i], face[i + 1], f))
+        num_triangles = len(triangles) // 4
+        if num_triangles > NO_NODE:
+            raise ValueError("too many triangles for a BVH")
+        if bounds is not None:
+            r = bounds[3]
+            boxes = array('f', [bounds[0] - r, bounds[1] - r, bounds[2] - r,
+                                bounds[0] + r, bounds[1] + r, bounds[2] + r])
+            return BVH(vertices, array('H', [0, num_triangles, NO_NODE, NO_NODE]), boxes, triangles)
+
+        # The box and centre of each triangle, which is where the triangles are split at
+        tri_boxes = []
+        centres = []
+        for t in range(0, len(triangles), 4):
+            box = array('f', [0] * 6)
+            for i in range(3):
+                values = [vertices[triangles[t + j] * 3 + i] for j in range(3)]
+                box[i] = min(values)
+                box[i + 3] = max(values)
+            tri_boxes.append(box)
+            centres.append([(box[i] + box[i + 3]) * 0.5 for i in range(3)])
+
+        builder = _Builder(tri_boxes, centres)
+        builder.build(list(range(num_triangles)), 1)
+
+        # Put the triangles in the order of the leaf nodes they ended up in
+        ordered = array('H')
+        for t in builder.order:
+            ordered.extend(triangles[t * 4:t * 4 + 4])
+        return BVH(vertices, builder.nodes, builder.boxes, ordered)
+
+    def ray(self, m_inverse, ray):
+        """
+        Returns the index of the first face hit by the given ray, an array of the x, y, z of its origin and
+        of its normalised direction in world space, and the furthest distance to look, which is changed to
+        the distance of the hit, with the given inverse of the mesh's model matrix; returns -1 if nothing
+        is hit
+        """
+        return bvh_ray(self.nodes, self.boxes, self.triangles, self.vertices, m_inverse, ray)
+
+    def sphere(self, m_inverse, sphere, faces):
+        """
+        Writes the indices of the faces that the given sphere, an array of the x, y, z of its centre in
+        world space and its radius, touches into the given array of shorts, with the given inverse of the
+        mesh's model matrix, and returns how many were written
+        """
+        return bvh_sphere(self.nodes, self.boxes, self.triangles, self.vertices, m_inverse, sphere, faces)
+
+
+class _Builder:
+    # Splits triangles in half along the axis in which their centres are most spread out, like
+    # Mesh._cluster() does, until there are few enough to make a leaf; nodes are added before their
+    # children, so the root is the first node
+
+    def __init__(self, tri_boxes, centres):
+        self.tri_boxes = tri_boxes
+        self.centres = centres
+        self.nodes = array('H')
+        self.boxes = array('f')
+        self.order = []
+
+    def build(self, tris, depth):
+        if depth > MAX_DEPTH:
+            raise ValueError("BVH is too deep")
+        node = len(self.nodes) // 4
+        box = array('f', self.tri_boxes[tris[0]])
+        for t in tris:
+            tri_box = self.tri_boxes[t]
+            for i in range(3):
+                box[i] = min(box[i], tri_box[i])
+                box[i + 3] = max(box[i + 3], tri_box[i + 3])
+        self.boxes.extend(box)
+
+        if len(tris) <= LEAF_SIZE:
+            self.nodes.extend((len(self.order), len(tris), NO_NODE, NO_NODE))
+            self.order.extend(tris)
+            return node
+
+        self.nodes.extend((0, 0, NO_NODE, NO_NODE))
+        centres = self.centres
+        axis = 0
+        spread = -1
+        for i in range(3):
+            values = [centres[t][i] for t in tris]
+            if max(values) - min(values) > spread:
+                spread = max(values) - min(values)
+                axis = i
+        tris.sort(key=lambda t: centres[t][axis])
+        half = len(tris) // 2
+        self.nodes[node * 4 + 2] = self.build(tris[:half], depth + 1)
+        self.nodes[node * 4 + 3] = self.build(tris[half:], depth + 1)
+        return node
@@ -0,0 +1,143 @@
+from array import array
+from math import sqrt
+from .native import *
+
+
+class Camera:
+    """
+    A camera with a position and an orientation in the world, from which the view matrix and the
+    planes of the viewing frustum are derived
+
+    The view matrix and frustum planes are only rebuilt when the camera has moved since they were
+    last needed, and the frustum planes can be transformed into the object space of a mesh, so that
+    whole meshes, or clusters of faces within a mesh, can be tested against the frustum using their
+    untransformed bounding spheres before any of their vertices are transformed
+    """
+
+    def __init__(self, m_proj, position):
+        self.m_proj = m_proj
+
+        # Position and orientation (a quaternion) of the camera in the world
+        self.position = array('f', position)
+        self.orientation = array('f', [1, 0, 0, 0])
+
+        # Pre-allocated space for the view matrix, the combined view and projection matrix, and the
+        # frustum planes in world space and in the object space of the mesh being rendered; each plane
+        # is four consecutive values a, b, c, d such that a point x, y, z is on the inside of the
+        # plane when ax + by + cz + d >= 0
+        self.m_view = array('f', [0] * 16)
+        self.m_view_proj = array('f', [0] * 16)
+        self.planes = array('f', [0] * 24)
+        self.object_planes = array('f', [0] * 24)
+        self.object_plane_views = [memoryview(self.object_planes)[i:i + 4] for i in range(0, 24, 4)]
+        self.conjugate = array('f', [1, 0, 0, 0])
+        self.inverse_pos = array('f', [0, 0, 0])
+
+        # Whether the camera has moved since the view matrix and frustum planes were last built
+        self.changed = True
+
+    def move(self, vector):
+        """
+        Moves the camera by the given 3D vector
+        """
+        v_add(self.position, vector)
+        self.changed = True
+
+    def rotate(self, degrees, axis):
+        """
+        Rotates the camera by the given number of degrees around the given axis
+        """
+        q_rotate(self.orientation, degrees, axis)
+        self.changed = True
+
+    def view_matrix(self):
+        """
+        Returns the view matrix, which transforms world coordinates into camera coordinates
+        """
+        if self.changed:
+            self._build()
+        return self.m_view
+
+    def _build(self):
+        # The view matrix is the inverse of the camera's own transformation, so it undoes the camera's
+        # translation first and then its rotation, by rotating with the conjugate of the orientation
+        orientation = self.orientation
+        conjugate = self.conjugate
+        conjugate[0] = orientation[0]
+        conjugate[1] = -orientation[1]
+        conjugate[2] = -orientation[2]
+        conjugate[3] = -orientation[3]
+        v_scale(self.position, -1, self.inverse_pos)
+
+        m_view = self.m_view
+        for i in range(16):
+            m_view[i] = 1 if i % 5 == 0 else 0
+        m_translate(m_view, self.inverse_pos)
+        m_rotate(m_view, conjugate)
+
+        # Extract the frustum planes from the combined view and projection matrix, a point is inside
+        # the frustum when its clip coordinates satisfy -w <= x <= w, -w <= y <= w and 0 <= z <= w, so
+        # each plane is a sum or difference of the matrix's columns
+        m = self.m_view_proj
+        for i in range(16):
+            m[i] = m_view[i]
+        m_multiply(m, self.m_proj)
+        planes = self.planes
+        for i in range(4):
+            col_x = m[i * 4]
+            col_y = m[i * 4 + 1]
+            col_z = m[i * 4 + 2]
+            col_w = m[i * 4 + 3]
+            planes[i] = col_w + col_x  # Left
+            planes[4 + i] = col_w - col_x  # Right
+            planes[8 + i] = col_w + col_y  # Bottom
+            planes[12 + i] = col_w - col_y  # Top
+            planes[16 + i] = col_z  # Near
+            planes[20 + i] = col_w - col_z  # Far
+
+        # Normalise the planes so that evaluating a plane at a point gives the distance of the point
+        # from the plane, which is what allows testing spheres against them
+        for i in range(0, 24, 4):
+            a = planes[i]
+            b = planes[i + 1]
+            c = planes[i + 2]
+            mag = sqrt(a * a + b * b + c * c)
+            for j in range(i, i + 4):
+                planes[j] /= mag
+
+        self.changed = False
+
+    def frustum_planes(self, m_model):
+        """
+        Returns the frustum planes transformed into the object space of a mesh with the given model
+        matrix, as a list of six 4-element views into pre-allocated space that is overwritten on the
+        next call
+
+        A plane transforms by the matrix that transforms points out of object space, multiplied on the
+        other side, so there is no need to invert the model matrix; as long as the model matrix only
+        rotates and translates, the planes stay normalised
+        """
+        if self.changed:
+            self._build()
+        planes = self.planes
+        dest = self.object_planes
+        for i in range(0, 24, 4):
+            a = planes[i]
+            b = planes[i + 1]
+            c = planes[i + 2]
+            d = planes[i + 3]
+            for r in range(0, 16, 4):
+                dest[i + (r >> 2)] = m_model[r] * a + m_model[r + 1] * b + m_model[r + 2] * c + m_model[r + 3] * d
+        return self.object_plane_views
+
+
+def sphere_outside(planes, sphere):
+    """
+    Returns true if the given bounding sphere, a 4-element array of centre x, y, z and radius, lies
+    entirely outside any of the given frustum planes, in which case nothing inside it can be seen
+    """
+    radius = -sphere[3]
+    for plane in planes:
+        if v_dot(plane, sphere) + plane[3] < radius:
+            return True
+    return False
@@ -0,0 +1,72 @@
+from micropython import const
+import struct
+import sys
+import time
+from .native import *
+
+# Marker at the start of every chunk of captured frame data, so the host can find frames in amongst
+# any other output on the serial console
+MAGIC = b'T3DC'
+
+# Chunk header, following the magic: frame width, frame height, frame number, index of the first
+# pixel in the chunk, length of the chunk's encoded data and flags
+HEADER = '<HHIIHB'
+
+FLAG_KEYFRAME = const(1)
+FLAG_END_OF_FRAME = const(2)
+
+# How often to encode a frame against a blank frame instead of the previous frame, so a host that
+# starts listening part way through a capture can pick up the stream
+KEYFRAME_INTERVAL = const(64)
+
+
+class FrameCapture:
+    """
+    Streams the contents of a buffered display to a host over the USB serial console
+
+    Each frame is encoded as the difference from the previous frame, which is then run-length encoded
+    in native code, so unchanged parts of the screen cost almost nothing to send; the encoded frame
+    is sent in chunks small enough that we don't need to allocate space for a whole encoded frame
+
+    Note that we need to keep a copy of the previous frame, so capturing needs as much memory again as
+    the framebuffer itself, which is why it's only allocated when capturing is turned on
+    """
+
+    def __init__(self, fb, chunk_size=4096, stream=None):
+        self.fb = fb
+        self.stream = stream or getattr(sys.stdout, 'buffer', sys.stdout)
+        self.frame = 0
+
+        # Pre-allocated space for the previous frame, the encoded output and the chunk header
+        self.previous = bytearray(len(fb.buffer))
+        self.output = bytearray(chunk_size)
+        self.output_mv = memoryview(self.output)
+        self.header = bytearray(struct.calcsize(HEADER))
+
+    def capture(self):
+        """
+        Encodes the current contents of the framebuffer and writes it to the stream, returns how long
+        it took in microseconds
+        """
+        start_t = time.ticks_us()
+
+        fb = self.fb
+        stream = self.stream
+        header = self.header
+        keyframe = self.frame % KEYFRAME_INTERVAL == 0
+        flags = FLAG_KEYFRAME if keyframe else 0
+        num_pixels = len(fb.buffer) // 2
+
+        pixel = 0
+        while pixel < num_pixels:
+            start = pixel
+            pixel, length = fb_delta_rle(fb.buffer, self.previous, self.output, start, keyframe)
+            if pixel >= num_pixels:
+                flags |= FLAG_END_OF_FRAME
+            struct.pack_into(HEADER, header, 0, fb.width, fb.height, self.frame, start, length, flags)
+            stream.write(MAGIC)
+            stream.write(header)
+            stream.write(self.output_mv[:length])
+
+        self.frame += 1
+        return time.ticks_diff(time.ticks_us(), start_t)
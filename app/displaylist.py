@@ -0,0 +1,132 @@
+from array import array
+
+
+class DisplayList:
+    """
+    The primitives to draw for a frame, already sorted into the order they should be drawn in, with their
+    screen coordinates and colours, so that deciding what to draw can be done separately from drawing it
+
+    Primitives are triangles, or lines or points in the wireframe and point cloud modes, and the stride is
+    the number of coordinates each one has; space is pre-allocated for a number of primitives and reused
+    from frame to frame, the coordinates of each triangle are available as a view into the coordinate
+    array that can be passed straight to the framebuffer's drawing calls
+    """
+
+    def __init__(self, size=0):
+        # Render mode, number of primitives in the list, and number of coordinates per primitive
+        self.mode = 0
+        self.count = 0
+        self.stride = 6
+
+        # Number of display pixels across and down each pixel of the frame covers, see ResolutionController
+        self.scale = 1
+
+        # When the first input acted on by this frame happened, if input latency is being measured
+        self.input_t = None
+
+        # Particles to draw over the primitives, as a [coords, count, colour, size] list for each particle
+        # system, see particle_batch()
+        self.particles = []
+
+        self.size = 0
+        self.coords = array('h')
+        self.colours = None
+        self.triangles = []
+        self.reserve(size)
+
+    def reserve(self, size, stride=6):
+        """
+        Ensures there is space for at least the given number of primitives with the given number of
+        coordinates each, this only allocates if there is not enough space already, and keeps anything
+        that is already in the list so that it can grow while it is being built
+        """
+        if size <= self.size and size * stride <= len(self.coords):
+            return
+        if size > self.size:
+            colours = array('H', [0] * size)
+            for i in range(self.size):
+                colours[i] = self.colours[i]
+            self.size = size
+            self.colours = colours
+        if size * stride > len(self.coords):
+            coords = array('h', [0] * (size * stride))
+            for i in range(len(self.coords)):
+                coords[i] = self.coords[i]
+            self.coords = coords
+            coords = memoryview(coords)
+            self.triangles = [coords[i:i + 6] for i in range(0, len(self.coords) - 5, 6)]
+
+    def particle_batch(self, index, capacity):
+        """
+        Returns the [coords, count, colour, size] list of the particle system with the given index, making
+        sure there is space in its coordinates for the given number of particles; this only allocates if
+        there is not enough space already
+        """
+        particles = self.particles
+        if index == len(particles):
+            particles.append([array('h'), 0, 0, 1])
+        batch = particles[index]
+        if len(batch[0]) < capacity * 2:
+            batch[0] = array('h', [0] * (capacity * 2))
+        return batch
+
+
+class TileBins:
+    """
+    Sorts the primitives of a display list into bins, one for each horizontal tile of the display that a
+    primitive overlaps, so that when drawing a tile only the primitives that can be seen in it need to be
+    drawn; primitives keep their display list order within each bin
+
+    The bins are pre-allocated with space for every primitive in every bin, which is the worst case
+    """
+
+    def __init__(self, num_tiles, tile_height):
+        self.num_tiles = num_tiles
+        self.tile_height = tile_height
+
+        # Number of primitives in each bin, and the display list indices of the primitives in each bin,
+        # where bin N starts at index N * size
+        self.counts = array('H', [0] * num_tiles)
+        self.size = 0
+        self.bins = None
+
+    def reserve(self, size):
+        """
+        Ensures there is space for at least the given number of primitives in each bin, this only
+        allocates if there is not enough space already
+        """
+        if size <= self.size:
+            return
+        self.size = size
+        self.bins = array('H', [0] * (size * self.num_tiles))
+
+    def bin(self, display_list):
+        """
+        Sorts the primitives of the given display list into the bins
+        """
+        self.reserve(display_list.size)
+        counts = self.counts
+        bins = self.bins
+        size = self.size
+        tile_height = self.tile_height
+        last_tile = self.num_tiles - 1
+        for i in range(self.num_tiles):
+            counts[i] = 0
+
+        # Only the y coordinates of each primitive matter
+        coords = display_list.coords
+        stride = display_list.stride
+        for i in range(display_list.count):
+            k = i * stride
+            top = coords[k + 1]
+            bottom = top
+            for j in range(k + 3, k + stride, 2):
+                top = min(top, coords[j])
+                bottom = max(bottom, coords[j])
+            if bottom < 0:
+                continue
+            first = max(top, 0) // tile_height
+            last = min(bottom // tile_height, last_tile)
+            for tile in range(first, last + 1):
+                bins[tile * size + counts[tile]] = i
+                counts[tile] += 1
@@ -0,0 +1,103 @@
+from array import array
+import time
+
+# Upper bounds of the buckets of the latency histogram, in milliseconds, anything slower goes in a final
+# bucket of its own
+LATENCY_BUCKETS = (10, 20, 30, 40, 50, 60, 80, 100, 150, 200, 300, 500)
+
+
+class InputQueue:
+    """
+    A queue of timestamped input events, such as buttons being pressed and released, so that input can be
+    acted on at a well-defined point in the frame, in the order it happened, instead of polling the state
+    of every button each frame and missing anything that happened in between
+
+    Events are small integers whose meaning is up to whoever pushes them; they are kept in a ring buffer
+    that is allocated up front, so nothing is allocated when events are pushed or popped, and if the queue
+    fills up then new events are dropped and counted
+
+    Only one thread may push events and only one thread may pop them, each side only moves its own end of
+    the ring buffer, so this needs no lock
+    """
+
+    def __init__(self, size=16):
+        self.size = size
+        self.events = bytearray(size)
+        self.times = array('i', [0] * size)
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+        # When the most recently popped event happened
+        self.time = 0
+
+    def push(self, event):
+        """
+        Adds an event to the queue, timestamped with the current time; for button events that is when the
+        buttons module dispatched the callback, which is some time after the edge on the pin, as the
+        buttons module handles the pin interrupt itself and calls back from the scheduler
+        """
+        head = self.head
+        next_head = (head + 1) % self.size
+        if next_head == self.tail:
+            self.dropped += 1
+            return
+        self.events[head] = event
+        self.times[head] = time.ticks_us()
+        self.head = next_head
+
+    def pop(self):
+        """
+        Removes the oldest event from the queue and returns it, or returns -1 if the queue is empty; the
+        time the event happened is left in the time attribute
+        """
+        tail = self.tail
+        if tail == self.head:
+            return -1
+        event = self.events[tail]
+        self.time = self.times[tail]
+        self.tail = (tail + 1) % self.size
+        return event
+
+
+class LatencyHistogram:
+    """
+    Counts how long it takes for input to be seen on the display, from when an event was pushed to when
+    the first frame that reflects it started to be sent to the display, in buckets of the given sizes;
+    the time before the event was pushed, such as between a button's edge and its callback, isn't counted
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = array('I', [0] * (len(buckets) + 1))
+        self.total = 0
+        self.worst = 0
+
+    def record(self, us):
+        ms = us // 1000
+        buckets = self.buckets
+        i = 0
+        while i < len(buckets) and ms >= buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += us
+        self.worst = max(self.worst, us)
+
+    def print_report(self):
+        counts = self.counts
+        num = sum(counts)
+        print("latency: {} events, mean {:,} us, worst {:,} us, from callback dispatch, not the button edge".format(
+            num, self.total // num if num else 0, self.worst))
+        lower = 0
+        for i in range(len(counts)):
+            label = '{}-{} ms'.format(lower, self.buckets[i]) if i < len(self.buckets) else '{}+ ms'.format(lower)
+            if i < len(self.buckets):
+                lower = self.buckets[i]
+            bar = '#' * ((counts[i] * 40 + num - 1) // num) if num else ''
+            print("  {:<12}{:>6} {}".format(label, counts[i], bar))
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.total = 0
+        self.worst = 0
@@ -0,0 +1,175 @@
+from array import array
+from micropython import const
+import gc
+import time
+
+# The heap is allocated in blocks of this many bytes, so every object uses a whole number of blocks
+BLOCK_SIZE = const(16)
+
+# How many snapshots of the heap to keep
+MAX_SNAPSHOTS = const(16)
+
+
+def _blocks(n):
+    return (n + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+
+def size_of(obj, itemsize=4, seen=None):
+    """
+    Returns an estimate of the number of bytes of heap used by the given object, including everything it
+    refers to; MicroPython can't tell us the size of an object, so this is worked out from the sizes of the
+    object structures on 32-bit ports and rounded up to whole heap blocks
+
+    Arrays can't tell us their type either, so the size of their items must be given, except for bytes
+    and bytearrays; objects in the given set of ids are not counted again, so that objects that are shared
+    between structures are only counted once
+    """
+    if seen is not None:
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+
+    if obj is None or isinstance(obj, (bool, int)):
+        # Small integers and constants are stored in the reference itself
+        return 0
+    if isinstance(obj, float):
+        return BLOCK_SIZE
+    if isinstance(obj, (bytes, bytearray, str)):
+        return _blocks(16) + _blocks(len(obj))
+    if isinstance(obj, array):
+        return _blocks(16) + _blocks(len(obj) * itemsize)
+    if isinstance(obj, memoryview):
+        # Views don't own the memory they refer to
+        return _blocks(16)
+    if isinstance(obj, (list, tuple)):
+        size = _blocks(16) + _blocks(len(obj) * 4)
+        for item in obj:
+            size += size_of(item, itemsize, seen)
+        return size
+    if isinstance(obj, dict):
+        size = _blocks(16) + _blocks(len(obj) * 8)
+        for key, value in obj.items():
+            size += size_of(key, itemsize, seen) + size_of(value, itemsize, seen)
+        return size
+    # Anything else, count just the object itself
+    return _blocks(16)
+
+
+def largest_free_block():
+    """
+    Returns the size of the largest single allocation that can currently be made, which is less than the
+    total free memory when the heap is fragmented; there is no way to ask the heap for this, so it is
+    found by trying allocations of different sizes, which makes it too slow to call every frame
+    """
+    gc.collect()
+    lo = 0
+    hi = gc.mem_free()
+    while hi - lo > BLOCK_SIZE:
+        mid = (lo + hi) // 2
+        try:
+            block = bytearray(mid)
+            del block
+            lo = mid
+        except MemoryError:
+            hi = mid
+    return lo
+
+
+class MemoryReport:
+    """
+    Accounts for where memory goes: estimates the size of each of a mesh's structures and of the renderer's
+    buffers, and keeps snapshots of the state of the heap taken at interesting moments, such as either side
+    of loading a mesh, all of which can be printed on demand
+    """
+
+    def __init__(self):
+        # Snapshots of (label, time, free, allocated, largest free block), the oldest are dropped when
+        # there are too many
+        self.snapshots = []
+
+    def record(self, label, largest=True):
+        """
+        Takes a snapshot of the heap, finding the largest free block as well unless told not to, since that
+        is slow and collects garbage
+        """
+        # Note the heap before finding the largest free block, which collects garbage, so that the
+        # snapshot shows any garbage that was left behind
+        ticks = time.ticks_ms()
+        free = gc.mem_free()
+        alloc = gc.mem_alloc()
+        block = largest_free_block() if largest else -1
+        if len(self.snapshots) >= MAX_SNAPSHOTS:
+            self.snapshots.pop(0)
+        self.snapshots.append((label, ticks, free, alloc, block))
+
+    @staticmethod
+    def mesh_sizes(mesh, seen):
+        """
+        Returns a list of (name, bytes) pairs for each of the given mesh's structures
+        """
+        # Item sizes of the arrays in each structure
+        structures = (
+            ('vertices', 4), ('vertices_trans', 4), ('normals', 4), ('colours', 4), ('plane_dists', 4),
+            ('depth_map', 4), ('vert_indices', 4), ('norm_indices', 4), ('col_indices', 4),
+            ('faces', 4), ('clusters', 2), ('edges', 2), ('edge_faces', 2), ('points', 2),
+            ('screen_coords', 2), ('sections', 4), ('bsp', 2),
+        )
+        sizes = [(name, size_of(getattr(mesh, name), itemsize, seen)) for name, itemsize in structures]
+        if mesh.animation:
+            sizes.append(('animation', size_of(mesh.animation.buffers, 4, seen)))
+        if mesh.bvh:
+            bvh = mesh.bvh
+            size = size_of(bvh.nodes, 2, seen) + size_of(bvh.boxes, 4, seen) + size_of(bvh.triangles, 2, seen)
+            sizes.append(('bvh', size))
+        return sizes
+
+    @staticmethod
+    def renderer_sizes(renderer, seen):
+        """
+        Returns a list of (name, bytes) pairs for each of the given renderer's buffers
+        """
+        sizes = [('framebuffer', size_of(renderer.fb.buffer, 1, seen))]
+        if renderer.fb.indexed:
+            fb = renderer.fb
+            sizes.append(('palette', size_of(fb.palette, 2, seen) + size_of(fb.chunk, 1, seen)))
+        display_lists = [renderer.display_list]
+        if renderer.pipeline:
+            display_lists = renderer.pipeline.buffers
+        size = 0
+        for display_list in display_lists:
+            size += size_of(display_list.coords, 2, seen) + size_of(display_list.colours, 2, seen)
+            size += size_of(display_list.triangles, 2, seen) + size_of(display_list.particles, 2, seen)
+        sizes.append(('display lists', size))
+        if renderer.particles:
+            sizes.append(('particles', size_of([system.pool for system in renderer.particles], 4, seen)))
+        bodies = renderer.bodies
+        sizes.append(('bodies', size_of(bodies.state, 4, seen) + size_of(bodies.matrices, 4, seen)))
+        if renderer.bins:
+            sizes.append(('tile bins', size_of(renderer.bins.bins, 2, seen)))
+        if renderer.capture:
+            capture = renderer.capture
+            sizes.append(('capture', size_of(capture.previous, 1, seen) + size_of(capture.output, 1, seen)))
+        return sizes
+
+    def print_report(self, renderer):
+        seen = set()
+        mesh = renderer.mesh
+        print("memory: mesh {}".format(renderer.render_object))
+        total = 0
+        for name, size in MemoryReport.mesh_sizes(mesh, seen):
+            print("  {:<16}{:>10,} bytes".format(name, size))
+            total += size
+        print("  {:<16}{:>10,} bytes".format('total', total))
+
+        print("memory: renderer")
+        for name, size in MemoryReport.renderer_sizes(renderer, seen):
+            print("  {:<16}{:>10,} bytes".format(name, size))
+
+        print("memory: heap snapshots")
+        for label, ticks, free, alloc, block in self.snapshots:
+            print("  {:<20} {:>10} ms  free {:>8,}  allocated {:>8,}  largest free block {:>8}".format(
+                label, ticks, free, alloc, '{:,}'.format(block) if block >= 0 else '-'))
+        self.record('now')
+        label, ticks, free, alloc, block = self.snapshots[-1]
+        print("memory: free {:,} bytes, allocated {:,} bytes, largest free block {:,} bytes".format(
+            free, alloc, block))
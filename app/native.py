@@ -0,0 +1,7 @@
+# The functions of the tidal3d native module, which every other module of the app imports from here with
+# "from .native import *", so that which implementation is used is decided in one place
+try:
+    from tidal3d import *
+except ImportError:
+    # Stock firmware doesn't have the native module, so fall back to the much slower Python version
+    from .tidal3d_viper import *
@@ -1,10 +1,29 @@
 from array import array
-from tidal3d import *
+from micropython import const
+from .native import *
+from .animation import VertexAnimation
+from .bvh import BVH
+
+# Where models are loaded from, tools that load models off the badge can point this somewhere else
+ASSET_DIR = "apps/tidal_3d/"
+
+# Maximum number of faces in a cluster, see Mesh._cluster()
+CLUSTER_SIZE = const(16)
+
+# Face index of the missing face of an edge that is only part of one face
+NO_FACE = const(0xffff)
+
+# How far a vertex can be in front of the plane of a face of a convex mesh, as a fraction of the radius
+# of the mesh, to allow for rounding errors, see Mesh.is_convex()
+CONVEX_TOLERANCE = 0.0001
+
+# Bits of the flags section of a mesh in a bundle
+FLAG_CONVEX = const(1)
 
 
 class Mesh:
 
-    def __init__(self, filename):
+    def __init__(self, filename, bundle=None):
         # A face is made of 3 vertices, a normal vector, and a material
         self.vertices = []
         self.normals = []
@@ -21,15 +40,57 @@ class Mesh:
         # It is a list of (vert_index, norm_index, col_index) tuples
         self.faces = []
 
-        # Pre-allocated space for face index/depth pairs for depth-sorting faces
+        # Pre-allocated space for face index/depth pairs for depth-sorting faces, and for marking which
+        # faces can be seen when drawing a wireframe with back faces culled
         self.depth_map = None
-
-        # Pre-allocated space for transformed vertices and normals
+        self.face_visible = None
+
+        # Bounding sphere of the whole mesh, and a list of (face_indices, bounding_sphere) tuples for
+        # clusters of nearby faces, where a bounding sphere is an array of centre x, y, z and radius
+        self.bounds = None
+        self.clusters = []
+
+        # Distance of each face's plane from the origin along the face's normal, so that which side of
+        # a face a point is on can be found without knowing where the face is
+        self.plane_dists = None
+
+        # Each unique edge as a pair of vertex indices, along with the pair of faces either side of it,
+        # and each unique vertex index, so that drawing the mesh as a wireframe or as a point cloud
+        # draws each edge or vertex once rather than once for every face it belongs to
+        self.edges = None
+        self.edge_faces = None
+        self.points = None
+
+        # Pre-allocated space for transformed vertices, for marking which of them have been transformed so
+        # far, and for their screen coordinates
         self.vertices_trans = None
-        self.normals_trans = None
+        self.vertices_done = None
+        self.screen_coords = None
+
+        # Vertex animation that moves the mesh's vertices, if it has one
+        self.animation = None
 
-        # Load mesh and material data
-        self._load(filename)
+        # Whether the mesh is convex, in which case none of the faces that face the camera can be in front
+        # of each other, so they don't need sorting
+        self.convex = None
+
+        # Arrays read from a bundle by section name, which the vertices, normals and colours are views into;
+        # meshes loaded from their own files only have the vertices, which are views into one array too
+        self.sections = None
+
+        # Nodes of a BSP tree of the mesh's faces, if it was packed with one, which gives the faces that
+        # face the camera in order from back to front without sorting them, see bsp_traverse()
+        self.bsp = None
+
+        # Bounding volume hierarchy of the mesh's triangles, for finding the faces that a ray hits or a
+        # sphere touches without testing every face, see BVH
+        self.bvh = None
+
+        # Load mesh and material data, from the bundle if it has the mesh, otherwise from its own files
+        if bundle and filename in bundle:
+            self._load_bundle(bundle, filename)
+        else:
+            self._load(filename)
 
         # Position and linear velocity
         self.position = array('f', [0, 0, 0])
@@ -41,6 +102,51 @@ class Mesh:
         self.angular = array('f', [0, 0, 0])
         self.axis = array('f', [0, 0, 0])
 
+        # Rigid bodies that move the mesh instead of update(), and the mesh's model matrix, if it has been
+        # attached to them
+        self.bodies = None
+        self.model_matrix = None
+
+    def attach(self, bodies):
+        """
+        Makes the mesh one of the given rigid bodies, which move it from then on, so that any number of
+        meshes can be moved with a single call; the mesh's position, velocity, orientation and angular
+        velocity become views of its state in the bodies, and its model matrix is worked out with theirs
+        """
+        index = bodies.add(self.position, self.velocity, self.orientation, self.angular)
+        self.position, self.velocity, self.orientation, self.angular = bodies.body(index)
+        self.model_matrix = bodies.matrix(index)
+        self.bodies = bodies
+
+    def inverse_matrix(self):
+        """
+        Returns the inverse of the mesh's model matrix, which transforms world coordinates into the mesh's
+        object space by undoing its translation and then its rotation, in the same way as the camera's
+        view matrix, for querying its BVH
+        """
+        m_inverse = array('f', [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1])
+        position = self.position
+        orientation = self.orientation
+        m_translate(m_inverse, array('f', [-position[0], -position[1], -position[2]]))
+        m_rotate(m_inverse, array('f', [orientation[0], -orientation[1], -orientation[2], -orientation[3]]))
+        return m_inverse
+
+    def inverse_rotation(self, m_inverse, q_inverse):
+        """
+        Fills the given matrix with the inverse of the mesh's rotation, which is the rotation by the
+        conjugate of its orientation quaternion, written into the given array of four floats; this is the
+        inverse model matrix without the translation, for bringing vectors into the mesh's object space
+        every frame without allocating anything
+        """
+        orientation = self.orientation
+        q_inverse[0] = orientation[0]
+        q_inverse[1] = -orientation[1]
+        q_inverse[2] = -orientation[2]
+        q_inverse[3] = -orientation[3]
+        for i in range(16):
+            m_inverse[i] = 1 if i % 5 == 0 else 0
+        m_rotate(m_inverse, q_inverse)
+
     def rotate_y(self, val):
         self.angular[1] = val
 
@@ -50,29 +156,28 @@ class Mesh:
     def _load(self, filename):
         # Parse the geometry file
         op = ObjectParser()
-        op.parse("apps/tidal_3d/" + filename)
+        op.parse(ASSET_DIR + filename)
 
-        self.vertices = op.vertices
+        # Keep the vertices in one array, as they are in a bundle, so they can be handed to native code
+        verts = array('f', [c for v in op.vertices for c in v])
+        self.sections = {'verts': verts}
+        view = memoryview(verts)
+        self.vertices = [view[i:i + 3] for i in range(0, len(verts), 3)]
         self.vert_indices = [f['indices'] for f in op.faces]
 
         # Pre-calculate face normal vectors, a normal is the direction exactly perpendicular to
         # the plane of the face, the direction the front of the face is pointing
-        a = array('f', [0, 0, 0])
-        b = array('f', [0, 0, 0])
         for face in self.vert_indices:
-            v_subtract(self.vertices[face[0]], self.vertices[face[1]], a)
-            v_subtract(self.vertices[face[1]], self.vertices[face[2]], b)
-            normal = array('f', [0, 0, 0])
-            v_cross(a, b, normal)
-            v_normalise(normal)
             # TODO normal deduplication -- "item in list" is not implemented in micropython for lists of arrays
-            self.normals.append(normal)
+            self.normals.append(array('f', [0, 0, 0]))
             self.norm_indices.append(len(self.normals) - 1)
+        self.plane_dists = array('f', [0] * len(self.vert_indices))
+        self._face_normals()
 
         # If the geometry has materials, let's also parse the accompanying material library file
         mp = MaterialParser()
         if op.mat_lib:
-            mp.parse("apps/tidal_3d/" + op.mat_lib)
+            mp.parse(ASSET_DIR + op.mat_lib)
 
             # Use the material's diffuse colour for the colour of the faces
             self.col_indices = [0] * len(self.vert_indices)
@@ -90,25 +195,239 @@ class Mesh:
         for i in range(len(self.vert_indices)):
             self.faces.append([self.vert_indices[i], self.norm_indices[i], self.col_indices[i]])
 
+        self._prepare()
+
+        # Play the mesh's vertex animation, if there is one alongside the geometry file
+        try:
+            self.animate(VertexAnimation(ASSET_DIR + filename[:filename.rfind('.')] + ".anim"))
+        except OSError:
+            pass
+
+    def _load_bundle(self, bundle, name):
+        # Everything that is worked out from the geometry and material files when loading them is already
+        # in the bundle, including the face normals, see tools/pack_bundle.py; each section is read
+        # straight into an array and the vertices, normals and colours are views into those arrays,
+        # rather than an array each, which saves both time and memory
+        verts = bundle.read(name + '/verts')
+        sizes = bundle.read(name + '/sizes')
+        indices = bundle.read(name + '/faces')
+        normals = bundle.read(name + '/normals')
+        colours = bundle.read(name + '/colours')
+        self.sections = {'verts': verts, 'faces': indices, 'normals': normals, 'colours': colours}
+
+        view = memoryview(verts)
+        self.vertices = [view[i:i + 3] for i in range(0, len(verts), 3)]
+        view = memoryview(normals)
+        self.normals = [view[i:i + 3] for i in range(0, len(normals), 3)]
+        view = memoryview(colours)
+        self.colours = [view[i:i + 3] for i in range(0, len(colours), 3)]
+        self.plane_dists = bundle.read(name + '/planes')
+        self.col_indices = bundle.read(name + '/materials')
+        if name + '/flags' in bundle:
+            self.convex = bool(bundle.read(name + '/flags')[0] & FLAG_CONVEX)
+        if name + '/bsp' in bundle:
+            self.bsp = bundle.read(name + '/bsp')
+        if name + '/bvh' in bundle:
+            self.bvh = BVH(verts, bundle.read(name + '/bvh'), bundle.read(name + '/boxes'),
+                           bundle.read(name + '/tris'))
+
+        view = memoryview(indices)
+        start = 0
+        for i in range(len(sizes)):
+            self.vert_indices.append(view[start:start + sizes[i]])
+            self.norm_indices.append(i)
+            self.faces.append([self.vert_indices[i], i, self.col_indices[i]])
+            start += sizes[i]
+
+        self._prepare()
+
+        # The mesh's vertex animation, if it has one, is streamed from its own section of the bundle
+        if name + '/anim' in bundle:
+            self.animate(VertexAnimation(bundle.filename, offset=bundle.offset(name + '/anim')))
+
+    def _prepare(self):
+        # Works out the rest of what the renderer needs from the mesh's geometry, however it was loaded
+
+        # Pre-calculate bounding spheres for the whole mesh and for clusters of nearby faces, so they
+        # can be tested against the camera's frustum before any vertices are transformed
+        self.bounds = Mesh.bounding_sphere(self.vertices)
+        if self.convex is None:
+            self.convex = Mesh.is_convex(self.vertices, self.normals, self.plane_dists, self.bounds[3])
+        centres = []
+        for face in self.vert_indices:
+            centre = array('f', [0, 0, 0])
+            v_average([self.vertices[i] for i in face], centre)
+            centres.append(centre)
+        self._cluster(list(range(len(self.faces))), centres)
+        if self.bvh is None:
+            self.bvh = BVH.build(self.sections['verts'], self.vert_indices)
+
+        # Find the unique edges and vertices
+        self._edges()
+
         # Pre-allocate some working space for face index/depth pairs for depth-sorting faces
         self.depth_map = array('f', [0] * (len(self.faces) * 2))
+        self.face_visible = bytearray(len(self.faces))
 
-        # Pre-allocate some working space for transforming vertices and normals
+        # Pre-allocate some working space for transforming vertices
         self.vertices_trans = [None] * len(self.vertices)
         for i in range(len(self.vertices)):
             self.vertices_trans[i] = array('f', [0, 0, 0])
-        self.normals_trans = [None] * len(self.normals)
-        for i in range(len(self.normals)):
-            self.normals_trans[i] = array('f', [0, 0, 0])
+        self.vertices_done = bytearray(len(self.vertices))
+        self.screen_coords = array('h', [0] * (len(self.vertices) * 2))
+
+    def _face_normals(self):
+        # Work out each face's normal from its vertices, along with the distance of its plane from the
+        # origin, this is redone whenever the vertices move
+        vertices = self.vertices
+        normals = self.normals
+        plane_dists = self.plane_dists
+        a = array('f', [0, 0, 0])
+        b = array('f', [0, 0, 0])
+        for i in range(len(self.vert_indices)):
+            face = self.vert_indices[i]
+            normal = normals[self.norm_indices[i]]
+            v_subtract(vertices[face[0]], vertices[face[1]], a)
+            v_subtract(vertices[face[1]], vertices[face[2]], b)
+            v_cross(a, b, normal)
+            v_normalise(normal)
+            plane_dists[i] = v_dot(normal, vertices[face[0]])
+
+    def animate(self, animation):
+        """
+        Plays the given vertex animation on the mesh, starting from its first keyframe
+        """
+        if animation.num_vertices != len(self.vertices):
+            animation.close()
+            raise ValueError("vertex animation does not match the mesh")
+        self.animation = animation
+
+        # The bounding spheres worked out from the loaded vertices won't hold once they move, so use the
+        # animation's bounds, which hold for every keyframe, for the whole mesh and for a single cluster
+        self.bounds = animation.bounds
+        self.clusters = [(array('H', [f for cluster_faces, _ in self.clusters for f in cluster_faces]),
+                          animation.bounds)]
+
+        # The mesh may not stay convex as its vertices move, and a BSP tree or a BVH only holds for the
+        # vertices it was built from, so the BVH is replaced by one that tests every triangle
+        self.convex = False
+        self.bsp = None
+        self.bvh = BVH.build(self.sections['verts'], self.vert_indices, animation.bounds)
+
+        animation.apply(self.vertices)
+        self._face_normals()
+
+    @staticmethod
+    def bounding_sphere(vertices):
+        """
+        Returns a sphere that encloses all of the given vertices, centred on the middle of their
+        bounding box, which is not the smallest possible sphere but is quick to find
+        """
+        lo = array('f', vertices[0])
+        hi = array('f', vertices[0])
+        for v in vertices:
+            for i in range(3):
+                lo[i] = min(lo[i], v[i])
+                hi[i] = max(hi[i], v[i])
+        centre = array('f', [0, 0, 0])
+        v_average([lo, hi], centre)
+        d = array('f', [0, 0, 0])
+        radius = 0
+        for v in vertices:
+            v_subtract(v, centre, d)
+            radius = max(radius, v_magnitude(d))
+        return array('f', [centre[0], centre[1], centre[2], radius])
+
+    @staticmethod
+    def is_convex(vertices, normals, plane_dists, radius):
+        """
+        Returns whether a mesh with the given vertices and face normals and plane distances is convex,
+        which it is if no vertex is in front of the plane of any face; this is the case for meshes like
+        cubes and spheres, but also for parts of them, such as a hemisphere without its base
+        """
+        tolerance = radius * CONVEX_TOLERANCE
+        for i in range(len(plane_dists)):
+            normal = normals[i]
+            limit = plane_dists[i] + tolerance
+            for v in vertices:
+                if v_dot(normal, v) > limit:
+                    return False
+        return True
+
+    def _cluster(self, face_indices, centres):
+        # Recursively split the faces in half along the axis in which their centres are most spread
+        # out until there are few enough to make a cluster, so faces in a cluster are close together
+        # and their bounding sphere is small
+        if len(face_indices) <= CLUSTER_SIZE:
+            verts = [self.vertices[i] for f in face_indices for i in self.vert_indices[f]]
+            self.clusters.append((array('H', face_indices), Mesh.bounding_sphere(verts)))
+            return
+        axis = 0
+        spread = -1
+        for i in range(3):
+            values = [centres[f][i] for f in face_indices]
+            if max(values) - min(values) > spread:
+                spread = max(values) - min(values)
+                axis = i
+        face_indices.sort(key=lambda f: centres[f][axis])
+        half = len(face_indices) // 2
+        self._cluster(face_indices[:half], centres)
+        self._cluster(face_indices[half:], centres)
+
+    def _edges(self):
+        # Vertices at the same position are the same point as far as drawing points and edges goes, but
+        # exporters often duplicate vertices along seams, so each vertex is mapped to the first vertex at
+        # its position
+        first = {}
+        remap = array('H', [0] * len(self.vertices))
+        self.points = array('H')
+        for i in range(len(self.vertices)):
+            v = self.vertices[i]
+            key = (v[0], v[1], v[2])
+            if key not in first:
+                first[key] = i
+                self.points.append(i)
+            remap[i] = first[key]
+
+        # An edge is shared by the two faces either side of it, and it is the same edge whichever way
+        # round its vertices are given, so key edges by their vertices in order; an edge of more than
+        # two faces is split into more than one edge, so that every face's edges can still be drawn
+        index = {}
+        self.edges = array('H')
+        self.edge_faces = array('H')
+        for f in range(len(self.vert_indices)):
+            face = self.vert_indices[f]
+            for j in range(len(face)):
+                a = remap[face[j]]
+                b = remap[face[(j + 1) % len(face)]]
+                if a == b:
+                    continue
+                key = (a, b) if a < b else (b, a)
+                e = index.get(key)
+                if e is None or self.edge_faces[e + 1] != NO_FACE:
+                    index[key] = len(self.edges)
+                    self.edges.append(key[0])
+                    self.edges.append(key[1])
+                    self.edge_faces.append(f)
+                    self.edge_faces.append(NO_FACE)
+                else:
+                    self.edge_faces[e + 1] = f
 
     def update(self, delta_t):
-        # Move our position by our velocity
-        v_scale(self.velocity, delta_t, self.delta_v)
-        v_add(self.position, self.delta_v)
-        # Rotate ourselves around the axis
-        degrees = v_magnitude(self.angular)
-        v_normalise(self.angular, self.axis)
-        q_rotate(self.orientation, degrees * delta_t, self.axis)
+        # Meshes that are attached to rigid bodies are moved along with the rest of the bodies
+        if self.bodies is None:
+            # Move our position by our velocity
+            v_scale(self.velocity, delta_t, self.delta_v)
+            v_add(self.position, self.delta_v)
+            # Rotate ourselves around the axis
+            degrees = v_magnitude(self.angular)
+            v_normalise(self.angular, self.axis)
+            q_rotate(self.orientation, degrees * delta_t, self.axis)
+        # Move our vertices to where they are in the animation
+        if self.animation:
+            self.animation.update(delta_t)
+            self.animation.apply(self.vertices)
+            self._face_normals()
 
 
 class ParserInterface:
@@ -0,0 +1,67 @@
+from array import array
+from micropython import const
+from .native import *
+
+# Number of floats each particle takes up in the pool: x, y, z of its position, x, y, z of its velocity,
+# and how many seconds it has left to live, see p_update()
+PARTICLE_SIZE = const(7)
+
+
+class ParticleSystem:
+    """
+    A pool of particles for effects such as exhaust and explosions, which are drawn over the scene as
+    single pixels or small squares of one colour
+
+    Every particle's position, velocity and remaining lifetime are kept in a single array that is allocated
+    up front, so that all of the particles are moved, aged and projected to the screen with one native call
+    each frame, and drawn with another, without allocating anything; the live particles are kept at the
+    start of the pool, and when a particle's lifetime runs out the last live particle takes its place, so
+    new particles can be emitted for as long as there is room for them
+    """
+
+    def __init__(self, capacity, colour, size=1, acceleration=(0, 0, 0)):
+        self.capacity = capacity
+        self.pool = array('f', [0] * (capacity * PARTICLE_SIZE))
+        self.count = 0
+
+        # RGB565 colour of the particles and the width and height of each particle in pixels, and the
+        # acceleration of every particle, such as gravity, in world units per second per second
+        self.colour = colour
+        self.size = size
+        self.acceleration = array('f', acceleration)
+
+    def emit(self, position, velocity, lifetime):
+        """
+        Adds a particle at the given position, moving with the given velocity, that lives for the given
+        number of seconds; returns False if there is no room for it
+        """
+        if self.count == self.capacity:
+            return False
+        pool = self.pool
+        i = self.count * PARTICLE_SIZE
+        pool[i] = position[0]
+        pool[i + 1] = position[1]
+        pool[i + 2] = position[2]
+        pool[i + 3] = velocity[0]
+        pool[i + 4] = velocity[1]
+        pool[i + 5] = velocity[2]
+        pool[i + 6] = lifetime
+        self.count += 1
+        return True
+
+    def clear(self):
+        """
+        Removes every particle
+        """
+        self.count = 0
+
+    def update(self, delta_t, m_view_proj, coords, width, height):
+        """
+        Moves the particles on by the given number of seconds, removing any whose lifetime runs out, and
+        writes the screen coordinates of the rest into the given array, which must have room for two for
+        each particle, using the given combined view and projection matrix and screen size; returns the
+        number of particles, particles that can't be seen are given coordinates off the screen
+        """
+        self.count = p_update(self.pool, self.count, delta_t, self.acceleration, m_view_proj, coords,
+                              width, height)
+        return self.count
@@ -0,0 +1,133 @@
+import _thread
+import time
+
+
+class Pipeline:
+    """
+    Runs a producer on a second thread so that it can work on the next frame while the current frame is
+    being consumed on the main thread, for example building the display list for frame N+1 while frame N
+    is being drawn and sent to the display
+
+    Frames are handed over in a pair of pre-allocated buffers that the producer and consumer take turns
+    with, whether each buffer is ready to be consumed is guarded by a lock; nothing is allocated when
+    handing over a frame, and the producer waits for a buffer to be consumed before reusing it
+
+    This only depends on the _thread module, so can be tried out on the unix port of MicroPython as well
+    as on the badge, see tools/bench_pipeline.py
+
+    The ESP32 port of MicroPython, which the badge runs, is built with a global interpreter lock, so only
+    one of the two threads runs at a time and the pipeline gives no parallel speedup there; it has not
+    been measured on the badge
+    """
+
+    def __init__(self, buffers, producer):
+        self.buffers = buffers
+        self.producer = producer
+        self.lock = _thread.allocate_lock()
+
+        # Whether each buffer holds a frame that is waiting to be consumed, and which buffer the
+        # producer and consumer will use next
+        self.ready = [False, False]
+        self.produce_index = 0
+        self.consume_index = 0
+
+        self.running = False
+        self.stopped = True
+
+        # Exception that stopped the producer, which is raised again on the consumer's thread
+        self.error = None
+
+        # Time spent producing and consuming frames, and when we started counting, for reporting how
+        # busy each thread is
+        self.produce_t = 0
+        self.consume_t = 0
+        self.start_t = time.ticks_us()
+
+    def start(self):
+        """
+        Starts the producer, dropping any frames that were produced before it was last stopped
+        """
+        self.ready[0] = False
+        self.ready[1] = False
+        self.produce_index = 0
+        self.consume_index = 0
+        self.error = None
+        self.running = True
+        self.stopped = False
+        _thread.start_new_thread(self._run, ())
+
+    def stop(self):
+        """
+        Stops the producer and waits for it to finish the frame it is working on
+        """
+        self.running = False
+        while not self.stopped:
+            time.sleep_ms(1)
+
+    def _run(self):
+        # However the producer stops, stop() mustn't be left waiting for it, and if it raised an exception
+        # then the consumer's thread raises it again, as nothing would see it on this thread
+        try:
+            self._produce()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.stopped = True
+
+    def _produce(self):
+        lock = self.lock
+        ready = self.ready
+        while self.running:
+            index = self.produce_index
+            with lock:
+                waiting = ready[index]
+            if waiting:
+                # The consumer hasn't finished with this buffer yet
+                time.sleep_ms(1)
+                continue
+
+            start_t = time.ticks_us()
+            self.producer(self.buffers[index])
+
+            with lock:
+                ready[index] = True
+                self.produce_t += time.ticks_diff(time.ticks_us(), start_t)
+            self.produce_index = index ^ 1
+
+    def consume(self, consumer):
+        """
+        Passes the next frame to the given consumer if it is ready, returns whether there was a frame;
+        raises the exception that stopped the producer, if it raised one
+        """
+        error = self.error
+        if error is not None:
+            self.error = None
+            raise error
+        index = self.consume_index
+        with self.lock:
+            waiting = self.ready[index]
+        if not waiting:
+            return False
+
+        start_t = time.ticks_us()
+        consumer(self.buffers[index])
+
+        with self.lock:
+            self.ready[index] = False
+            self.consume_t += time.ticks_diff(time.ticks_us(), start_t)
+        self.consume_index = index ^ 1
+        return True
+
+    def utilisation(self):
+        """
+        Returns the percentage of the time that each of the producer and consumer threads were busy since
+        the last time this was called
+        """
+        with self.lock:
+            now = time.ticks_us()
+            elapsed = max(1, time.ticks_diff(now, self.start_t))
+            result = (self.produce_t * 100 // elapsed, self.consume_t * 100 // elapsed)
+            self.produce_t = 0
+            self.consume_t = 0
+            self.start_t = now
+        return result
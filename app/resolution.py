@@ -0,0 +1,46 @@
+from micropython import const
+
+# How many frames the average frame time is taken over, roughly, as the weight of each new frame time in
+# an exponential moving average is one over this
+AVERAGE_FRAMES = const(8)
+
+# How many frames to wait after changing resolution before changing it again, so that the average has
+# time to settle at the new resolution
+HOLD_FRAMES = const(30)
+
+
+class ResolutionController:
+    """
+    Chooses whether to draw the scene at full or half resolution, from the average of recent frame times,
+    so that when a scene is too slow to draw at full resolution the frame rate can be kept up by drawing
+    fewer pixels instead of dropping frames
+
+    Drawing at half resolution only saves the time spent drawing pixels, not the time spent working out
+    what to draw, so the frame time at full resolution can't be predicted from the frame time at half
+    resolution; instead full resolution is only tried again once frames are taking well under the budget
+    """
+
+    def __init__(self, budget, recover=0.5):
+        # Frame time in microseconds that frames should take no longer than, and the fraction of it that
+        # frames must take at half resolution before going back to full resolution
+        self.budget = budget
+        self.recover = recover
+
+        self.scale = 1
+        self.average = 0
+        self.hold = HOLD_FRAMES
+
+    def update(self, frame_t):
+        """
+        Takes the time the last frame took in microseconds, and returns the scale to draw the next frame at
+        """
+        self.average += (frame_t - self.average) // AVERAGE_FRAMES
+        if self.hold:
+            self.hold -= 1
+        elif self.scale == 1 and self.average > self.budget:
+            self.scale = 2
+            self.hold = HOLD_FRAMES
+        elif self.scale == 2 and self.average < self.budget * self.recover:
+            self.scale = 1
+            self.hold = HOLD_FRAMES
+        return self.scale
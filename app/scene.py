@@ -0,0 +1,48 @@
+from array import array
+from math import radians, tan
+from micropython import const
+
+# How the scene is set up and drawn, which tools/render_offline.py reads from here too, so that its
+# frames are the same as the app's
+
+MODE_POINT_CLOUD = const(0)
+MODE_WIREFRAME_FULL = const(1)
+MODE_WIREFRAME_BACK_FACE_CULLING = const(2)
+MODE_SOLID = const(3)
+MODE_SOLID_SHADED = const(4)
+
+# Faces are clipped against the edges of the screen, except that they can overhang the left and right
+# edges by this many times the distance from the centre of the screen to the edge, see v_clip_to_screen;
+# a face can become up to this many triangles when it is clipped
+GUARD_BAND = 2.0
+CLIP_MAX_TRIANGLES = const(6)
+
+# Field of view in degrees, and the distances of the near and far clipping planes, of the projection
+FIELD_OF_VIEW = const(90)
+NEAR = 0.1
+FAR = const(100)
+
+# Where the camera starts, and the direction the light shines in, which is normalised when it is used
+CAMERA_POSITION = (0, 10, 35)
+LIGHT = (-1, -1, -2)
+
+
+def perspective_matrix(fov, aspect, near, far):
+    """
+    Returns the perspective projection matrix for the given field of view and aspect ratio, multiplication
+    of any vector V with the projection matrix will yield normalised device coordinates
+    """
+    proj_mat = [0] * 16
+    # Set the field of view, accomodating for the aspect ratio of the screen
+    scale = tan(radians(fov * 0.5))
+    proj_mat[0] = 1.0 / (scale * aspect)  # Scale of the x coord of the projected vertex
+    proj_mat[5] = 1.0 / scale  # Scale of the y coord of the projected vertex
+    # Z clipping planes
+    proj_mat[10] = -far / (far - near)
+    proj_mat[14] = -far * near / (far - near)
+    # Setting these following values is how we do the perspective division, by causing w to be set to -z
+    # instead of 1 and then w is used as the normalising divisor during vector-proj_mat multiplication
+    proj_mat[11] = -1
+    proj_mat[15] = 0
+
+    return array('f', proj_mat)
@@ -0,0 +1,936 @@
+"""
+A pure-Python implementation of the tidal3d native module, for badges running stock firmware
+
+This has exactly the same API as the native module, see module/tidal3d.c for descriptions of the
+functions, and is selected automatically when the native module is not available; it is much slower
+than the native module but it means the app can run everywhere
+
+Functions that only deal with integers are compiled by the viper code emitter and access buffers
+through raw pointers; viper has no floating point type, so the floating point maths is compiled by
+the native code emitter instead, with values and buffers cached in locals wherever possible
+"""
+
+from array import array
+from math import cos, sin, sqrt
+from micropython import const
+
+# Pre-computed PI over 180
+DEGS_TO_RADS = 0.017453
+
+
+@micropython.native
+def v_magnitude(vector):
+    x = vector[0]
+    y = vector[1]
+    z = vector[2]
+    return sqrt(x * x + y * y + z * z)
+
+
+@micropython.native
+def v_normalise(vector, dest=None):
+    if dest is None:
+        dest = vector
+    x = vector[0]
+    y = vector[1]
+    z = vector[2]
+    mag = sqrt(x * x + y * y + z * z)
+    # Avoid divide by zero on zero-length vectors
+    if mag == 0:
+        dest[0] = x
+        dest[1] = y
+        dest[2] = z
+    else:
+        dest[0] = x / mag
+        dest[1] = y / mag
+        dest[2] = z / mag
+
+
+@micropython.native
+def v_scale(vector, factor, dest=None):
+    if dest is None:
+        dest = vector
+    dest[0] = vector[0] * factor
+    dest[1] = vector[1] * factor
+    dest[2] = vector[2] * factor
+
+
+@micropython.native
+def v_add(vector1, vector2, dest=None):
+    if dest is None:
+        dest = vector1
+    dest[0] = vector1[0] + vector2[0]
+    dest[1] = vector1[1] + vector2[1]
+    dest[2] = vector1[2] + vector2[2]
+
+
+@micropython.native
+def v_subtract(vector1, vector2, dest=None):
+    if dest is None:
+        dest = vector1
+    dest[0] = vector1[0] - vector2[0]
+    dest[1] = vector1[1] - vector2[1]
+    dest[2] = vector1[2] - vector2[2]
+
+
+@micropython.native
+def v_average(vectors, dest):
+    x = 0.0
+    y = 0.0
+    z = 0.0
+    for vector in vectors:
+        x += vector[0]
+        y += vector[1]
+        z += vector[2]
+    n = len(vectors)
+    dest[0] = x / n
+    dest[1] = y / n
+    dest[2] = z / n
+
+
+@micropython.native
+def _multiply(vector, m, dest):
+    x = vector[0]
+    y = vector[1]
+    z = vector[2]
+    w = x * m[3] + y * m[7] + z * m[11] + m[15]
+    dx = x * m[0] + y * m[4] + z * m[8] + m[12]
+    dy = x * m[1] + y * m[5] + z * m[9] + m[13]
+    dz = x * m[2] + y * m[6] + z * m[10] + m[14]
+    if w != 1:
+        dest[0] = dx / w
+        dest[1] = dy / w
+        dest[2] = dz / w
+    else:
+        dest[0] = dx
+        dest[1] = dy
+        dest[2] = dz
+
+
+@micropython.native
+def v_multiply(vector, matrix, dest=None):
+    _multiply(vector, matrix, vector if dest is None else dest)
+
+
+@micropython.native
+def v_multiply_batch(vectors, matrix, dests=None):
+    if dests is None:
+        dests = vectors
+    for i in range(len(vectors)):
+        _multiply(vectors[i], matrix, dests[i])
+
+
+@micropython.native
+def v_lerp_batch(frame1, frame2, factor, dests):
+    if len(frame1) < len(dests) * 3 or len(frame2) < len(dests) * 3:
+        raise ValueError("frames are too small")
+    for j in range(len(dests)):
+        dest = dests[j]
+        for i in range(3):
+            a = frame1[j * 3 + i]
+            dest[i] = a + (frame2[j * 3 + i] - a) * factor
+
+
+@micropython.native
+def v_dot(vector1, vector2):
+    return vector1[0] * vector2[0] + vector1[1] * vector2[1] + vector1[2] * vector2[2]
+
+
+@micropython.native
+def v_cross(vector1, vector2, dest=None):
+    if dest is None:
+        dest = vector1
+    x1 = vector1[0]
+    y1 = vector1[1]
+    z1 = vector1[2]
+    x2 = vector2[0]
+    y2 = vector2[1]
+    z2 = vector2[2]
+    dest[0] = y1 * z2 - z1 * y2
+    dest[1] = z1 * x2 - x1 * z2
+    dest[2] = x1 * y2 - y1 * x2
+
+
+@micropython.native
+def v_ndc_to_screen(vectors, coords, width, height):
+    half_width = 0.5 * width
+    for i in range(len(vectors)):
+        vector = vectors[i]
+        coords[i * 2] = int((vector[0] + 1) * half_width)
+        coords[i * 2 + 1] = int((1 - (vector[1] + 1) * 0.5) * height)
+
+
+# Scratch space for v_clip_to_screen, so that normalised device coords are rounded to single precision
+# the same as when they are stored by v_multiply
+_ndc = array('f', [0, 0])
+
+
+@micropython.native
+def _clip_distance(v, plane, guard):
+    if plane == 0:
+        return v[2]
+    if plane == 1:
+        return v[0] + guard * v[3]
+    if plane == 2:
+        return guard * v[3] - v[0]
+    if plane == 3:
+        return v[1] + v[3]
+    return v[3] - v[1]
+
+
+@micropython.native
+def _clip_polygon(poly, plane, guard):
+    out = []
+    prev = poly[-1]
+    d_prev = _clip_distance(prev, plane, guard)
+    for cur in poly:
+        d_cur = _clip_distance(cur, plane, guard)
+        if (d_prev < 0) != (d_cur < 0):
+            t = d_prev / (d_prev - d_cur)
+            out.append([prev[j] + (cur[j] - prev[j]) * t for j in range(4)])
+        if d_cur >= 0:
+            out.append(cur)
+        prev = cur
+        d_prev = d_cur
+    return out
+
+
+@micropython.native
+def v_clip_to_screen(vectors, matrix, coords, index, width, height, guard):
+    if len(matrix) < 16:
+        raise ValueError("matrix is too small")
+    m = matrix
+    poly = []
+    outside_all = 0x1f
+    outside_any = 0
+    for vector in vectors:
+        x = vector[0]
+        y = vector[1]
+        z = vector[2]
+        v = [x * m[c] + y * m[4 + c] + z * m[8 + c] + m[12 + c] for c in range(4)]
+        outside = 0
+        for plane in range(5):
+            if _clip_distance(v, plane, guard) < 0:
+                outside |= 1 << plane
+        outside_all &= outside
+        outside_any |= outside
+        poly.append(v)
+    if outside_all:
+        return 0
+
+    for plane in range(5):
+        if outside_any & (1 << plane) and len(poly) >= 3:
+            poly = _clip_polygon(poly, plane, guard)
+    n = len(poly)
+    if n < 3:
+        return 0
+
+    ndc = _ndc
+    half_width = 0.5 * width
+    xy = []
+    for v in poly:
+        w = v[3]
+        ndc[0] = v[0] / w if w != 1 else v[0]
+        ndc[1] = v[1] / w if w != 1 else v[1]
+        xy.append(int((ndc[0] + 1) * half_width))
+        xy.append(int((1 - (ndc[1] + 1) * 0.5) * height))
+
+    if (index + n - 2) * 6 > len(coords):
+        raise ValueError("coords is too small")
+    for i in range(1, n - 1):
+        k = (index + i - 1) * 6
+        coords[k] = xy[0]
+        coords[k + 1] = xy[1]
+        coords[k + 2] = xy[i * 2]
+        coords[k + 3] = xy[i * 2 + 1]
+        coords[k + 4] = xy[i * 2 + 2]
+        coords[k + 5] = xy[i * 2 + 3]
+    return n - 2
+
+
+@micropython.native
+def m_multiply(mat1, mat2):
+    # Multiply row by row, each row of the result only depends on the same row of the first matrix
+    # so it can be written back in place once it has been calculated
+    for r in range(0, 16, 4):
+        a0 = mat1[r]
+        a1 = mat1[r + 1]
+        a2 = mat1[r + 2]
+        a3 = mat1[r + 3]
+        for c in range(4):
+            mat1[r + c] = a0 * mat2[c] + a1 * mat2[4 + c] + a2 * mat2[8 + c] + a3 * mat2[12 + c]
+
+
+@micropython.native
+def m_translate(matrix, vector):
+    # Multiplying by a translation matrix only affects the last column of each row
+    x = vector[0]
+    y = vector[1]
+    z = vector[2]
+    for r in range(0, 16, 4):
+        w = matrix[r + 3]
+        matrix[r] += w * x
+        matrix[r + 1] += w * y
+        matrix[r + 2] += w * z
+
+
+@micropython.native
+def m_rotate(matrix, quaternion):
+    w = quaternion[0]
+    x = quaternion[1]
+    y = quaternion[2]
+    z = quaternion[3]
+    r0 = 1 - 2 * (y * y + z * z)
+    r1 = 2 * (x * y - w * z)
+    r2 = 2 * (x * z + w * y)
+    r4 = 2 * (x * y + w * z)
+    r5 = 1 - 2 * (x * x + z * z)
+    r6 = 2 * (y * z - w * x)
+    r8 = 2 * (x * z - w * y)
+    r9 = 2 * (y * z + w * x)
+    r10 = 1 - 2 * (x * x + y * y)
+    for r in range(0, 16, 4):
+        a0 = matrix[r]
+        a1 = matrix[r + 1]
+        a2 = matrix[r + 2]
+        matrix[r] = a0 * r0 + a1 * r4 + a2 * r8
+        matrix[r + 1] = a0 * r1 + a1 * r5 + a2 * r9
+        matrix[r + 2] = a0 * r2 + a1 * r6 + a2 * r10
+
+
+@micropython.native
+def q_rotate(quaternion, degrees, vector):
+    q1w = quaternion[0]
+    q1x = quaternion[1]
+    q1y = quaternion[2]
+    q1z = quaternion[3]
+
+    # Compute a rotation quaternion from the angle and vector
+    theta = (degrees * DEGS_TO_RADS) / 2
+    factor = sin(theta)
+    q2w = cos(theta)
+    q2x = vector[0] * factor
+    q2y = vector[1] * factor
+    q2z = vector[2] * factor
+
+    # Multiply the given quaternion by the rotation quaternion
+    quaternion[0] = q1w * q2w - q1x * q2x - q1y * q2y - q1z * q2z
+    quaternion[1] = q1w * q2x + q1x * q2w + q1y * q2z - q1z * q2y
+    quaternion[2] = q1w * q2y - q1x * q2z + q1y * q2w + q1z * q2x
+    quaternion[3] = q1w * q2z + q1x * q2y - q1y * q2x + q1z * q2w
+
+
+@micropython.native
+def z_sort(map, map_size):
+    # Sorting a list of (value, key) tuples is by far the quickest way to sort in Python, it costs an
+    # allocation per pair but any in-place sort over the array would box a float on every comparison
+    pairs = [(map[i * 2 + 1], map[i * 2]) for i in range(map_size)]
+    pairs.sort()
+    for i in range(map_size):
+        value, key = pairs[i]
+        map[i * 2] = key
+        map[i * 2 + 1] = value
+
+
+# Flag used by bsp_traverse to mark a node whose own faces are next to be written out, and the child
+# index of a node that has no such child
+BSP_EMIT = const(0x8000)
+BSP_NO_NODE = const(0xffff)
+
+
+@micropython.native
+def bsp_traverse(nodes, normals, plane_dists, position, map):
+    x = position[0]
+    y = position[1]
+    z = position[2]
+    count = 0
+    stack = [0] if len(nodes) else []
+    while stack:
+        entry = stack.pop()
+        node = (entry & ~BSP_EMIT) * 4
+        first = nodes[node]
+        if entry & BSP_EMIT:
+            for f in range(first, first + nodes[node + 1]):
+                n = f * 3
+                if normals[n] * x + normals[n + 1] * y + normals[n + 2] * z >= plane_dists[f]:
+                    map[count * 2] = f
+                    count += 1
+            continue
+
+        # Which side of the node's plane the position is on decides which child is nearer, and entries
+        # are popped in the reverse order they are pushed
+        n = first * 3
+        if normals[n] * x + normals[n + 1] * y + normals[n + 2] * z >= plane_dists[first]:
+            near = nodes[node + 2]
+            far = nodes[node + 3]
+        else:
+            near = nodes[node + 3]
+            far = nodes[node + 2]
+        if near != BSP_NO_NODE:
+            stack.append(near)
+        stack.append(entry | BSP_EMIT)
+        if far != BSP_NO_NODE:
+            stack.append(far)
+    return count
+
+
+# Number of floats each particle takes up in a particle pool, and the screen coordinate given to particles
+# that can't be seen
+PARTICLE_SIZE = const(7)
+OFF_SCREEN = const(-32768)
+
+
+@micropython.native
+def p_update(pool, count, delta_t, acceleration, matrix, coords, width, height):
+    if count < 0 or count * PARTICLE_SIZE > len(pool) or count * 2 > len(coords):
+        raise ValueError("too many particles")
+    ax = acceleration[0] * delta_t
+    ay = acceleration[1] * delta_t
+    az = acceleration[2] * delta_t
+    m = matrix
+    i = 0
+    while i < count:
+        p = i * PARTICLE_SIZE
+        pool[p + 6] -= delta_t
+        if pool[p + 6] <= 0:
+            # The particle moved into this one's place still needs updating, so don't move on
+            count -= 1
+            last = count * PARTICLE_SIZE
+            for j in range(PARTICLE_SIZE):
+                pool[p + j] = pool[last + j]
+            continue
+        pool[p + 3] += ax
+        pool[p + 4] += ay
+        pool[p + 5] += az
+        pool[p] += pool[p + 3] * delta_t
+        pool[p + 1] += pool[p + 4] * delta_t
+        pool[p + 2] += pool[p + 5] * delta_t
+
+        px = pool[p]
+        py = pool[p + 1]
+        pz = pool[p + 2]
+        x = px * m[0] + py * m[4] + pz * m[8] + m[12]
+        y = px * m[1] + py * m[5] + pz * m[9] + m[13]
+        z = px * m[2] + py * m[6] + pz * m[10] + m[14]
+        w = px * m[3] + py * m[7] + pz * m[11] + m[15]
+        if w > 0 and -w < x and x < w and -w < y and y < w and 0 <= z and z <= w:
+            coords[i * 2] = int((x / w + 1) * 0.5 * width)
+            coords[i * 2 + 1] = int((1 - (y / w + 1) * 0.5) * height)
+        else:
+            coords[i * 2] = OFF_SCREEN
+            coords[i * 2 + 1] = OFF_SCREEN
+        i += 1
+    return count
+
+
+# Number of floats each body takes up in a rigid body state array
+BODY_SIZE = const(13)
+
+
+@micropython.native
+def b_update(state, count, delta_t, matrices):
+    if count < 0 or count * BODY_SIZE > len(state) or count * 16 > len(matrices):
+        raise ValueError("too many bodies")
+    for i in range(count):
+        b = i * BODY_SIZE
+        m = i * 16
+        state[b] += state[b + 3] * delta_t
+        state[b + 1] += state[b + 4] * delta_t
+        state[b + 2] += state[b + 5] * delta_t
+
+        # A body that isn't spinning keeps its orientation exactly
+        ax = state[b + 10]
+        ay = state[b + 11]
+        az = state[b + 12]
+        degrees = sqrt(ax * ax + ay * ay + az * az)
+        if degrees > 0:
+            theta = (degrees * delta_t * DEGS_TO_RADS) / 2
+            factor = sin(theta) / degrees
+            q1w = state[b + 6]
+            q1x = state[b + 7]
+            q1y = state[b + 8]
+            q1z = state[b + 9]
+            q2w = cos(theta)
+            q2x = ax * factor
+            q2y = ay * factor
+            q2z = az * factor
+            state[b + 6] = q1w * q2w - q1x * q2x - q1y * q2y - q1z * q2z
+            state[b + 7] = q1w * q2x + q1x * q2w + q1y * q2z - q1z * q2y
+            state[b + 8] = q1w * q2y - q1x * q2z + q1y * q2w + q1z * q2x
+            state[b + 9] = q1w * q2z + q1x * q2y - q1y * q2x + q1z * q2w
+
+        w = state[b + 6]
+        x = state[b + 7]
+        y = state[b + 8]
+        z = state[b + 9]
+        matrices[m] = 1 - 2 * (y * y + z * z)
+        matrices[m + 1] = 2 * (x * y - w * z)
+        matrices[m + 2] = 2 * (x * z + w * y)
+        matrices[m + 3] = 0
+        matrices[m + 4] = 2 * (x * y + w * z)
+        matrices[m + 5] = 1 - 2 * (x * x + z * z)
+        matrices[m + 6] = 2 * (y * z - w * x)
+        matrices[m + 7] = 0
+        matrices[m + 8] = 2 * (x * z - w * y)
+        matrices[m + 9] = 2 * (y * z + w * x)
+        matrices[m + 10] = 1 - 2 * (x * x + y * y)
+        matrices[m + 11] = 0
+        matrices[m + 12] = state[b]
+        matrices[m + 13] = state[b + 1]
+        matrices[m + 14] = state[b + 2]
+        matrices[m + 15] = 1
+
+
+# Child index of a BVH node that has no such child
+BVH_NO_NODE = const(0xffff)
+
+
+@micropython.native
+def _bvh_transform(v, w, m, dest):
+    for i in range(3):
+        dest[i] = v[0] * m[i] + v[1] * m[4 + i] + v[2] * m[8 + i] + w * m[12 + i]
+
+
+@micropython.native
+def bvh_ray(nodes, boxes, triangles, vertices, m_inverse, ray):
+    if len(ray) < 7:
+        raise ValueError("ray is too small")
+    o = [0.0, 0.0, 0.0]
+    d = [0.0, 0.0, 0.0]
+    _bvh_transform(ray, 1, m_inverse, o)
+    _bvh_transform(memoryview(ray)[3:], 0, m_inverse, d)
+    nearest = ray[6]
+    face = -1
+    stack = [0] if len(nodes) else []
+    while stack:
+        node = stack.pop()
+
+        # Skip the node if the ray misses its box, or only reaches it beyond the nearest hit so far
+        box = node * 6
+        t_near = 0
+        t_far = nearest
+        for j in range(3):
+            if t_near > t_far:
+                break
+            if d[j] == 0:
+                if o[j] < boxes[box + j] or o[j] > boxes[box + j + 3]:
+                    t_far = -1
+                continue
+            t1 = (boxes[box + j] - o[j]) / d[j]
+            t2 = (boxes[box + j + 3] - o[j]) / d[j]
+            if t1 > t2:
+                t1, t2 = t2, t1
+            t_near = max(t1, t_near)
+            t_far = min(t2, t_far)
+        if t_near > t_far:
+            continue
+
+        node *= 4
+        first = nodes[node]
+        if nodes[node + 1] == 0:
+            stack.append(nodes[node + 3])
+            stack.append(nodes[node + 2])
+            continue
+        for t in range(first * 4, (first + nodes[node + 1]) * 4, 4):
+            a = triangles[t] * 3
+            b = triangles[t + 1] * 3
+            c = triangles[t + 2] * 3
+            e1x = vertices[b] - vertices[a]
+            e1y = vertices[b + 1] - vertices[a + 1]
+            e1z = vertices[b + 2] - vertices[a + 2]
+            e2x = vertices[c] - vertices[a]
+            e2y = vertices[c + 1] - vertices[a + 1]
+            e2z = vertices[c + 2] - vertices[a + 2]
+            px = d[1] * e2z - d[2] * e2y
+            py = d[2] * e2x - d[0] * e2z
+            pz = d[0] * e2y - d[1] * e2x
+            det = e1x * px + e1y * py + e1z * pz
+            if det == 0:
+                continue
+            inv_det = 1 / det
+            sx = o[0] - vertices[a]
+            sy = o[1] - vertices[a + 1]
+            sz = o[2] - vertices[a + 2]
+            u = (sx * px + sy * py + sz * pz) * inv_det
+            if u < 0 or u > 1:
+                continue
+            qx = sy * e1z - sz * e1y
+            qy = sz * e1x - sx * e1z
+            qz = sx * e1y - sy * e1x
+            v = (d[0] * qx + d[1] * qy + d[2] * qz) * inv_det
+            if v < 0 or u + v > 1:
+                continue
+            dist = (e2x * qx + e2y * qy + e2z * qz) * inv_det
+            if 0 <= dist < nearest:
+                nearest = dist
+                face = triangles[t + 3]
+    ray[6] = nearest
+    return face
+
+
+@micropython.native
+def _closest_on_triangle(p, vertices, a, b, c, dest):
+    ab = [vertices[b + i] - vertices[a + i] for i in range(3)]
+    ac = [vertices[c + i] - vertices[a + i] for i in range(3)]
+    ap = [p[i] - vertices[a + i] for i in range(3)]
+    bp = [p[i] - vertices[b + i] for i in range(3)]
+    cp = [p[i] - vertices[c + i] for i in range(3)]
+    d1 = ab[0] * ap[0] + ab[1] * ap[1] + ab[2] * ap[2]
+    d2 = ac[0] * ap[0] + ac[1] * ap[1] + ac[2] * ap[2]
+    d3 = ab[0] * bp[0] + ab[1] * bp[1] + ab[2] * bp[2]
+    d4 = ac[0] * bp[0] + ac[1] * bp[1] + ac[2] * bp[2]
+    d5 = ab[0] * cp[0] + ab[1] * cp[1] + ab[2] * cp[2]
+    d6 = ac[0] * cp[0] + ac[1] * cp[1] + ac[2] * cp[2]
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+    corner = a
+    u = 0
+    v = 0
+    if d1 <= 0 and d2 <= 0:
+        corner = a
+    elif d3 >= 0 and d4 <= d3:
+        corner = b
+    elif d6 >= 0 and d5 <= d6:
+        corner = c
+    elif vc <= 0 and d1 >= 0 and d3 <= 0:
+        u = d1 / (d1 - d3)
+    elif vb <= 0 and d2 >= 0 and d6 <= 0:
+        v = d2 / (d2 - d6)
+    elif va <= 0 and d4 - d3 >= 0 and d5 - d6 >= 0:
+        v = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        u = 1 - v
+    else:
+        denom = 1 / (va + vb + vc)
+        u = vb * denom
+        v = vc * denom
+    for i in range(3):
+        dest[i] = vertices[corner + i] + ab[i] * u + ac[i] * v
+
+
+@micropython.native
+def bvh_sphere(nodes, boxes, triangles, vertices, m_inverse, sphere, faces):
+    centre = [0.0, 0.0, 0.0]
+    closest = [0.0, 0.0, 0.0]
+    _bvh_transform(sphere, 1, m_inverse, centre)
+    radius_sq = sphere[3] * sphere[3]
+    max_faces = len(faces)
+    count = 0
+    stack = [0] if len(nodes) else []
+    while stack and count < max_faces:
+        node = stack.pop()
+
+        # Skip the node if the point of its box that is nearest the sphere's centre is outside the sphere
+        box = node * 6
+        dist_sq = 0
+        for j in range(3):
+            c = centre[j]
+            if c < boxes[box + j]:
+                dist_sq += (boxes[box + j] - c) ** 2
+            elif c > boxes[box + j + 3]:
+                dist_sq += (c - boxes[box + j + 3]) ** 2
+        if dist_sq > radius_sq:
+            continue
+
+        node *= 4
+        first = nodes[node]
+        if nodes[node + 1] == 0:
+            stack.append(nodes[node + 3])
+            stack.append(nodes[node + 2])
+            continue
+        for t in range(first * 4, (first + nodes[node + 1]) * 4, 4):
+            if count == max_faces:
+                break
+            _closest_on_triangle(centre, vertices, triangles[t] * 3, triangles[t + 1] * 3, triangles[t + 2] * 3,
+                                 closest)
+            dx = closest[0] - centre[0]
+            dy = closest[1] - centre[1]
+            dz = closest[2] - centre[2]
+            if dx * dx + dy * dy + dz * dz <= radius_sq:
+                face = triangles[t + 3]
+                if count == 0 or faces[count - 1] != face:
+                    faces[count] = face
+                    count += 1
+    return count
+
+
+# Flag used by fb_delta_rle to mark a run of a repeated value, as opposed to a run of literal values
+RLE_REPEAT = const(0x8000)
+RLE_MAX_RUN = const(0x7fff)
+
+
+# Viper functions can't take more than four arguments, so functions with more arguments are split into
+# a native function that puts the rest of the arguments in here, and a viper function that does the work
+_params = array('i', [0, 0, 0, 0, 0, 0])
+
+
+@micropython.native
+def fb_delta_rle(buffer, previous, output, start, keyframe):
+    params = _params
+    params[0] = start
+    params[1] = 1 if keyframe else 0
+    return _fb_delta_rle(buffer, previous, output, params)
+
+
+@micropython.viper
+def _fb_delta_rle(buffer, previous, output, params) -> object:
+    p = ptr32(params)
+    start = p[0]
+    keyframe = p[1]
+    cur = ptr16(buffer)
+    prev = ptr16(previous)
+    out = ptr16(output)
+    length = int(len(buffer))
+    if int(len(previous)) < length:
+        length = int(len(previous))
+    length >>= 1
+    out_len = int(len(output)) >> 1
+
+    # Masking the previous frame to nothing encodes the difference from a blank frame
+    mask = 0
+    if not keyframe:
+        mask = 0xffff
+
+    i = start
+    o = 0
+    while i < length and o + 2 <= out_len:
+        d = cur[i] ^ (prev[i] & mask)
+        run = 1
+        while i + run < length and run < RLE_MAX_RUN and (cur[i + run] ^ (prev[i + run] & mask)) == d:
+            run += 1
+        if run > 1:
+            out[o] = RLE_REPEAT | run
+            out[o + 1] = d
+            o += 2
+        else:
+            # Gather literal values until the start of the next run of repeated values, or until the
+            # output buffer is full
+            max_run = out_len - o - 1
+            if max_run > RLE_MAX_RUN:
+                max_run = RLE_MAX_RUN
+            while i + run < length and run < max_run:
+                k = i + run
+                if k + 1 < length and (cur[k] ^ (prev[k] & mask)) == (cur[k + 1] ^ (prev[k + 1] & mask)):
+                    break
+                run += 1
+            out[o] = run
+            o += 1
+            for k in range(i, i + run):
+                out[o] = cur[k] ^ (prev[k] & mask)
+                o += 1
+        # Remember the encoded pixels, they form the previous frame next time
+        for k in range(i, i + run):
+            prev[k] = cur[k]
+        i += run
+
+    return (i, o * 2)
+
+
+@micropython.native
+def fb_lines(buffer, width, height, y, coords, colours, count):
+    params = _params
+    params[0] = width
+    params[1] = height
+    params[2] = y
+    params[3] = count
+    # Framebuffers of 8-bit palette indices are half the size of RGB565 framebuffers
+    params[4] = 1 if len(buffer) < width * height * 2 else 0
+    _fb_lines(buffer, coords, colours, params)
+
+
+@micropython.viper
+def _fb_lines(buffer, coords, colours, params):
+    buf = ptr16(buffer)
+    buf8 = ptr8(buffer)
+    c = ptr16(coords)
+    col = ptr16(colours)
+    p = ptr32(params)
+    width = p[0]
+    height = p[1]
+    top = p[2]
+    count = p[3]
+    indexed = p[4]
+    for i in range(count):
+        # Coordinates are signed but come out of the pointer unsigned
+        x1 = int(c[i * 4] ^ 0x8000) - 0x8000
+        y1 = int(c[i * 4 + 1] ^ 0x8000) - 0x8000 - top
+        x2 = int(c[i * 4 + 2] ^ 0x8000) - 0x8000
+        y2 = int(c[i * 4 + 3] ^ 0x8000) - 0x8000 - top
+
+        # Skip lines that are entirely to one side of the framebuffer
+        if (x1 < 0 and x2 < 0) or (x1 >= width and x2 >= width) or (y1 < 0 and y2 < 0) or (y1 >= height and y2 >= height):
+            continue
+        colour = col[i] & 0xff if indexed else ((col[i] & 0xff) << 8) | (col[i] >> 8)
+
+        # The same line drawing algorithm as the framebuf module
+        dx = x2 - x1
+        sx = 1
+        if dx <= 0:
+            dx = -dx
+            sx = -1
+        dy = y2 - y1
+        sy = 1
+        if dy <= 0:
+            dy = -dy
+            sy = -1
+        steep = 0
+        if dy > dx:
+            temp = x1
+            x1 = y1
+            y1 = temp
+            temp = dx
+            dx = dy
+            dy = temp
+            temp = sx
+            sx = sy
+            sy = temp
+            steep = 1
+        e = 2 * dy - dx
+        for _ in range(dx):
+            if steep:
+                if 0 <= y1 and y1 < width and 0 <= x1 and x1 < height:
+                    if indexed:
+                        buf8[x1 * width + y1] = colour
+                    else:
+                        buf[x1 * width + y1] = colour
+            else:
+                if 0 <= x1 and x1 < width and 0 <= y1 and y1 < height:
+                    if indexed:
+                        buf8[y1 * width + x1] = colour
+                    else:
+                        buf[y1 * width + x1] = colour
+            while e >= 0:
+                y1 += sy
+                e -= 2 * dx
+            x1 += sx
+            e += 2 * dy
+        if 0 <= x2 and x2 < width and 0 <= y2 and y2 < height:
+            if indexed:
+                buf8[y2 * width + x2] = colour
+            else:
+                buf[y2 * width + x2] = colour
+
+
+@micropython.native
+def fb_points(buffer, width, height, y, coords, colours, count):
+    params = _params
+    params[0] = width
+    params[1] = height
+    params[2] = y
+    params[3] = count
+    params[4] = 1 if len(buffer) < width * height * 2 else 0
+    _fb_points(buffer, coords, colours, params)
+
+
+@micropython.viper
+def _fb_points(buffer, coords, colours, params):
+    buf = ptr16(buffer)
+    buf8 = ptr8(buffer)
+    c = ptr16(coords)
+    col = ptr16(colours)
+    p = ptr32(params)
+    width = p[0]
+    height = p[1]
+    top = p[2]
+    count = p[3]
+    indexed = p[4]
+    for i in range(count):
+        x = int(c[i * 2] ^ 0x8000) - 0x8000
+        y = int(c[i * 2 + 1] ^ 0x8000) - 0x8000 - top
+        if 0 <= x and x < width and 0 <= y and y < height:
+            if indexed:
+                buf8[y * width + x] = col[i] & 0xff
+            else:
+                buf[y * width + x] = ((col[i] & 0xff) << 8) | (col[i] >> 8)
+
+
+@micropython.native
+def fb_particles(buffer, width, height, y, coords, count, colour, size):
+    params = _params
+    params[0] = width
+    params[1] = height
+    params[2] = y
+    params[3] = count
+    params[4] = 1 if len(buffer) < width * height * 2 else 0
+    params[5] = size
+    _fb_particles(buffer, coords, params, colour)
+
+
+@micropython.viper
+def _fb_particles(buffer, coords, params, colour: int):
+    buf = ptr16(buffer)
+    buf8 = ptr8(buffer)
+    c = ptr16(coords)
+    p = ptr32(params)
+    width = p[0]
+    height = p[1]
+    top = p[2]
+    count = p[3]
+    indexed = p[4]
+    size = p[5]
+    if not indexed:
+        colour = ((colour & 0xff) << 8) | ((colour >> 8) & 0xff)
+    offset = (size - 1) // 2
+    for i in range(count):
+        x1 = int(c[i * 2] ^ 0x8000) - 0x8000 - offset
+        y1 = int(c[i * 2 + 1] ^ 0x8000) - 0x8000 - top - offset
+        x2 = x1 + size
+        y2 = y1 + size
+        if x1 < 0:
+            x1 = 0
+        if y1 < 0:
+            y1 = 0
+        if x2 > width:
+            x2 = width
+        if y2 > height:
+            y2 = height
+        for y in range(y1, y2):
+            for x in range(x1, x2):
+                if indexed:
+                    buf8[y * width + x] = colour
+                else:
+                    buf[y * width + x] = colour
+
+
+@micropython.viper
+def fb_expand(buffer, start: int, palette, output) -> int:
+    if int(len(palette)) < 256:
+        raise ValueError("palette must have 256 colours")
+    buf = ptr8(buffer)
+    pal = ptr16(palette)
+    out = ptr16(output)
+    count = int(len(output)) // 2
+    if start < 0:
+        start = 0
+    if count > int(len(buffer)) - start:
+        count = int(len(buffer)) - start
+    for i in range(count):
+        out[i] = pal[buf[start + i]]
+    return count if count > 0 else 0
+
+
+@micropython.viper
+def fb_upscale(buffer, width: int, height: int):
+    if int(len(buffer)) < width * height:
+        raise ValueError("buffer is too small")
+    indexed = int(len(buffer)) < width * height * 2
+    buf = ptr16(buffer)
+    buf8 = ptr8(buffer)
+    half_width = (width + 1) // 2
+    y = (height + 1) // 2 - 1
+    while y >= 0:
+        x = half_width - 1
+        while x >= 0:
+            src = y * half_width + x
+            col = int(buf8[src]) if indexed else int(buf[src])
+            # Write the bottom row of the doubled pixel first, it is furthest from the pixel being read
+            for j in range(2):
+                row = y * 2 + 1 - j
+                for i in range(2):
+                    column = x * 2 + 1 - i
+                    if column < width and row < height:
+                        if indexed:
+                            buf8[row * width + column] = col
+                        else:
+                            buf[row * width + column] = col
+            x -= 1
+        y -= 1
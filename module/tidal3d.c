@@ -1,4 +1,5 @@
 #include <math.h>
+#include <string.h>
 
 #include "py/runtime.h"
 #include "py/binary.h"
@@ -229,6 +230,42 @@ STATIC mp_obj_t v_multiply_batch(size_t n_args, const mp_obj_t *args) {
 }
 STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(v_multiply_batch_obj, 2, 3, v_multiply_batch);
 
+/**
+ * Linearly interpolates between two sets of 3D vectors, such as two keyframes of a vertex animation,
+ * writing the results into the given list of 3D vectors
+ *
+ * frame1: An array of x, y, z values for each vector, the vectors when the factor is 0
+ * frame2: An array of x, y, z values for each vector, the vectors when the factor is 1
+ * factor: How far to interpolate from the first set of vectors to the second
+ * dests: A list of 3D vectors where the results will be written, one for each vector in the frames
+ */
+STATIC mp_obj_t v_lerp_batch(size_t n_args, const mp_obj_t *args) {
+	mp_buffer_info_t frame1_buffer, frame2_buffer, dest_buffer;
+	mp_get_buffer_raise(args[0], &frame1_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[1], &frame2_buffer, MP_BUFFER_READ);
+	mp_float_t t = mp_obj_get_float(args[2]);
+
+	size_t list_len;
+	mp_obj_t *dest_list;
+	mp_obj_get_array(args[3], &list_len, &dest_list);
+	if (frame1_buffer.len < list_len * 12 || frame2_buffer.len < list_len * 12) {
+		mp_raise_ValueError(MP_ERROR_TEXT("frames are too small"));
+	}
+
+	float *frame1 = (float *)frame1_buffer.buf;
+	float *frame2 = (float *)frame2_buffer.buf;
+	for (size_t j = 0; j < list_len; j++) {
+		mp_get_buffer_raise(dest_list[j], &dest_buffer, MP_BUFFER_WRITE);
+		for (size_t i = 0; i < 3; i++) {
+			mp_float_t a = frame1[j * 3 + i];
+			((float *)dest_buffer.buf)[i] = a + (frame2[j * 3 + i] - a) * t;
+		}
+	}
+
+	return mp_const_none;
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(v_lerp_batch_obj, 4, 4, v_lerp_batch);
+
 /**
  * Returns a scalar value of 0 if the given 3D vectors are exactly perpendicular, <0 if the angle
  * between them is greater than 90° or >0 if the angle between them is less than 90° (dot product)
@@ -308,6 +345,166 @@ STATIC mp_obj_t v_ndc_to_screen(size_t n_args, const mp_obj_t *args) {
 }
 STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(v_ndc_to_screen_obj, 4, 4, v_ndc_to_screen);
 
+// A triangle clipped against the five planes used by v_clip_to_screen can gain a vertex for each plane
+#define CLIP_MAX_VERTICES (8)
+
+// Internal helper to find the signed distance of a vertex in clip space from one of the planes used by
+// v_clip_to_screen, a vertex is on the inside of the plane when the distance is not negative
+STATIC mp_float_t clip_distance(const mp_float_t *v, size_t plane, mp_float_t guard) {
+	switch (plane) {
+		case 0:
+			// Near
+			return v[2];
+		case 1:
+			// Left, at the edge of the guard band
+			return v[0] + guard * v[3];
+		case 2:
+			// Right, at the edge of the guard band
+			return guard * v[3] - v[0];
+		case 3:
+			// Bottom, at the edge of the screen
+			return v[1] + v[3];
+		default:
+			// Top, at the edge of the screen
+			return v[3] - v[1];
+	}
+}
+
+// Internal helper to clip a polygon against one plane, the Sutherland-Hodgman way: walking around the
+// polygon's edges, vertices inside the plane are kept, and wherever an edge crosses the plane a new
+// vertex is made where it crosses; returns the number of vertices in the clipped polygon
+STATIC size_t clip_polygon(mp_float_t (*in)[4], size_t n, mp_float_t (*out)[4], size_t plane, mp_float_t guard) {
+	size_t m = 0;
+	const mp_float_t *prev = in[n - 1];
+	mp_float_t d_prev = clip_distance(prev, plane, guard);
+	for (size_t i = 0; i < n; i++) {
+		const mp_float_t *cur = in[i];
+		mp_float_t d_cur = clip_distance(cur, plane, guard);
+		if ((d_prev < 0) != (d_cur < 0)) {
+			mp_float_t t = d_prev / (d_prev - d_cur);
+			for (size_t j = 0; j < 4; j++) {
+				out[m][j] = prev[j] + (cur[j] - prev[j]) * t;
+			}
+			m++;
+		}
+		if (d_cur >= 0) {
+			memcpy(out[m++], cur, sizeof(out[0]));
+		}
+		prev = cur;
+		d_prev = d_cur;
+	}
+	return m;
+}
+
+/**
+ * Projects a triangle from camera coordinates onto the screen, clipping it so that nothing behind the
+ * near plane or off the top or bottom of the screen is drawn, and so that the screen coordinates stay
+ * small; a clipped triangle becomes a polygon, which is written out as a fan of triangles
+ *
+ * Clipping is done in clip space, before the perspective division, where vertices behind the camera are
+ * still well behaved; triangles that are entirely inside are not clipped at all and triangles that are
+ * entirely outside one of the planes are dropped, so only triangles that cross a plane cost any more
+ *
+ * Left and right are clipped against a guard band rather than the edges of the screen, because filling
+ * a polygon that overhangs the sides of the screen costs very little, but clipping it costs more
+ *
+ * vectors: Vertices for a single face in camera coordinates as a list of three arrays
+ * matrix: The projection matrix
+ * coords: A pre-allocated array of screen coordinates with six values for each triangle
+ * index: The index of the triangle in coords to start writing at, there must be room for as many
+ *        triangles as the face is clipped into, up to six
+ * width: Width of the screen in pixels
+ * height: Height of the screen in pixels
+ * guard: Width of the guard band, as a multiple of the distance from the centre of the screen to its
+ *        left and right edges
+ *
+ * Returns the number of triangles written, which is zero if none of the triangle can be seen
+ */
+STATIC mp_obj_t v_clip_to_screen(size_t n_args, const mp_obj_t *args) {
+	mp_obj_t *vecs;
+	mp_obj_get_array_fixed_n(args[0], 3, &vecs);
+
+	mp_buffer_info_t mat_buffer, coord_buffer, vec_buffer;
+	mp_get_buffer_raise(args[1], &mat_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[2], &coord_buffer, MP_BUFFER_WRITE);
+	size_t index = mp_obj_get_int(args[3]);
+	mp_float_t w = mp_obj_get_float(args[4]);
+	mp_float_t h = mp_obj_get_float(args[5]);
+	mp_float_t guard = mp_obj_get_float(args[6]);
+	if (mat_buffer.len < 64) {
+		mp_raise_ValueError(MP_ERROR_TEXT("matrix is too small"));
+	}
+	float *mat = (float *)mat_buffer.buf;
+
+	// Transform the vertices into clip space, and work out which planes each one is outside of
+	mp_float_t poly[2][CLIP_MAX_VERTICES][4];
+	int outside_all = 0x1f;
+	int outside_any = 0;
+	for (size_t i = 0; i < 3; i++) {
+		mp_get_buffer_raise(vecs[i], &vec_buffer, MP_BUFFER_READ);
+		mp_float_t x = ((float *)vec_buffer.buf)[0];
+		mp_float_t y = ((float *)vec_buffer.buf)[1];
+		mp_float_t z = ((float *)vec_buffer.buf)[2];
+		for (size_t j = 0; j < 4; j++) {
+			poly[0][i][j] = x * mat[j] + y * mat[4 + j] + z * mat[8 + j] + mat[12 + j];
+		}
+		int outside = 0;
+		for (size_t plane = 0; plane < 5; plane++) {
+			if (clip_distance(poly[0][i], plane, guard) < 0) {
+				outside |= 1 << plane;
+			}
+		}
+		outside_all &= outside;
+		outside_any |= outside;
+	}
+
+	// Nothing can be seen if every vertex is outside the same plane
+	if (outside_all) {
+		return mp_obj_new_int(0);
+	}
+
+	// Clip against each plane that any vertex is outside of
+	size_t n = 3;
+	size_t cur = 0;
+	for (size_t plane = 0; plane < 5 && n >= 3; plane++) {
+		if (outside_any & (1 << plane)) {
+			n = clip_polygon(poly[cur], n, poly[1 - cur], plane, guard);
+			cur = 1 - cur;
+		}
+	}
+	if (n < 3) {
+		return mp_obj_new_int(0);
+	}
+
+	// Perspective division and conversion to screen coordinates, the same as v_multiply followed by
+	// v_ndc_to_screen, so unclipped triangles come out exactly the same
+	mp_int_t xy[CLIP_MAX_VERTICES][2];
+	for (size_t i = 0; i < n; i++) {
+		mp_float_t *v = poly[cur][i];
+		float ndc_x = v[3] != 1 ? v[0] / v[3] : v[0];
+		float ndc_y = v[3] != 1 ? v[1] / v[3] : v[1];
+		xy[i][0] = (ndc_x + 1) * 0.5 * w;
+		xy[i][1] = (1 - (ndc_y + 1) * 0.5) * h;
+	}
+
+	// Write the polygon out as a fan of triangles around its first vertex
+	size_t num_coords = coord_buffer.len / mp_binary_get_size('@', coord_buffer.typecode, NULL);
+	if ((index + n - 2) * 6 > num_coords) {
+		mp_raise_ValueError(MP_ERROR_TEXT("coords is too small"));
+	}
+	for (size_t i = 1; i + 1 < n; i++) {
+		size_t k = (index + i - 1) * 6;
+		mp_binary_set_val_array_from_int(coord_buffer.typecode, coord_buffer.buf, k, xy[0][0]);
+		mp_binary_set_val_array_from_int(coord_buffer.typecode, coord_buffer.buf, k + 1, xy[0][1]);
+		mp_binary_set_val_array_from_int(coord_buffer.typecode, coord_buffer.buf, k + 2, xy[i][0]);
+		mp_binary_set_val_array_from_int(coord_buffer.typecode, coord_buffer.buf, k + 3, xy[i][1]);
+		mp_binary_set_val_array_from_int(coord_buffer.typecode, coord_buffer.buf, k + 4, xy[i + 1][0]);
+		mp_binary_set_val_array_from_int(coord_buffer.typecode, coord_buffer.buf, k + 5, xy[i + 1][1]);
+	}
+	return mp_obj_new_int(n - 2);
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(v_clip_to_screen_obj, 7, 7, v_clip_to_screen);
+
 // Internal helper to calculate matrix multiplication used by m_multiply, m_translate and m_rotate
 STATIC void m_multiply_internal(float *dest, float *mat1, float *mat2) {
 	float m0[4], m1[4], m2[4], m3[4];
@@ -483,6 +680,961 @@ STATIC mp_obj_t z_sort(size_t n_args, const mp_obj_t *args) {
 }
 STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(z_sort_obj, 2, 2, z_sort);
 
+// Flag used by bsp_traverse to mark a node whose own faces are next to be written out, as opposed to a
+// node whose children are still to be visited, and the child index of a node that has no such child
+#define BSP_EMIT (0x8000)
+#define BSP_NO_NODE (0xffff)
+
+// Deepest BSP tree that bsp_traverse can walk, and so the most entries its stack can need, since each
+// node visited replaces itself on the stack with up to three entries
+#define BSP_MAX_DEPTH (128)
+#define BSP_STACK_SIZE (BSP_MAX_DEPTH * 2 + 1)
+
+/**
+ * Walks a mesh's BSP tree, see tools/pack_bundle.py, and writes the indices of the faces that face the
+ * given position into a face index/depth map in order from back to front as seen from that position,
+ * so drawing them in that order needs no depth sort; the depths in the map are left alone
+ *
+ * At each node, the child on the far side of the plane of the node's faces from the position is written
+ * first, then the node's faces, then the child on the near side, so nothing is written before anything
+ * that could be in front of it
+ *
+ * nodes: An array of unsigned shorts, four for each node, the first of which is the root: the index
+ *   of the node's first face, its number of faces, and its front and back child nodes; a node's faces
+ *   are consecutive faces of the mesh that all lie in the plane of its first face
+ * normals: An array containing the x, y, z of each face's normal one after another
+ * plane_dists: An array containing the distance of each face's plane from the origin along its normal
+ * position: A 3D vector of the viewing position in the mesh's object space
+ * map: An array of face index/depth pairs to write the face indices into
+ *
+ * Returns the number of faces written
+ */
+STATIC mp_obj_t bsp_traverse(size_t n_args, const mp_obj_t *args) {
+	mp_buffer_info_t nodes_buffer, normals_buffer, dists_buffer, pos_buffer, map_buffer;
+	mp_get_buffer_raise(args[0], &nodes_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[1], &normals_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[2], &dists_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[3], &pos_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[4], &map_buffer, MP_BUFFER_WRITE);
+
+	const uint16_t *nodes = (const uint16_t *)nodes_buffer.buf;
+	const float *normals = (const float *)normals_buffer.buf;
+	const float *plane_dists = (const float *)dists_buffer.buf;
+	const float *pos = (const float *)pos_buffer.buf;
+	float *map = (float *)map_buffer.buf;
+	size_t num_nodes = nodes_buffer.len / 8;
+	size_t num_faces = dists_buffer.len / 4;
+	if (normals_buffer.len / 12 < num_faces) {
+		num_faces = normals_buffer.len / 12;
+	}
+	if (map_buffer.len / 8 < num_faces) {
+		num_faces = map_buffer.len / 8;
+	}
+
+	uint16_t stack[BSP_STACK_SIZE];
+	size_t top = 0;
+	size_t count = 0;
+	if (num_nodes > 0) {
+		stack[top++] = 0;
+	}
+	while (top > 0) {
+		uint16_t entry = stack[--top];
+		const uint16_t *node = nodes + (entry & ~BSP_EMIT) * 4;
+		size_t first = node[0];
+		size_t last = first + node[1];
+		if (last > num_faces || (node[1] == 0 && !(entry & BSP_EMIT))) {
+			mp_raise_ValueError(MP_ERROR_TEXT("BSP node faces out of range"));
+		}
+
+		if (entry & BSP_EMIT) {
+			// Write the node's faces that face the position, faces in the same plane can't overlap
+			// each other so they can be written in any order
+			for (size_t f = first; f < last; f++) {
+				const float *n = normals + f * 3;
+				if (n[0] * pos[0] + n[1] * pos[1] + n[2] * pos[2] >= plane_dists[f]) {
+					map[count * 2] = f;
+					count++;
+				}
+			}
+			continue;
+		}
+
+		// Which side of the node's plane the position is on decides which child is nearer
+		const float *n = normals + first * 3;
+		bool in_front = n[0] * pos[0] + n[1] * pos[1] + n[2] * pos[2] >= plane_dists[first];
+		uint16_t near = in_front ? node[2] : node[3];
+		uint16_t far = in_front ? node[3] : node[2];
+		if (top + 3 > BSP_STACK_SIZE) {
+			mp_raise_ValueError(MP_ERROR_TEXT("BSP tree is too deep"));
+		}
+		if ((near != BSP_NO_NODE && near >= num_nodes) || (far != BSP_NO_NODE && far >= num_nodes)) {
+			mp_raise_ValueError(MP_ERROR_TEXT("BSP node child out of range"));
+		}
+
+		// Entries are popped in the reverse order they are pushed
+		if (near != BSP_NO_NODE) {
+			stack[top++] = near;
+		}
+		stack[top++] = entry | BSP_EMIT;
+		if (far != BSP_NO_NODE) {
+			stack[top++] = far;
+		}
+	}
+
+	return mp_obj_new_int(count);
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(bsp_traverse_obj, 5, 5, bsp_traverse);
+
+// Number of floats each particle takes up in a particle pool: its position, its velocity, and how many
+// seconds it has left to live
+#define PARTICLE_SIZE (7)
+
+// Screen coordinate given to particles that can't be seen, which is off the edge of any framebuffer
+#define OFF_SCREEN (-32768)
+
+/**
+ * Moves and ages a pool of particles, recycles the particles whose lifetimes have run out, and works
+ * out the screen coordinates of the rest, so that a whole particle system is updated in a single call
+ *
+ * pool: An array of floats, PARTICLE_SIZE for each particle: x, y, z of its position, x, y, z of its
+ *       velocity, and its remaining lifetime in seconds; the live particles are at the start of the
+ *       pool, and when a particle's lifetime runs out the last live particle is moved into its place
+ * count: Number of live particles
+ * delta_t: Time to move the particles on by, in seconds
+ * acceleration: A 3D vector added to the velocity of every particle each second, such as gravity
+ * matrix: A 4x4 matrix that transforms world coordinates to clip coordinates, that is the combined view
+ *         and projection matrix
+ * coords: A signed 16-bit array to write the x, y screen coordinates of each live particle into,
+ *         particles outside the viewable space are given coordinates that are off the screen
+ * width: Width of the screen in pixels
+ * height: Height of the screen in pixels
+ *
+ * Returns the number of live particles
+ */
+STATIC mp_obj_t p_update(size_t n_args, const mp_obj_t *args) {
+	mp_buffer_info_t pool_buffer, accel_buffer, matrix_buffer, coord_buffer;
+	mp_get_buffer_raise(args[0], &pool_buffer, MP_BUFFER_RW);
+	mp_int_t count = mp_obj_get_int(args[1]);
+	mp_float_t delta_t = mp_obj_get_float(args[2]);
+	mp_get_buffer_raise(args[3], &accel_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[4], &matrix_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[5], &coord_buffer, MP_BUFFER_WRITE);
+	mp_float_t width = mp_obj_get_float(args[6]);
+	mp_float_t height = mp_obj_get_float(args[7]);
+	if (count < 0 || (size_t)count * PARTICLE_SIZE * 4 > pool_buffer.len || (size_t)count * 4 > coord_buffer.len) {
+		mp_raise_ValueError(MP_ERROR_TEXT("too many particles"));
+	}
+
+	float *pool = (float *)pool_buffer.buf;
+	const float *accel = (const float *)accel_buffer.buf;
+	const float *m = (const float *)matrix_buffer.buf;
+	int16_t *coords = (int16_t *)coord_buffer.buf;
+	mp_int_t i = 0;
+	while (i < count) {
+		float *p = pool + i * PARTICLE_SIZE;
+		p[6] -= delta_t;
+		if (p[6] <= 0) {
+			// The particle moved into this one's place still needs updating, so don't move on
+			count--;
+			memcpy(p, pool + count * PARTICLE_SIZE, PARTICLE_SIZE * sizeof(float));
+			continue;
+		}
+		for (size_t j = 0; j < 3; j++) {
+			p[j + 3] += accel[j] * delta_t;
+			p[j] += p[j + 3] * delta_t;
+		}
+
+		// Project the particle in the same way as v_multiply and v_ndc_to_screen would, skipping it if
+		// it is outside the viewable space, including behind the camera
+		mp_float_t x = p[0] * m[0] + p[1] * m[4] + p[2] * m[8] + m[12];
+		mp_float_t y = p[0] * m[1] + p[1] * m[5] + p[2] * m[9] + m[13];
+		mp_float_t z = p[0] * m[2] + p[1] * m[6] + p[2] * m[10] + m[14];
+		mp_float_t w = p[0] * m[3] + p[1] * m[7] + p[2] * m[11] + m[15];
+		if (w > 0 && -w < x && x < w && -w < y && y < w && 0 <= z && z <= w) {
+			coords[i * 2] = (x / w + 1) * 0.5 * width;
+			coords[i * 2 + 1] = (1 - (y / w + 1) * 0.5) * height;
+		} else {
+			coords[i * 2] = OFF_SCREEN;
+			coords[i * 2 + 1] = OFF_SCREEN;
+		}
+		i++;
+	}
+
+	return mp_obj_new_int(count);
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(p_update_obj, 8, 8, p_update);
+
+// Number of floats each body takes up in a rigid body state array: its position, its velocity, its
+// orientation quaternion, and its angular velocity
+#define BODY_SIZE (13)
+
+/**
+ * Moves a batch of rigid bodies on by the given time, and writes the model matrix of each body, so that
+ * any number of moving objects are updated in a single call
+ *
+ * Each body is moved and turned in the same way as Mesh.update moves a single mesh with v_scale, v_add
+ * and q_rotate, and its model matrix is the identity matrix rotated by its orientation with m_rotate
+ * and then translated by its position with m_translate
+ *
+ * state: An array of floats, BODY_SIZE for each body: x, y, z of its position, x, y, z of its velocity,
+ *        w, x, y, z of its orientation, and x, y, z of its angular velocity, which is the axis it spins
+ *        around scaled by the number of degrees it spins a second
+ * count: Number of bodies
+ * delta_t: Time to move the bodies on by, in seconds, which can be zero to only write the matrices
+ * matrices: An array of floats to write a 4x4 model matrix into for each body
+ */
+STATIC mp_obj_t b_update(size_t n_args, const mp_obj_t *args) {
+	mp_buffer_info_t state_buffer, matrix_buffer;
+	mp_get_buffer_raise(args[0], &state_buffer, MP_BUFFER_RW);
+	mp_int_t count = mp_obj_get_int(args[1]);
+	mp_float_t delta_t = mp_obj_get_float(args[2]);
+	mp_get_buffer_raise(args[3], &matrix_buffer, MP_BUFFER_WRITE);
+	if (count < 0 || (size_t)count * BODY_SIZE * 4 > state_buffer.len || (size_t)count * 64 > matrix_buffer.len) {
+		mp_raise_ValueError(MP_ERROR_TEXT("too many bodies"));
+	}
+
+	for (mp_int_t i = 0; i < count; i++) {
+		float *b = (float *)state_buffer.buf + i * BODY_SIZE;
+		float *m = (float *)matrix_buffer.buf + i * 16;
+
+		// Move by the velocity
+		for (size_t j = 0; j < 3; j++) {
+			b[j] += b[j + 3] * delta_t;
+		}
+
+		// Rotate around the axis of the angular velocity, by its magnitude in degrees a second, a body
+		// that isn't spinning keeps its orientation exactly
+		float *q = b + 6;
+		mp_float_t degrees = v_magnitude_internal(b + 10, 3);
+		if (degrees > 0) {
+			float theta = (degrees * delta_t * DEGS_TO_RADS) / 2;
+			float factor = sin(theta) / degrees;
+			float q1w = q[0];
+			float q1x = q[1];
+			float q1y = q[2];
+			float q1z = q[3];
+			float q2w = cos(theta);
+			float q2x = b[10] * factor;
+			float q2y = b[11] * factor;
+			float q2z = b[12] * factor;
+			q[0] = q1w * q2w - q1x * q2x - q1y * q2y - q1z * q2z;
+			q[1] = q1w * q2x + q1x * q2w + q1y * q2z - q1z * q2y;
+			q[2] = q1w * q2y - q1x * q2z + q1y * q2w + q1z * q2x;
+			q[3] = q1w * q2z + q1x * q2y - q1y * q2x + q1z * q2w;
+		}
+
+		// The rotation matrix of the orientation, as m_rotate makes it, with the translation of the
+		// position along the bottom row
+		float w = q[0];
+		float x = q[1];
+		float y = q[2];
+		float z = q[3];
+		m[0] = 1 - 2 * (y * y + z * z);
+		m[1] = 2 * (x * y - w * z);
+		m[2] = 2 * (x * z + w * y);
+		m[3] = 0;
+		m[4] = 2 * (x * y + w * z);
+		m[5] = 1 - 2 * (x * x + z * z);
+		m[6] = 2 * (y * z - w * x);
+		m[7] = 0;
+		m[8] = 2 * (x * z - w * y);
+		m[9] = 2 * (y * z + w * x);
+		m[10] = 1 - 2 * (x * x + y * y);
+		m[11] = 0;
+		m[12] = b[0];
+		m[13] = b[1];
+		m[14] = b[2];
+		m[15] = 1;
+	}
+
+	return mp_const_none;
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(b_update_obj, 4, 4, b_update);
+
+// Child index of a BVH node that has no such child, that is of a leaf node
+#define BVH_NO_NODE (0xffff)
+
+// Deepest BVH that bvh_ray and bvh_sphere can walk, and so the most entries their stacks can need, since
+// each node visited replaces itself on the stack with its two children
+#define BVH_MAX_DEPTH (32)
+#define BVH_STACK_SIZE (BVH_MAX_DEPTH + 1)
+
+/**
+ * The buffers of a mesh's bounding volume hierarchy, see app/bvh.py, along with the number of nodes,
+ * triangles and vertices they have room for
+ */
+typedef struct _bvh_t {
+	const uint16_t *nodes;
+	const float *boxes;
+	const uint16_t *triangles;
+	const float *vertices;
+	size_t num_nodes;
+	size_t num_triangles;
+	size_t num_vertices;
+} bvh_t;
+
+STATIC void bvh_get(bvh_t *bvh, const mp_obj_t *args) {
+	mp_buffer_info_t nodes_buffer, boxes_buffer, tris_buffer, verts_buffer;
+	mp_get_buffer_raise(args[0], &nodes_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[1], &boxes_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[2], &tris_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[3], &verts_buffer, MP_BUFFER_READ);
+	bvh->nodes = (const uint16_t *)nodes_buffer.buf;
+	bvh->boxes = (const float *)boxes_buffer.buf;
+	bvh->triangles = (const uint16_t *)tris_buffer.buf;
+	bvh->vertices = (const float *)verts_buffer.buf;
+	bvh->num_nodes = nodes_buffer.len / 8;
+	if (boxes_buffer.len / 24 < bvh->num_nodes) {
+		bvh->num_nodes = boxes_buffer.len / 24;
+	}
+	bvh->num_triangles = tris_buffer.len / 8;
+	bvh->num_vertices = verts_buffer.len / 12;
+}
+
+/**
+ * Checks the node at the top of the stack of a walk of a BVH, and replaces it with its children if it
+ * isn't a leaf; returns the node, or NULL if it is not a leaf
+ */
+STATIC const uint16_t *bvh_visit(const bvh_t *bvh, uint16_t *stack, size_t *top) {
+	uint16_t index = stack[--*top];
+	const uint16_t *node = bvh->nodes + index * 4;
+	if ((size_t)node[0] + node[1] > bvh->num_triangles) {
+		mp_raise_ValueError(MP_ERROR_TEXT("BVH node triangles out of range"));
+	}
+	if (node[1] > 0) {
+		return node;
+	}
+	if (node[2] >= bvh->num_nodes || node[3] >= bvh->num_nodes) {
+		mp_raise_ValueError(MP_ERROR_TEXT("BVH node child out of range"));
+	}
+	if (*top + 2 > BVH_STACK_SIZE) {
+		mp_raise_ValueError(MP_ERROR_TEXT("BVH is too deep"));
+	}
+	stack[(*top)++] = node[3];
+	stack[(*top)++] = node[2];
+	return NULL;
+}
+
+/**
+ * Returns the vertices of a triangle of a BVH
+ */
+STATIC void bvh_triangle(const bvh_t *bvh, size_t t, const float **a, const float **b, const float **c) {
+	const uint16_t *tri = bvh->triangles + t * 4;
+	if (tri[0] >= bvh->num_vertices || tri[1] >= bvh->num_vertices || tri[2] >= bvh->num_vertices) {
+		mp_raise_ValueError(MP_ERROR_TEXT("BVH triangle vertex out of range"));
+	}
+	*a = bvh->vertices + tri[0] * 3;
+	*b = bvh->vertices + tri[1] * 3;
+	*c = bvh->vertices + tri[2] * 3;
+}
+
+/**
+ * Transforms a point, or a direction if w is zero, by a 4x4 matrix in the same way as v_multiply
+ */
+STATIC void bvh_transform(const float *v, mp_float_t w, const float *m, mp_float_t *dest) {
+	for (size_t i = 0; i < 3; i++) {
+		dest[i] = v[0] * m[i] + v[1] * m[4 + i] + v[2] * m[8 + i] + w * m[12 + i];
+	}
+}
+
+/**
+ * Casts a ray at a mesh's triangles, walking its bounding volume hierarchy so that only the triangles in
+ * boxes the ray passes through are tested, and finds the nearest triangle the ray hits; the ray is
+ * given in world space and transformed into the mesh's object space with the inverse of its model
+ * matrix, which must only rotate and translate so that distances along the ray are the same in both
+ *
+ * nodes: An array of unsigned shorts, four for each node, the first of which is the root: the index of
+ *   the node's first triangle and its number of triangles, for a leaf node, or zero triangles and its
+ *   two child nodes
+ * boxes: An array of floats, six for each node: the x, y, z of the low and then high corner of the box
+ *   that encloses the node's triangles, in object space
+ * triangles: An array of unsigned shorts, four for each triangle: the indices of its three vertices, and
+ *   the index of the mesh's face it is part of
+ * vertices: An array containing the x, y, z of each of the mesh's vertices one after another
+ * m_inverse: A 4x4 matrix that transforms world coordinates to the mesh's object coordinates
+ * ray: An array of seven floats: x, y, z of the ray's origin, x, y, z of its direction, which must be
+ *   normalised, and the furthest distance along the ray to look, which is changed to the distance of
+ *   the hit if there is one, so that casting the same ray at several meshes finds the nearest hit
+ *
+ * Returns the index of the face that was hit, or -1 if nothing was hit
+ */
+STATIC mp_obj_t bvh_ray(size_t n_args, const mp_obj_t *args) {
+	bvh_t bvh;
+	bvh_get(&bvh, args);
+	mp_buffer_info_t matrix_buffer, ray_buffer;
+	mp_get_buffer_raise(args[4], &matrix_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[5], &ray_buffer, MP_BUFFER_RW);
+	if (ray_buffer.len < 28) {
+		mp_raise_ValueError(MP_ERROR_TEXT("ray is too small"));
+	}
+	float *ray = (float *)ray_buffer.buf;
+	const float *m = (const float *)matrix_buffer.buf;
+	mp_float_t o[3], d[3];
+	bvh_transform(ray, 1, m, o);
+	bvh_transform(ray + 3, 0, m, d);
+	mp_float_t nearest = ray[6];
+	mp_int_t face = -1;
+
+	uint16_t stack[BVH_STACK_SIZE];
+	size_t top = 0;
+	if (bvh.num_nodes > 0) {
+		stack[top++] = 0;
+	}
+	while (top > 0) {
+		// Skip the node if the ray misses its box, or only reaches it beyond the nearest hit so far,
+		// clipping the ray against each pair of the box's sides in turn
+		const float *box = bvh.boxes + stack[top - 1] * 6;
+		mp_float_t t_near = 0;
+		mp_float_t t_far = nearest;
+		for (size_t j = 0; j < 3 && t_near <= t_far; j++) {
+			if (d[j] == 0) {
+				if (o[j] < box[j] || o[j] > box[j + 3]) {
+					t_far = -1;
+				}
+				continue;
+			}
+			mp_float_t t1 = (box[j] - o[j]) / d[j];
+			mp_float_t t2 = (box[j + 3] - o[j]) / d[j];
+			if (t1 > t2) {
+				mp_float_t t = t1;
+				t1 = t2;
+				t2 = t;
+			}
+			t_near = t1 > t_near ? t1 : t_near;
+			t_far = t2 < t_far ? t2 : t_far;
+		}
+		if (t_near > t_far) {
+			top--;
+			continue;
+		}
+
+		const uint16_t *node = bvh_visit(&bvh, stack, &top);
+		if (node == NULL) {
+			continue;
+		}
+		for (size_t t = node[0]; t < (size_t)node[0] + node[1]; t++) {
+			// Moller-Trumbore ray/triangle intersection, which finds where the ray hits the triangle's
+			// plane in terms of the triangle's edges, and hits either side of the triangle
+			const float *a, *b, *c;
+			bvh_triangle(&bvh, t, &a, &b, &c);
+			mp_float_t e1[3] = {b[0] - a[0], b[1] - a[1], b[2] - a[2]};
+			mp_float_t e2[3] = {c[0] - a[0], c[1] - a[1], c[2] - a[2]};
+			mp_float_t p[3] = {d[1] * e2[2] - d[2] * e2[1], d[2] * e2[0] - d[0] * e2[2], d[0] * e2[1] - d[1] * e2[0]};
+			mp_float_t det = e1[0] * p[0] + e1[1] * p[1] + e1[2] * p[2];
+			if (det == 0) {
+				continue;
+			}
+			mp_float_t inv_det = 1 / det;
+			mp_float_t s[3] = {o[0] - a[0], o[1] - a[1], o[2] - a[2]};
+			mp_float_t u = (s[0] * p[0] + s[1] * p[1] + s[2] * p[2]) * inv_det;
+			if (u < 0 || u > 1) {
+				continue;
+			}
+			mp_float_t q[3] = {s[1] * e1[2] - s[2] * e1[1], s[2] * e1[0] - s[0] * e1[2], s[0] * e1[1] - s[1] * e1[0]};
+			mp_float_t v = (d[0] * q[0] + d[1] * q[1] + d[2] * q[2]) * inv_det;
+			if (v < 0 || u + v > 1) {
+				continue;
+			}
+			mp_float_t dist = (e2[0] * q[0] + e2[1] * q[1] + e2[2] * q[2]) * inv_det;
+			if (dist >= 0 && dist < nearest) {
+				nearest = dist;
+				face = bvh.triangles[t * 4 + 3];
+			}
+		}
+	}
+
+	ray[6] = nearest;
+	return mp_obj_new_int(face);
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(bvh_ray_obj, 6, 6, bvh_ray);
+
+/**
+ * Finds the point on a triangle that is closest to a point
+ */
+STATIC void closest_on_triangle(const mp_float_t *p, const float *a, const float *b, const float *c, mp_float_t *dest) {
+	// Work out which of the triangle's corners, edges or its face is nearest, from where the point is in
+	// terms of the two edges from each corner in turn
+	mp_float_t ab[3], ac[3], ap[3], bp[3], cp[3];
+	for (size_t i = 0; i < 3; i++) {
+		ab[i] = b[i] - a[i];
+		ac[i] = c[i] - a[i];
+		ap[i] = p[i] - a[i];
+		bp[i] = p[i] - b[i];
+		cp[i] = p[i] - c[i];
+	}
+	mp_float_t d1 = ab[0] * ap[0] + ab[1] * ap[1] + ab[2] * ap[2];
+	mp_float_t d2 = ac[0] * ap[0] + ac[1] * ap[1] + ac[2] * ap[2];
+	mp_float_t d3 = ab[0] * bp[0] + ab[1] * bp[1] + ab[2] * bp[2];
+	mp_float_t d4 = ac[0] * bp[0] + ac[1] * bp[1] + ac[2] * bp[2];
+	mp_float_t d5 = ab[0] * cp[0] + ab[1] * cp[1] + ab[2] * cp[2];
+	mp_float_t d6 = ac[0] * cp[0] + ac[1] * cp[1] + ac[2] * cp[2];
+	mp_float_t va = d3 * d6 - d5 * d4;
+	mp_float_t vb = d5 * d2 - d1 * d6;
+	mp_float_t vc = d1 * d4 - d3 * d2;
+	const float *corner = a;
+	mp_float_t u = 0;
+	mp_float_t v = 0;
+	if (d1 <= 0 && d2 <= 0) {
+		corner = a;
+	} else if (d3 >= 0 && d4 <= d3) {
+		corner = b;
+	} else if (d6 >= 0 && d5 <= d6) {
+		corner = c;
+	} else if (vc <= 0 && d1 >= 0 && d3 <= 0) {
+		u = d1 / (d1 - d3);
+	} else if (vb <= 0 && d2 >= 0 && d6 <= 0) {
+		v = d2 / (d2 - d6);
+	} else if (va <= 0 && d4 - d3 >= 0 && d5 - d6 >= 0) {
+		// On the edge from b to c
+		mp_float_t w = (d4 - d3) / ((d4 - d3) + (d5 - d6));
+		u = 1 - w;
+		v = w;
+	} else {
+		mp_float_t denom = 1 / (va + vb + vc);
+		u = vb * denom;
+		v = vc * denom;
+	}
+	for (size_t i = 0; i < 3; i++) {
+		dest[i] = corner[i] + ab[i] * u + ac[i] * v;
+	}
+}
+
+/**
+ * Finds the faces of a mesh that a sphere touches, walking its bounding volume hierarchy so that only
+ * the triangles in boxes the sphere touches are tested; the sphere is given in world space and
+ * transformed into the mesh's object space with the inverse of its model matrix, which must only rotate
+ * and translate so that the sphere stays the same size
+ *
+ * nodes, boxes, triangles, vertices: The mesh's bounding volume hierarchy and vertices, see bvh_ray
+ * m_inverse: A 4x4 matrix that transforms world coordinates to the mesh's object coordinates
+ * sphere: An array of the x, y, z of the sphere's centre and its radius
+ * faces: An array of unsigned shorts to write the indices of the faces the sphere touches into, which
+ *   stops when it is full; a face made of several triangles can be written more than once
+ *
+ * Returns the number of faces written
+ */
+STATIC mp_obj_t bvh_sphere(size_t n_args, const mp_obj_t *args) {
+	bvh_t bvh;
+	bvh_get(&bvh, args);
+	mp_buffer_info_t matrix_buffer, sphere_buffer, faces_buffer;
+	mp_get_buffer_raise(args[4], &matrix_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[5], &sphere_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[6], &faces_buffer, MP_BUFFER_WRITE);
+	const float *sphere = (const float *)sphere_buffer.buf;
+	uint16_t *faces = (uint16_t *)faces_buffer.buf;
+	size_t max_faces = faces_buffer.len / 2;
+	mp_float_t centre[3];
+	bvh_transform(sphere, 1, (const float *)matrix_buffer.buf, centre);
+	mp_float_t radius_sq = sphere[3] * sphere[3];
+	size_t count = 0;
+
+	uint16_t stack[BVH_STACK_SIZE];
+	size_t top = 0;
+	if (bvh.num_nodes > 0) {
+		stack[top++] = 0;
+	}
+	while (top > 0 && count < max_faces) {
+		// Skip the node if the point of its box that is nearest the sphere's centre is outside the sphere
+		const float *box = bvh.boxes + stack[top - 1] * 6;
+		mp_float_t dist_sq = 0;
+		for (size_t j = 0; j < 3; j++) {
+			mp_float_t e = centre[j] < box[j] ? box[j] - centre[j] : centre[j] > box[j + 3] ? centre[j] - box[j + 3] : 0;
+			dist_sq += e * e;
+		}
+		if (dist_sq > radius_sq) {
+			top--;
+			continue;
+		}
+
+		const uint16_t *node = bvh_visit(&bvh, stack, &top);
+		if (node == NULL) {
+			continue;
+		}
+		for (size_t t = node[0]; t < (size_t)node[0] + node[1] && count < max_faces; t++) {
+			const float *a, *b, *c;
+			bvh_triangle(&bvh, t, &a, &b, &c);
+			mp_float_t closest[3];
+			closest_on_triangle(centre, a, b, c, closest);
+			mp_float_t dx = closest[0] - centre[0];
+			mp_float_t dy = closest[1] - centre[1];
+			mp_float_t dz = closest[2] - centre[2];
+			if (dx * dx + dy * dy + dz * dz <= radius_sq) {
+				// Triangles of the same face are usually next to each other, so this catches most repeats
+				uint16_t face = bvh.triangles[t * 4 + 3];
+				if (count == 0 || faces[count - 1] != face) {
+					faces[count++] = face;
+				}
+			}
+		}
+	}
+
+	return mp_obj_new_int(count);
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(bvh_sphere_obj, 7, 7, bvh_sphere);
+
+// Flag used by fb_delta_rle to mark a run of a repeated value, as opposed to a run of literal values
+#define RLE_REPEAT (0x8000)
+#define RLE_MAX_RUN (0x7fff)
+
+/**
+ * Encodes a section of the given RGB565 framebuffer as the difference from the previous frame, and then
+ * run-length encodes those differences; pixels that did not change since the previous frame have a
+ * difference of zero so even busy scenes compress well
+ *
+ * The encoded data is a sequence of 16-bit little-endian words, each run starts with a header word, if
+ * the RLE_REPEAT bit is set then the remaining bits are a count of how many times the following single
+ * word is repeated, otherwise the header is a count of how many literal words follow
+ *
+ * buffer: The framebuffer to encode
+ * previous: A buffer the same size as the framebuffer containing the previous frame, this is updated
+ *           with the current frame as pixels are encoded
+ * output: A pre-allocated buffer where the encoded data will be written
+ * start: The index of the first pixel to encode
+ * keyframe: If true, encode the difference from a blank frame instead of from the previous frame
+ *
+ * Returns a tuple of the index of the next pixel to be encoded and the number of bytes written to the
+ * output buffer; encoding stops either when all pixels have been encoded or when the output buffer is
+ * full, in which case the caller should send the output and call again to encode the remaining pixels
+ */
+STATIC mp_obj_t fb_delta_rle(size_t n_args, const mp_obj_t *args) {
+	mp_buffer_info_t buf_buffer, prev_buffer, out_buffer;
+	mp_get_buffer_raise(args[0], &buf_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[1], &prev_buffer, MP_BUFFER_RW);
+	mp_get_buffer_raise(args[2], &out_buffer, MP_BUFFER_WRITE);
+	size_t i = mp_obj_get_int(args[3]);
+	bool keyframe = mp_obj_is_true(args[4]);
+
+	uint16_t *cur = (uint16_t *)buf_buffer.buf;
+	uint16_t *prev = (uint16_t *)prev_buffer.buf;
+	uint16_t *out = (uint16_t *)out_buffer.buf;
+	size_t len = (buf_buffer.len < prev_buffer.len ? buf_buffer.len : prev_buffer.len) / 2;
+	size_t out_len = out_buffer.len / 2;
+	size_t o = 0;
+
+	#define DELTA(k) (keyframe ? cur[k] : (uint16_t)(cur[k] ^ prev[k]))
+	while (i < len && o + 2 <= out_len) {
+		uint16_t d = DELTA(i);
+		size_t run = 1;
+		while (i + run < len && run < RLE_MAX_RUN && DELTA(i + run) == d) {
+			run++;
+		}
+		if (run > 1) {
+			out[o++] = RLE_REPEAT | run;
+			out[o++] = d;
+		} else {
+			// Gather literal values until the start of the next run of repeated values, or until
+			// the output buffer is full
+			size_t max_run = out_len - o - 1;
+			if (max_run > RLE_MAX_RUN) {
+				max_run = RLE_MAX_RUN;
+			}
+			while (i + run < len && run < max_run) {
+				if (i + run + 1 < len && DELTA(i + run) == DELTA(i + run + 1)) {
+					break;
+				}
+				run++;
+			}
+			out[o++] = run;
+			for (size_t k = 0; k < run; k++) {
+				out[o++] = DELTA(i + k);
+			}
+		}
+		// Remember the encoded pixels, they form the previous frame next time
+		memcpy(&prev[i], &cur[i], run * 2);
+		i += run;
+	}
+	#undef DELTA
+
+	mp_obj_t result[2] = { mp_obj_new_int(i), mp_obj_new_int(o * 2) };
+	return mp_obj_new_tuple(2, result);
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(fb_delta_rle_obj, 5, 5, fb_delta_rle);
+
+// Internal helper to set a pixel in either an RGB565 framebuffer or an 8-bit palette indexed framebuffer
+STATIC inline void fb_plot_internal(void *buf, bool indexed, mp_int_t i, uint16_t col) {
+	if (indexed) {
+		((uint8_t *)buf)[i] = (uint8_t)col;
+	} else {
+		((uint16_t *)buf)[i] = col;
+	}
+}
+
+// Internal helper to draw a line into a framebuffer, this is the same algorithm as the line drawing in
+// the framebuf module, so lines drawn either way are identical; pixels outside the buffer are skipped
+STATIC void fb_line_internal(void *buf, bool indexed, mp_int_t width, mp_int_t height, mp_int_t x1, mp_int_t y1, mp_int_t x2, mp_int_t y2, uint16_t col) {
+	mp_int_t dx = x2 - x1;
+	mp_int_t sx;
+	if (dx > 0) {
+		sx = 1;
+	} else {
+		dx = -dx;
+		sx = -1;
+	}
+	mp_int_t dy = y2 - y1;
+	mp_int_t sy;
+	if (dy > 0) {
+		sy = 1;
+	} else {
+		dy = -dy;
+		sy = -1;
+	}
+	bool steep;
+	if (dy > dx) {
+		mp_int_t temp;
+		temp = x1;
+		x1 = y1;
+		y1 = temp;
+		temp = dx;
+		dx = dy;
+		dy = temp;
+		temp = sx;
+		sx = sy;
+		sy = temp;
+		steep = true;
+	} else {
+		steep = false;
+	}
+	mp_int_t e = 2 * dy - dx;
+	for (mp_int_t i = 0; i < dx; ++i) {
+		if (steep) {
+			if (0 <= y1 && y1 < width && 0 <= x1 && x1 < height) {
+				fb_plot_internal(buf, indexed, x1 * width + y1, col);
+			}
+		} else {
+			if (0 <= x1 && x1 < width && 0 <= y1 && y1 < height) {
+				fb_plot_internal(buf, indexed, y1 * width + x1, col);
+			}
+		}
+		while (e >= 0) {
+			y1 += sy;
+			e -= 2 * dx;
+		}
+		x1 += sx;
+		e += 2 * dy;
+	}
+	if (0 <= x2 && x2 < width && 0 <= y2 && y2 < height) {
+		fb_plot_internal(buf, indexed, y2 * width + x2, col);
+	}
+}
+
+/**
+ * Draws a batch of lines into a framebuffer, so that drawing a whole wireframe costs a single call
+ * instead of a call for every line
+ *
+ * buffer: The framebuffer's buffer, either RGB565 or 8-bit palette indices, which are told apart by
+ *         the size of the buffer
+ * width: Width of the framebuffer in pixels
+ * height: Height of the framebuffer in pixels
+ * y: The screen y coordinate of the top of the framebuffer, for when it only covers a strip of the
+ *    screen, lines are clipped to the strip
+ * coords: A signed 16-bit array of screen coordinates, x1, y1, x2, y2 for each line
+ * colours: An unsigned 16-bit array of RGB565 colours, one for each line, these are in the display's
+ *          byte order and are swapped into the framebuffer's byte order as they are drawn; or of palette
+ *          indices, if the framebuffer is indexed
+ * count: Number of lines to draw
+ */
+STATIC mp_obj_t fb_lines(size_t n_args, const mp_obj_t *args) {
+	mp_buffer_info_t buf_buffer, coord_buffer, col_buffer;
+	mp_get_buffer_raise(args[0], &buf_buffer, MP_BUFFER_WRITE);
+	mp_int_t width = mp_obj_get_int(args[1]);
+	mp_int_t height = mp_obj_get_int(args[2]);
+	mp_int_t top = mp_obj_get_int(args[3]);
+	mp_get_buffer_raise(args[4], &coord_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[5], &col_buffer, MP_BUFFER_READ);
+	mp_int_t count = mp_obj_get_int(args[6]);
+
+	bool indexed = buf_buffer.len < (size_t)(width * height * 2);
+	int16_t *coords = (int16_t *)coord_buffer.buf;
+	uint16_t *colours = (uint16_t *)col_buffer.buf;
+	for (mp_int_t i = 0; i < count; i++) {
+		mp_int_t x1 = coords[i * 4];
+		mp_int_t y1 = coords[i * 4 + 1] - top;
+		mp_int_t x2 = coords[i * 4 + 2];
+		mp_int_t y2 = coords[i * 4 + 3] - top;
+
+		// Skip lines that are entirely to one side of the framebuffer
+		if ((x1 < 0 && x2 < 0) || (x1 >= width && x2 >= width) || (y1 < 0 && y2 < 0) || (y1 >= height && y2 >= height)) {
+			continue;
+		}
+		uint16_t col = colours[i];
+		if (!indexed) {
+			col = (col >> 8) | (col << 8);
+		}
+		fb_line_internal(buf_buffer.buf, indexed, width, height, x1, y1, x2, y2, col);
+	}
+	return mp_const_none;
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(fb_lines_obj, 7, 7, fb_lines);
+
+/**
+ * Plots a batch of points into a framebuffer, so that drawing a whole point cloud costs a single call
+ * instead of a call for every point
+ *
+ * Takes the same arguments as fb_lines, except that coords contains x, y for each point, and colours
+ * contains a colour for each point
+ */
+STATIC mp_obj_t fb_points(size_t n_args, const mp_obj_t *args) {
+	mp_buffer_info_t buf_buffer, coord_buffer, col_buffer;
+	mp_get_buffer_raise(args[0], &buf_buffer, MP_BUFFER_WRITE);
+	mp_int_t width = mp_obj_get_int(args[1]);
+	mp_int_t height = mp_obj_get_int(args[2]);
+	mp_int_t top = mp_obj_get_int(args[3]);
+	mp_get_buffer_raise(args[4], &coord_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[5], &col_buffer, MP_BUFFER_READ);
+	mp_int_t count = mp_obj_get_int(args[6]);
+
+	bool indexed = buf_buffer.len < (size_t)(width * height * 2);
+	int16_t *coords = (int16_t *)coord_buffer.buf;
+	uint16_t *colours = (uint16_t *)col_buffer.buf;
+	for (mp_int_t i = 0; i < count; i++) {
+		mp_int_t x = coords[i * 2];
+		mp_int_t y = coords[i * 2 + 1] - top;
+		if (0 <= x && x < width && 0 <= y && y < height) {
+			uint16_t col = colours[i];
+			if (!indexed) {
+				col = (col >> 8) | (col << 8);
+			}
+			fb_plot_internal(buf_buffer.buf, indexed, y * width + x, col);
+		}
+	}
+	return mp_const_none;
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(fb_points_obj, 7, 7, fb_points);
+
+/**
+ * Plots a batch of particles into a framebuffer, all in the same colour, as single pixels or as small
+ * squares centred on their screen coordinates
+ *
+ * Takes the same arguments as fb_points, except that colour is a single colour for every particle, and
+ * size is the width and height of the squares in pixels
+ */
+STATIC mp_obj_t fb_particles(size_t n_args, const mp_obj_t *args) {
+	mp_buffer_info_t buf_buffer, coord_buffer;
+	mp_get_buffer_raise(args[0], &buf_buffer, MP_BUFFER_WRITE);
+	mp_int_t width = mp_obj_get_int(args[1]);
+	mp_int_t height = mp_obj_get_int(args[2]);
+	mp_int_t top = mp_obj_get_int(args[3]);
+	mp_get_buffer_raise(args[4], &coord_buffer, MP_BUFFER_READ);
+	mp_int_t count = mp_obj_get_int(args[5]);
+	uint16_t col = mp_obj_get_int(args[6]);
+	mp_int_t size = mp_obj_get_int(args[7]);
+
+	bool indexed = buf_buffer.len < (size_t)(width * height * 2);
+	if (!indexed) {
+		col = (col >> 8) | (col << 8);
+	}
+	int16_t *coords = (int16_t *)coord_buffer.buf;
+	mp_int_t offset = (size - 1) / 2;
+	for (mp_int_t i = 0; i < count; i++) {
+		mp_int_t x1 = coords[i * 2] - offset;
+		mp_int_t y1 = coords[i * 2 + 1] - top - offset;
+		mp_int_t x2 = x1 + size;
+		mp_int_t y2 = y1 + size;
+		if (x1 < 0) {
+			x1 = 0;
+		}
+		if (y1 < 0) {
+			y1 = 0;
+		}
+		if (x2 > width) {
+			x2 = width;
+		}
+		if (y2 > height) {
+			y2 = height;
+		}
+		for (mp_int_t y = y1; y < y2; y++) {
+			for (mp_int_t x = x1; x < x2; x++) {
+				fb_plot_internal(buf_buffer.buf, indexed, y * width + x, col);
+			}
+		}
+	}
+	return mp_const_none;
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(fb_particles_obj, 8, 8, fb_particles);
+
+/**
+ * Expands pixels of an 8-bit palette indexed framebuffer into RGB565 pixels, so that an indexed
+ * framebuffer can be sent to the display a chunk at a time without needing an RGB565 framebuffer
+ * the size of the whole display
+ *
+ * buffer: The indexed framebuffer's buffer
+ * start: Index of the first pixel to expand
+ * palette: An unsigned 16-bit array of 256 RGB565 colours, already in the framebuffer's byte order
+ * output: Buffer for the expanded pixels, as many pixels are expanded as will fit in it, or until the
+ *         end of the framebuffer
+ *
+ * Returns the number of pixels expanded
+ */
+STATIC mp_obj_t fb_expand(size_t n_args, const mp_obj_t *args) {
+	mp_buffer_info_t buf_buffer, pal_buffer, out_buffer;
+	mp_get_buffer_raise(args[0], &buf_buffer, MP_BUFFER_READ);
+	mp_int_t start = mp_obj_get_int(args[1]);
+	mp_get_buffer_raise(args[2], &pal_buffer, MP_BUFFER_READ);
+	mp_get_buffer_raise(args[3], &out_buffer, MP_BUFFER_WRITE);
+	if (pal_buffer.len < 512) {
+		mp_raise_ValueError(MP_ERROR_TEXT("palette must have 256 colours"));
+	}
+
+	uint8_t *buf = (uint8_t *)buf_buffer.buf;
+	uint16_t *palette = (uint16_t *)pal_buffer.buf;
+	uint16_t *output = (uint16_t *)out_buffer.buf;
+	mp_int_t count = out_buffer.len / 2;
+	if (start < 0) {
+		start = 0;
+	}
+	if (count > (mp_int_t)buf_buffer.len - start) {
+		count = (mp_int_t)buf_buffer.len - start;
+	}
+	for (mp_int_t i = 0; i < count; i++) {
+		output[i] = palette[buf[start + i]];
+	}
+
+	return mp_obj_new_int(count < 0 ? 0 : count);
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(fb_expand_obj, 4, 4, fb_expand);
+
+/**
+ * Scales up a framebuffer drawn at half resolution to full resolution, in place, by doubling each pixel
+ * across and down, so the scene can be drawn at a lower resolution when it is too slow to draw at full
+ * resolution without needing a second framebuffer
+ *
+ * buffer: The framebuffer's buffer, either RGB565 or 8-bit palette indices, which are told apart by
+ *         the size of the buffer; the half resolution image is at the start of the buffer, rounded up to
+ *         a whole number of pixels across and down
+ * width: Full width of the framebuffer in pixels
+ * height: Full height of the framebuffer in pixels
+ *
+ * Pixels are doubled starting from the end of the buffer, so every pixel of the half resolution image
+ * is read before it can be overwritten
+ */
+STATIC mp_obj_t fb_upscale(size_t n_args, const mp_obj_t *args) {
+	mp_buffer_info_t buf_buffer;
+	mp_get_buffer_raise(args[0], &buf_buffer, MP_BUFFER_WRITE);
+	mp_int_t width = mp_obj_get_int(args[1]);
+	mp_int_t height = mp_obj_get_int(args[2]);
+	bool indexed = buf_buffer.len < (size_t)(width * height * 2);
+	if (buf_buffer.len < (size_t)(width * height)) {
+		mp_raise_ValueError(MP_ERROR_TEXT("buffer is too small"));
+	}
+
+	mp_int_t half_width = (width + 1) / 2;
+	for (mp_int_t y = (height + 1) / 2 - 1; y >= 0; y--) {
+		for (mp_int_t x = half_width - 1; x >= 0; x--) {
+			mp_int_t src = y * half_width + x;
+			uint16_t col = indexed ? ((uint8_t *)buf_buffer.buf)[src] : ((uint16_t *)buf_buffer.buf)[src];
+			for (mp_int_t j = y * 2 + 1; j >= y * 2; j--) {
+				for (mp_int_t i = x * 2 + 1; i >= x * 2; i--) {
+					if (i < width && j < height) {
+						fb_plot_internal(buf_buffer.buf, indexed, j * width + i, col);
+					}
+				}
+			}
+		}
+	}
+	return mp_const_none;
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(fb_upscale_obj, 3, 3, fb_upscale);
+
 #if !MICROPY_ENABLE_DYNRUNTIME
 STATIC const mp_rom_map_elem_t tidal3d_module_globals_table[] = {
     { MP_ROM_QSTR(MP_QSTR___name__), MP_ROM_QSTR(MP_QSTR_tidal3d) },
@@ -494,14 +1646,27 @@ STATIC const mp_rom_map_elem_t tidal3d_module_globals_table[] = {
     { MP_ROM_QSTR(MP_QSTR_v_average), MP_ROM_PTR(&v_average_obj) },
     { MP_ROM_QSTR(MP_QSTR_v_multiply), MP_ROM_PTR(&v_multiply_obj) },
     { MP_ROM_QSTR(MP_QSTR_v_multiply_batch), MP_ROM_PTR(&v_multiply_batch_obj) },
+    { MP_ROM_QSTR(MP_QSTR_v_lerp_batch), MP_ROM_PTR(&v_lerp_batch_obj) },
     { MP_ROM_QSTR(MP_QSTR_v_dot), MP_ROM_PTR(&v_dot_obj) },
     { MP_ROM_QSTR(MP_QSTR_v_cross), MP_ROM_PTR(&v_cross_obj) },
     { MP_ROM_QSTR(MP_QSTR_v_ndc_to_screen), MP_ROM_PTR(&v_ndc_to_screen_obj) },
+    { MP_ROM_QSTR(MP_QSTR_v_clip_to_screen), MP_ROM_PTR(&v_clip_to_screen_obj) },
     { MP_ROM_QSTR(MP_QSTR_m_multiply), MP_ROM_PTR(&m_multiply_obj) },
     { MP_ROM_QSTR(MP_QSTR_m_translate), MP_ROM_PTR(&m_translate_obj) },
     { MP_ROM_QSTR(MP_QSTR_m_rotate), MP_ROM_PTR(&m_rotate_obj) },
     { MP_ROM_QSTR(MP_QSTR_q_rotate), MP_ROM_PTR(&q_rotate_obj) },
     { MP_ROM_QSTR(MP_QSTR_z_sort), MP_ROM_PTR(&z_sort_obj) },
+    { MP_ROM_QSTR(MP_QSTR_bsp_traverse), MP_ROM_PTR(&bsp_traverse_obj) },
+    { MP_ROM_QSTR(MP_QSTR_p_update), MP_ROM_PTR(&p_update_obj) },
+    { MP_ROM_QSTR(MP_QSTR_b_update), MP_ROM_PTR(&b_update_obj) },
+    { MP_ROM_QSTR(MP_QSTR_bvh_ray), MP_ROM_PTR(&bvh_ray_obj) },
+    { MP_ROM_QSTR(MP_QSTR_bvh_sphere), MP_ROM_PTR(&bvh_sphere_obj) },
+    { MP_ROM_QSTR(MP_QSTR_fb_delta_rle), MP_ROM_PTR(&fb_delta_rle_obj) },
+    { MP_ROM_QSTR(MP_QSTR_fb_lines), MP_ROM_PTR(&fb_lines_obj) },
+    { MP_ROM_QSTR(MP_QSTR_fb_points), MP_ROM_PTR(&fb_points_obj) },
+    { MP_ROM_QSTR(MP_QSTR_fb_particles), MP_ROM_PTR(&fb_particles_obj) },
+    { MP_ROM_QSTR(MP_QSTR_fb_expand), MP_ROM_PTR(&fb_expand_obj) },
+    { MP_ROM_QSTR(MP_QSTR_fb_upscale), MP_ROM_PTR(&fb_upscale_obj) },
 };
 STATIC MP_DEFINE_CONST_DICT(tidal3d_module_globals, tidal3d_module_globals_table);
 
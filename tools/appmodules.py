@@ -0,0 +1,35 @@
+"""
+Imports the app's own modules into tools that run on CPython, so that the tools treat models exactly the
+same way as the app does
+
+The modules are imported as the tidal_3d package, the same as on the badge, but without running the
+package's __init__.py, which needs the badge's own modules; the native module is never available, so the
+app's Python fallback for it is used, along with the stand-ins for MicroPython's modules in
+tools/shims/cpython
+"""
+
+import importlib
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app's modules that can be used without the badge's modules
+MODULES = ("animation", "bundle", "bvh", "camera", "native", "object", "scene", "tidal3d_viper")
+
+
+def import_app():
+    """
+    Returns the app's package, with each of the modules above imported into it
+    """
+    package = sys.modules.get("tidal_3d")
+    if package is None:
+        sys.path.insert(0, os.path.join(ROOT, "tools", "shims", "cpython"))
+        importlib.import_module("micropython")
+        package = types.ModuleType("tidal_3d")
+        package.__path__ = [os.path.join(ROOT, "app")]
+        sys.modules["tidal_3d"] = package
+    for name in MODULES:
+        importlib.import_module("tidal_3d." + name)
+    return package
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Compares how quickly files are copied from a badge by Pyboard.fs_get, which runs a command for every
+256 bytes of the file, and by Pyboard.fs_get_stream, which has the badge stream the whole file in one
+command, as raw binary frames and as base64 encoded frames
+
+Each file is copied the given number of times in each way, checking that every copy is the same as
+the one made by fs_get, and the best throughput of each is shown along with how many times faster it
+is than fs_get:
+
+    python tools/bench_download.py -d /dev/ttyACM0 /apps/tidal_3d/teapot.obj
+    python tools/bench_download.py -d /dev/ttyACM0 --repeat 5 /apps/tidal_3d/models.bundle
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pyboard
+
+METHODS = ("fs_get", "stream", "stream-base64")
+
+
+def copy(pyb, method, src, dest):
+    if method == "fs_get":
+        pyb.fs_get(src, dest)
+    else:
+        pyb.fs_get_stream(src, dest, base64_frames=method == "stream-base64")
+
+
+def bench(pyb, src, repeat, log=print):
+    """
+    Copies the given file from the device in each of the ways above, returning the best throughput of
+    each in bytes per second, raises PyboardError if a copy is not the same as fs_get's
+    """
+    results = {}
+    expected = None
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = os.path.join(tmp, "copy")
+        for method in METHODS:
+            best = None
+            for _ in range(repeat):
+                start_t = time.perf_counter()
+                copy(pyb, method, src, dest)
+                elapsed = time.perf_counter() - start_t
+                best = elapsed if best is None else min(best, elapsed)
+                with open(dest, "rb") as f:
+                    data = f.read()
+                if expected is None:
+                    expected = data
+                elif data != expected:
+                    raise pyboard.PyboardError("%s: %s copy differs from fs_get's" % (src, method))
+            results[method] = len(expected) / best if best else 0
+    base = results["fs_get"]
+    for method in METHODS:
+        log(
+            "{}: {}: {:,} bytes, {:,.0f} bytes/s, {:.1f}x fs_get".format(
+                src, method, len(expected), results[method], results[method] / base if base else 0
+            )
+        )
+    return results
+
+
+def main():
+    cmd_parser = argparse.ArgumentParser(description="Time copying files from a badge.")
+    cmd_parser.add_argument(
+        "-d",
+        "--device",
+        default=os.environ.get("PYBOARD_DEVICE", "/dev/ttyACM0"),
+        help="the serial device or other device specification understood by pyboard",
+    )
+    cmd_parser.add_argument(
+        "-b",
+        "--baudrate",
+        default=os.environ.get("PYBOARD_BAUDRATE", "115200"),
+        help="the baud rate of the serial device",
+    )
+    cmd_parser.add_argument(
+        "--repeat", default=3, type=int, help="number of times to copy each file in each way"
+    )
+    cmd_parser.add_argument("files", nargs="+", help="files on the device to copy")
+    args = cmd_parser.parse_args()
+
+    try:
+        pyb = pyboard.Pyboard(args.device, args.baudrate)
+        try:
+            pyb.enter_raw_repl(soft_reset=False)
+            for src in args.files:
+                bench(pyb, src, args.repeat)
+            pyb.exit_raw_repl()
+        finally:
+            pyb.close()
+    except pyboard.PyboardError as er:
+        print(er)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Exercises app/pipeline.py with stand-in producer and consumer workloads, comparing the frame rate of
+running them one after the other with running them pipelined on two threads
+
+This needs a MicroPython with threading enabled, it can be run on the unix port from the top of the
+repository, or on the badge once the app is installed, using the pyboard tool:
+
+    micropython tools/bench_pipeline.py
+    python tools/pyboard.py -d /dev/ttyACM0 tools/bench_pipeline.py
+
+With the global interpreter lock, as in most builds of MicroPython, the two threads cannot run Python
+code at the same time, so the utilisation shows how much the pipeline can actually overlap
+"""
+
+from array import array
+import sys
+import time
+
+sys.path.append('app')
+sys.path.append('/apps/tidal_3d')
+from pipeline import Pipeline
+
+# How long the stand-in workloads take, in microseconds
+PRODUCE_US = 20000
+CONSUME_US = 15000
+DURATION_MS = 3000
+
+
+def work(buffer, duration):
+    # Busy loop so the workload keeps the thread running Python code for the whole duration
+    start_t = time.ticks_us()
+    n = 0
+    while time.ticks_diff(time.ticks_us(), start_t) < duration:
+        n += 1
+    buffer[0] = n
+
+
+def produce(buffer):
+    work(buffer, PRODUCE_US)
+
+
+def consume(buffer):
+    work(buffer, CONSUME_US)
+
+
+def sequential():
+    buffer = array('i', [0])
+    frames = 0
+    start_t = time.ticks_ms()
+    while time.ticks_diff(time.ticks_ms(), start_t) < DURATION_MS:
+        produce(buffer)
+        consume(buffer)
+        frames += 1
+    return frames * 1000 // DURATION_MS
+
+
+def pipelined():
+    pipeline = Pipeline([array('i', [0]), array('i', [0])], produce)
+    pipeline.start()
+    pipeline.utilisation()
+    frames = 0
+    start_t = time.ticks_ms()
+    while time.ticks_diff(time.ticks_ms(), start_t) < DURATION_MS:
+        if pipeline.consume(consume):
+            frames += 1
+        else:
+            time.sleep_ms(1)
+    utilisation = pipeline.utilisation()
+    pipeline.stop()
+    return frames * 1000 // DURATION_MS, utilisation
+
+
+def main():
+    print("sequential: {} fps".format(sequential()))
+    fps, (produce_pc, consume_pc) = pipelined()
+    print("pipelined: {} fps, producer {}%, consumer {}%".format(fps, produce_pc, consume_pc))
+
+
+main()
@@ -0,0 +1,252 @@
+"""
+Benchmarks the native tidal3d module against the Python fallback in app/tidal3d_viper.py
+
+This runs on the badge, not the host, and the app must already be installed so that the fallback
+module can be found; run it using the pyboard tool:
+
+    python tools/pyboard.py -d /dev/ttyACM0 tools/bench_tidal3d.py
+
+On stock firmware, without the native module, only the fallback's timings are shown
+"""
+
+from array import array
+from micropython import const
+import sys
+import time
+
+sys.path.append('/apps/tidal_3d')
+import tidal3d_viper
+
+try:
+    import tidal3d
+except ImportError:
+    tidal3d = None
+
+# Workloads roughly the size of what the renderer does per frame for the teapot model
+NUM_VERTICES = const(300)
+NUM_FACES = const(500)
+NUM_PARTICLES = const(300)
+NUM_BODIES = const(50)
+NUM_QUERIES = const(100)
+GRID_SIZE = const(16)
+WIDTH = const(135)
+HEIGHT = const(240)
+
+
+def vectors(n):
+    return [array('f', [i * 0.01, -i * 0.02, i * 0.03]) for i in range(n)]
+
+
+def matrix():
+    return array('f', [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, -10, -35, 1])
+
+
+def bvh_grid():
+    """
+    Returns the nodes, boxes, triangles and vertices of a bounding volume hierarchy of a flat grid of
+    squares, each cut into two triangles, with four triangles in each leaf node
+    """
+    vertices = array('f')
+    for y in range(GRID_SIZE + 1):
+        for x in range(GRID_SIZE + 1):
+            vertices.extend([x - GRID_SIZE / 2, y - GRID_SIZE / 2, 0])
+    triangles = array('H')
+    for y in range(GRID_SIZE):
+        for x in range(GRID_SIZE):
+            v = y * (GRID_SIZE + 1) + x
+            triangles.extend([v, v + 1, v + GRID_SIZE + 2, len(triangles) // 8])
+            triangles.extend([v, v + GRID_SIZE + 2, v + GRID_SIZE + 1, len(triangles) // 8])
+    nodes = array('H')
+    boxes = array('f')
+
+    def build(first, count):
+        # Consecutive triangles are next to each other in the grid, so halving them keeps boxes small
+        node = len(nodes) // 4
+        lo = [min(vertices[triangles[t * 4 + j] * 3 + i] for t in range(first, first + count) for j in range(3))
+              for i in range(3)]
+        hi = [max(vertices[triangles[t * 4 + j] * 3 + i] for t in range(first, first + count) for j in range(3))
+              for i in range(3)]
+        boxes.extend(lo + hi)
+        if count <= 4:
+            nodes.extend([first, count, 0xffff, 0xffff])
+            return node
+        nodes.extend([0, 0, 0, 0])
+        nodes[node * 4 + 2] = build(first, count // 2)
+        nodes[node * 4 + 3] = build(first + count // 2, count - count // 2)
+        return node
+
+    build(0, len(triangles) // 4)
+    return nodes, boxes, triangles, vertices
+
+
+def benchmarks(mod):
+    """
+    Returns a list of (name, function) pairs, where each function runs a workload using the given
+    implementation of the module
+    """
+    verts = vectors(NUM_VERTICES)
+    dests = vectors(NUM_VERTICES)
+    mat = matrix()
+    frame1 = array('f', [i * 0.01 for i in range(NUM_VERTICES * 3)])
+    frame2 = array('f', [i * -0.01 for i in range(NUM_VERTICES * 3)])
+    quat = array('f', [1, 0, 0, 0])
+    axis = array('f', [0, 1, 0])
+    coords = array('h', bytes(NUM_VERTICES * 4))
+    depths = array('f', bytes(NUM_FACES * 8))
+    fb = bytearray(WIDTH * HEIGHT * 2)
+    indexed = bytearray(WIDTH * HEIGHT)
+    palette = array('H', range(256))
+    chunk = bytearray(WIDTH * 16 * 2)
+    previous = bytearray(len(fb))
+    output = bytearray(4096)
+    lines = array('h', [(i * 37) % (WIDTH if i % 2 == 0 else HEIGHT) for i in range(NUM_FACES * 6)])
+
+    # A balanced BSP tree with a face at each node, facing every which way
+    nodes = array('H')
+    for i in range(NUM_FACES):
+        front = i * 2 + 1
+        back = i * 2 + 2
+        nodes.extend([i, 1, front if front < NUM_FACES else 0xffff, back if back < NUM_FACES else 0xffff])
+    normals = array('f', [((i * 7) % 11) / 5 - 1 for i in range(NUM_FACES * 3)])
+    plane_dists = array('f', [((i * 3) % 7) - 3 for i in range(NUM_FACES)])
+    position = array('f', [0.5, 10, 35])
+
+    # A pool of particles spread out in front of the camera, which live for longer than the benchmark runs
+    pool = array('f')
+    for i in range(NUM_PARTICLES):
+        pool.extend([(i % 21) - 10, (i % 13) - 6, -(i % 17), (i % 5) - 2, i % 7, (i % 3) - 1, 1000])
+    accel = array('f', [0, -9.8, 0])
+    view_proj = array('f', [1.5, 0, 0, 0, 0, 0.8, 0, 0, 0, 0, -1, -1, 0, -8, 34.8, 35])
+    particle_coords = array('h', bytes(NUM_PARTICLES * 4))
+    colours = array('H', [0xffff] * (NUM_FACES * 3 // 2))
+
+    # Bodies moving and spinning every which way, with room for all of their model matrices
+    state = array('f')
+    for i in range(NUM_BODIES):
+        state.extend([i % 7, i % 5, -(i % 3), (i % 3) - 1, 1, 0, 1, 0, 0, 0, (i % 4) * 10, 20, -(i % 5) * 5])
+    body_matrices = array('f', bytes(NUM_BODIES * 64))
+
+    # Rays cast down at, and spheres dropped onto, points spread over a grid that has been moved away
+    bvh = bvh_grid()
+    bvh_inverse = array('f', [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 5, 1])
+    points = [((i * 7) % GRID_SIZE - GRID_SIZE / 2 + 0.3, (i * 11) % GRID_SIZE - GRID_SIZE / 2 + 0.6)
+              for i in range(NUM_QUERIES)]
+    rays = [array('f', [x, y, 5, 0, 0.6, -0.8, 100]) for x, y in points]
+    spheres = [array('f', [x, y, -4, 1.5]) for x, y in points]
+    touched = array('H', bytes(64))
+
+    def multiply():
+        mod.v_multiply_batch(verts, mat, dests)
+
+    def lerp():
+        mod.v_lerp_batch(frame1, frame2, 0.5, dests)
+
+    def ndc():
+        mod.v_ndc_to_screen(dests, coords, WIDTH, HEIGHT)
+
+    def normalise():
+        for v in dests:
+            mod.v_normalise(v)
+
+    def rotate():
+        mod.q_rotate(quat, 1, axis)
+        m = matrix()
+        mod.m_rotate(m, quat)
+        mod.m_translate(m, axis)
+        mod.m_multiply(m, mat)
+
+    def sort():
+        # Refill with the same unsorted depths each time, like the renderer does every frame
+        for i in range(NUM_FACES):
+            depths[i * 2] = i
+            depths[i * 2 + 1] = (i * 7919) % NUM_FACES
+        mod.z_sort(depths, NUM_FACES)
+
+    def bsp():
+        mod.bsp_traverse(nodes, normals, plane_dists, position, depths)
+
+    def particles():
+        mod.p_update(pool, NUM_PARTICLES, 0.001, accel, view_proj, particle_coords, WIDTH, HEIGHT)
+
+    def bodies():
+        mod.b_update(state, NUM_BODIES, 0.001, body_matrices)
+
+    def cast_rays():
+        for ray in rays:
+            ray[6] = 100
+            mod.bvh_ray(bvh[0], bvh[1], bvh[2], bvh[3], bvh_inverse, ray)
+
+    def drop_spheres():
+        for sphere in spheres:
+            mod.bvh_sphere(bvh[0], bvh[1], bvh[2], bvh[3], bvh_inverse, sphere, touched)
+
+    def draw_particles():
+        mod.fb_particles(fb, WIDTH, HEIGHT, 0, particle_coords, NUM_PARTICLES, 0xffff, 2)
+
+    def delta_rle():
+        # Change a band of the frame each time so there is something to encode
+        for i in range(0, len(fb), 97):
+            fb[i] = (fb[i] + 1) & 0xff
+        pixel = 0
+        keyframe = False
+        while pixel < WIDTH * HEIGHT:
+            pixel, _ = mod.fb_delta_rle(fb, previous, output, pixel, keyframe)
+
+    def draw_lines():
+        mod.fb_lines(fb, WIDTH, HEIGHT, 0, lines, colours, len(colours))
+
+    def expand():
+        for start in range(0, WIDTH * HEIGHT, len(chunk) // 2):
+            mod.fb_expand(indexed, start, palette, chunk)
+
+    def upscale():
+        mod.fb_upscale(fb, WIDTH, HEIGHT)
+
+    def draw_points():
+        mod.fb_points(fb, WIDTH, HEIGHT, 0, lines, colours, len(colours))
+
+    return [
+        ('v_multiply_batch', multiply),
+        ('v_lerp_batch', lerp),
+        ('v_ndc_to_screen', ndc),
+        ('v_normalise', normalise),
+        ('q_rotate/m_*', rotate),
+        ('z_sort', sort),
+        ('bsp_traverse', bsp),
+        ('p_update', particles),
+        ('b_update', bodies),
+        ('bvh_ray', cast_rays),
+        ('bvh_sphere', drop_spheres),
+        ('fb_delta_rle', delta_rle),
+        ('fb_lines', draw_lines),
+        ('fb_points', draw_points),
+        ('fb_particles', draw_particles),
+        ('fb_expand', expand),
+        ('fb_upscale', upscale),
+    ]
+
+
+def time_us(func, repeat=10):
+    # Run once first so any allocation or compilation doesn't count
+    func()
+    start_t = time.ticks_us()
+    for _ in range(repeat):
+        func()
+    return time.ticks_diff(time.ticks_us(), start_t) // repeat
+
+
+def main():
+    fallback = benchmarks(tidal3d_viper)
+    native = benchmarks(tidal3d) if tidal3d else [(name, None) for name, _ in fallback]
+    print('{:<18}{:>12}{:>12}{:>8}'.format('', 'native', 'fallback', 'ratio'))
+    for (name, fallback_func), (_, native_func) in zip(fallback, native):
+        fallback_t = time_us(fallback_func)
+        if native_func:
+            native_t = time_us(native_func)
+            ratio = '{:.1f}x'.format(fallback_t / max(1, native_t))
+            print('{:<18}{:>9,} us{:>9,} us{:>8}'.format(name, native_t, fallback_t, ratio))
+        else:
+            print('{:<18}{:>12}{:>9,} us{:>8}'.format(name, '-', fallback_t, '-'))
+
+
+main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Host side of the renderer's frame capture mode
+
+Reads the stream of delta and run-length encoded frames that the app writes to the USB serial console
+when capturing is turned on (press the joystick in on the badge) and saves them either as a series
+of PNG images, or as a video by piping them through ffmpeg; any other console output, such as the
+frame timings, is passed through to stdout
+
+Example usage:
+
+    python tools/capture.py -d /dev/ttyACM0 -o frames/
+    python tools/capture.py -d /dev/ttyACM0 -o demo.mp4 --fps 15
+"""
+
+import argparse
+import array
+import os
+import struct
+import subprocess
+import sys
+import zlib
+
+import pyboard
+
+# These must match the definitions in app/capture.py
+MAGIC = b"T3DC"
+HEADER = "<HHIIHB"
+HEADER_SIZE = struct.calcsize(HEADER)
+FLAG_KEYFRAME = 1
+FLAG_END_OF_FRAME = 2
+
+RLE_REPEAT = 0x8000
+
+
+class FrameDecoder:
+    """
+    Reconstructs frames from encoded chunks, the decoder keeps the previous frame in the same way as
+    the encoder does on the device so that the differences can be applied to it
+    """
+
+    def __init__(self):
+        self.pixels = None
+        self.synced = False
+
+    def decode(self, width, height, start, payload, flags):
+        """
+        Applies a chunk of encoded frame data, returns the frame as RGB565 pixel values if this was
+        the final chunk of the frame, otherwise None
+        """
+        keyframe = flags & FLAG_KEYFRAME
+        if keyframe and start == 0:
+            self.pixels = array.array("H", bytes(2 * width * height))
+            self.synced = True
+        if not self.synced:
+            # Until we see the start of a keyframe we have nothing to apply differences to
+            return None
+
+        words = array.array("H", payload)
+        if sys.byteorder == "big":
+            words.byteswap()
+        pixels = self.pixels
+        i = 0
+        p = start
+        while i < len(words):
+            header = words[i]
+            i += 1
+            if header & RLE_REPEAT:
+                n = header & ~RLE_REPEAT
+                d = words[i]
+                i += 1
+                if keyframe:
+                    pixels[p : p + n] = array.array("H", [d]) * n
+                elif d:
+                    for k in range(p, p + n):
+                        pixels[k] ^= d
+            else:
+                n = header
+                if keyframe:
+                    pixels[p : p + n] = words[i : i + n]
+                else:
+                    for k in range(n):
+                        pixels[p + k] ^= words[i + k]
+                i += n
+            p += n
+
+        if flags & FLAG_END_OF_FRAME:
+            return pixels
+        return None
+
+
+# Lookup table for converting the framebuffer's byte-swapped RGB565 pixel values to RGB888
+_RGB_TABLE = None
+
+
+def rgb565_to_rgb888(pixels):
+    global _RGB_TABLE
+    if _RGB_TABLE is None:
+        table = bytearray(3 * 65536)
+        for v in range(65536):
+            # The framebuffer holds colours with their bytes swapped for the display
+            c = ((v & 0xFF) << 8) | (v >> 8)
+            r = (c >> 11) & 0x1F
+            g = (c >> 5) & 0x3F
+            b = c & 0x1F
+            table[v * 3] = (r << 3) | (r >> 2)
+            table[v * 3 + 1] = (g << 2) | (g >> 4)
+            table[v * 3 + 2] = (b << 3) | (b >> 2)
+        _RGB_TABLE = bytes(table)
+    table = _RGB_TABLE
+    return b"".join([table[v * 3 : v * 3 + 3] for v in pixels])
+
+
+def write_png(filename, width, height, rgb):
+    def chunk(kind, data):
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+        )
+
+    stride = width * 3
+    raw = b"".join(b"\x00" + rgb[y * stride : (y + 1) * stride] for y in range(height))
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw)))
+        f.write(chunk(b"IEND", b""))
+
+
+class PngWriter:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.count = 0
+
+    def write(self, width, height, rgb):
+        write_png(
+            os.path.join(self.directory, "frame_{:05d}.png".format(self.count)), width, height, rgb
+        )
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+class VideoWriter:
+    def __init__(self, filename, fps):
+        self.filename = filename
+        self.fps = fps
+        self.ffmpeg = None
+        self.count = 0
+
+    def write(self, width, height, rgb):
+        if not self.ffmpeg:
+            # Wait for the first frame to know the frame size
+            cmd = ["ffmpeg", "-loglevel", "error", "-y"]
+            cmd += ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "{}x{}".format(width, height)]
+            cmd += ["-r", str(self.fps), "-i", "-", "-pix_fmt", "yuv420p", self.filename]
+            self.ffmpeg = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        self.ffmpeg.stdin.write(rgb)
+        self.count += 1
+
+    def close(self):
+        if self.ffmpeg:
+            self.ffmpeg.stdin.close()
+            self.ffmpeg.wait()
+
+
+def capture(serial, writer, max_frames=None, console=sys.stdout.buffer):
+    """
+    Reads from the serial connection, decoding frames and passing them to the writer until the given
+    number of frames has been written; returns the number of frames written
+    """
+    decoder = FrameDecoder()
+    buf = bytearray()
+    frames = 0
+    while max_frames is None or frames < max_frames:
+        buf += serial.read(max(1, serial.inWaiting()))
+
+        # Anything before the start of a chunk is console output
+        pos = buf.find(MAGIC)
+        if pos < 0:
+            # Keep back enough to catch a magic marker that is split across reads
+            keep = len(MAGIC) - 1
+            if len(buf) > keep:
+                console.write(buf[:-keep])
+                console.flush()
+                del buf[:-keep]
+            continue
+        if pos > 0:
+            console.write(buf[:pos])
+            console.flush()
+            del buf[:pos]
+
+        # Wait for the whole chunk to arrive
+        if len(buf) < len(MAGIC) + HEADER_SIZE:
+            continue
+        width, height, frame, start, length, flags = struct.unpack_from(HEADER, buf, len(MAGIC))
+        end = len(MAGIC) + HEADER_SIZE + length
+        if len(buf) < end:
+            continue
+        payload = bytes(buf[len(MAGIC) + HEADER_SIZE : end])
+        del buf[:end]
+
+        pixels = decoder.decode(width, height, start, payload, flags)
+        if pixels is not None:
+            writer.write(width, height, rgb565_to_rgb888(pixels))
+            frames += 1
+    return frames
+
+
+def main():
+    cmd_parser = argparse.ArgumentParser(description="Capture frames streamed from the badge.")
+    cmd_parser.add_argument(
+        "-d",
+        "--device",
+        default=os.environ.get("PYBOARD_DEVICE", "/dev/ttyACM0"),
+        help="the serial device or other device specification understood by pyboard",
+    )
+    cmd_parser.add_argument(
+        "-b",
+        "--baudrate",
+        default=os.environ.get("PYBOARD_BAUDRATE", "115200"),
+        help="the baud rate of the serial device",
+    )
+    cmd_parser.add_argument(
+        "-o",
+        "--output",
+        default="frames",
+        help="a directory to write PNG frames into, or a video file name to encode with ffmpeg",
+    )
+    cmd_parser.add_argument("--fps", default=10, type=int, help="frame rate of the output video")
+    cmd_parser.add_argument("-n", "--frames", type=int, help="stop after this many frames")
+    args = cmd_parser.parse_args()
+
+    if os.path.splitext(args.output)[1] in (".mp4", ".mkv", ".webm", ".gif", ".avi"):
+        writer = VideoWriter(args.output, args.fps)
+    else:
+        writer = PngWriter(args.output)
+
+    try:
+        pyb = pyboard.Pyboard(args.device, args.baudrate)
+    except pyboard.PyboardError as er:
+        print(er)
+        sys.exit(1)
+
+    frames = 0
+    try:
+        frames = capture(pyb.serial, writer, args.frames)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        pyb.close()
+    print("\n{} frames written".format(getattr(writer, "count", frames)))
+
+
+if __name__ == "__main__":
+    main()
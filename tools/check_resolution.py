@@ -0,0 +1,61 @@
+"""
+Checks the resolution controller of app/resolution.py against known sequences of frame times, the same
+way as the renderer's loop feeds it: once for each frame drawn, with the whole time of that frame
+
+This runs off the badge, on either the unix port of MicroPython or on CPython; run it from the top of
+the repository:
+
+    python tools/check_resolution.py
+    micropython tools/check_resolution.py
+"""
+
+import sys
+
+sys.path.insert(0, "tools/shims/cpython")
+sys.path.append("app")
+from resolution import ResolutionController, HOLD_FRAMES
+
+BUDGET = 20000
+
+
+def feed(controller, frame_times):
+    # Returns the scale chosen after each frame time
+    return [controller.update(t) for t in frame_times]
+
+
+def check(name, scales, expected):
+    if scales != expected:
+        print("{}: expected {}, got {}".format(name, expected, scales))
+        sys.exit(1)
+    print("{}: ok".format(name))
+
+
+def main():
+    # Frames over the budget only switch to half resolution once the hold after starting has run out
+    controller = ResolutionController(BUDGET)
+    check("slow frames", feed(controller, [30000] * (HOLD_FRAMES + 1)), [1] * HOLD_FRAMES + [2])
+
+    # Frames under the budget, but not under the fraction of it needed to recover, stay at half
+    # resolution, frames well under it go back to full resolution once the average has come down
+    scales = feed(controller, [15000] * (HOLD_FRAMES + 10))
+    check("recovering frames", scales, [2] * (HOLD_FRAMES + 10))
+    scales = feed(controller, [5000] * 20)
+    first = scales.index(1)
+    check("fast frames", scales, [2] * first + [1] * (20 - first))
+
+    # Frames within the budget never change the resolution
+    controller = ResolutionController(BUDGET)
+    check("steady frames", feed(controller, [BUDGET] * 100), [1] * 100)
+
+    # A pipelined loop polls every millisecond or so for a frame to be ready, feeding the controller
+    # the time since the last frame on every poll would keep a frame time of 25 ms at full resolution,
+    # as the average of the growing partial times is around half that
+    controller = ResolutionController(BUDGET)
+    polls = list(range(1000, 26000, 1000)) * 20
+    check("partial frame times", feed(controller, polls)[-1:], [1])
+    controller = ResolutionController(BUDGET)
+    check("whole frame times", feed(controller, [25000] * 40)[-1:], [2])
+
+
+if __name__ == "__main__":
+    main()
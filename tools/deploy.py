@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Incremental deployment of the app to a badge over a single raw REPL session
+
+Unlike invoking pyboard.py once per file, this opens the device once, enters the raw REPL once and
+then only transfers files whose contents differ from what is already on the device, as determined by
+comparing SHA256 hashes of the local and remote files. File data is sent base64 encoded in large
+chunks, which raw-paste mode can stream without the per-256-byte round trips of Pyboard.fs_put.
+
+Example usage:
+
+    python tools/deploy.py -d /dev/ttyACM0 /apps/tidal_3d app/*.py app/*.obj app/*.mtl
+
+To deploy to every attached badge at once, for example when setting up a table of badges for a
+workshop, each device gets its own worker thread and is verified by hash once the copy is done:
+
+    python tools/deploy.py --all /apps/tidal_3d app/*.py app/*.obj app/*.mtl
+
+Python modules can be cross-compiled to .mpy bytecode before they are deployed, this needs a build
+of mpy-cross that matches the version of MicroPython in the firmware:
+
+    python tools/deploy.py --mpy /apps/tidal_3d app/*.py app/*.obj app/*.mtl
+
+Any device specification understood by the Pyboard class may be used, so the same tool can be pointed
+at a MicroPython unix port for testing, for example:
+
+    python tools/deploy.py -d "execpty:socat -d -d PTY,raw,echo=0 EXEC:micropython" /tmp/tidal_3d app/*.py
+"""
+
+import argparse
+import base64
+import hashlib
+import os
+import subprocess
+import sys
+
+import pyboard
+
+# Amount of file data sent per command, large chunks amortise the cost of the command round trip but
+# the device must be able to hold the base64 encoded command and the decoded data in its heap at once
+DEFAULT_CHUNK_SIZE = 4096
+
+# USB vendor ID of the badge's serial port
+ESPRESSIF_VID = 0x303A
+
+# Architecture for native code emitted by mpy-cross, the badge's ESP32-S3 is an Xtensa LX7 core
+DEFAULT_MARCH = "xtensawin"
+
+# File in the build directory that records which architecture and version of mpy-cross its .mpy files
+# were compiled with, see compile_modules()
+MPY_STAMP = "mpy-cross.stamp"
+
+# Helper functions that are defined on the device once per session, they are prefixed with an
+# underscore so they are unlikely to clash with anything else in the device's global namespace
+_DEVICE_HELPERS = """\
+import os, binascii
+try:
+    from hashlib import sha256 as _t3d_sha
+except ImportError:
+    _t3d_sha = None
+def _t3d_hash(p):
+    if not _t3d_sha:
+        return '-'
+    try:
+        f = open(p, 'rb')
+    except OSError:
+        return '-'
+    h = _t3d_sha()
+    b = bytearray(512)
+    while True:
+        n = f.readinto(b)
+        if not n:
+            break
+        h.update(b if n == len(b) else b[:n])
+    f.close()
+    return binascii.hexlify(h.digest()).decode()
+def _t3d_mkdirs(p):
+    d = '/' if p.startswith('/') else ''
+    for c in p.split('/'):
+        if c:
+            d += c
+            try:
+                os.mkdir(d)
+            except OSError:
+                pass
+            d += '/'
+def _t3d_rm(p):
+    try:
+        os.remove(p)
+        print(p)
+    except OSError:
+        pass
+_t3d_a2b = binascii.a2b_base64
+"""
+
+
+def local_hash(filename):
+    """
+    Returns the hex encoded SHA256 hash of the given local file, the same form that the device
+    side helper returns for remote files
+    """
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+class Deployer:
+    """
+    Synchronises a set of local files with a directory on the device, all operations are performed
+    in the same raw REPL session, which the caller is expected to have entered already
+    """
+
+    def __init__(self, pyb, dest_dir, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.pyb = pyb
+        self.dest_dir = dest_dir.rstrip("/") or "/"
+        self.chunk_size = chunk_size
+        self.prepared = False
+
+    def remote_path(self, filename):
+        return self.dest_dir.rstrip("/") + "/" + os.path.basename(filename)
+
+    def prepare(self):
+        """
+        Defines the device side helpers and makes sure the destination directory exists
+        """
+        if not self.prepared:
+            self.pyb.exec_(_DEVICE_HELPERS)
+            self.pyb.exec_("_t3d_mkdirs(%r)" % self.dest_dir)
+            self.prepared = True
+
+    def remote_hashes(self, paths):
+        """
+        Returns a dict mapping each of the given remote paths to its hash, or to None if the file
+        does not exist or cannot be hashed on the device, all hashes are fetched in a single command
+        """
+        self.prepare()
+        if not paths:
+            return {}
+        out = self.pyb.exec_("for p in %r:\n print(_t3d_hash(p))" % (list(paths),))
+        hashes = str(out, "ascii").split()
+        if len(hashes) != len(paths):
+            raise pyboard.PyboardError("unexpected hash listing from device: %r" % out)
+        return {p: (None if h == "-" else h) for p, h in zip(paths, hashes)}
+
+    def put(self, src, dest, progress_callback=None):
+        """
+        Copies the given local file to the given path on the device
+        """
+        self.prepare()
+        src_size = os.path.getsize(src)
+        written = 0
+        pyb = self.pyb
+        pyb.exec_("f=open(%r,'wb')\nw=f.write" % dest)
+        try:
+            with open(src, "rb") as f:
+                while True:
+                    data = f.read(self.chunk_size)
+                    if not data:
+                        break
+                    pyb.exec_("w(_t3d_a2b(%r))" % base64.b64encode(data))
+                    written += len(data)
+                    if progress_callback:
+                        progress_callback(written, src_size)
+        finally:
+            pyb.exec_("f.close()")
+
+    def sync(self, srcs, force=False, progress_callback=None, log=print):
+        """
+        Copies each of the given local files into the destination directory on the device, unless
+        the remote copy is already identical; returns the lists of copied and skipped files
+        """
+        dests = [self.remote_path(src) for src in srcs]
+        remote = {} if force else self.remote_hashes(dests)
+        copied = []
+        skipped = []
+        for src, dest in zip(srcs, dests):
+            if not force and remote.get(dest) == local_hash(src):
+                skipped.append(src)
+                if log:
+                    log("skip %s (unchanged)" % src)
+                continue
+            if log:
+                log("cp %s :%s" % (src, dest))
+            self.put(src, dest, progress_callback=progress_callback)
+            copied.append(src)
+        self.remove_shadowing_sources(srcs, log=log)
+        return copied, skipped
+
+    def remove_shadowing_sources(self, srcs, log=print):
+        """
+        When importing, a module's .py source takes precedence over its compiled .mpy bytecode, so
+        remove any source left on the device by a previous upload of the given compiled modules
+        """
+        paths = [
+            self.remote_path(src[: -len(".mpy")] + ".py") for src in srcs if src.endswith(".mpy")
+        ]
+        if not paths:
+            return
+        out = self.pyb.exec_("for p in %r:\n _t3d_rm(p)" % (paths,))
+        if log:
+            for path in str(out, "ascii").split():
+                log("rm :%s" % path)
+
+    def verify(self, srcs):
+        """
+        Compares the hashes of the given local files with their copies on the device; returns the
+        list of files whose remote copy is missing or differs
+        """
+        dests = [self.remote_path(src) for src in srcs]
+        remote = self.remote_hashes(dests)
+        return [src for src, dest in zip(srcs, dests) if remote[dest] != local_hash(src)]
+
+
+def compile_modules(srcs, build_dir, mpy_cross="mpy-cross", march=DEFAULT_MARCH):
+    """
+    Cross-compiles the Python modules among the given files to .mpy bytecode in the build directory,
+    so the device doesn't have to compile them every time the app is launched; returns the list of
+    files to deploy, with each module replaced by its compiled counterpart
+
+    A module is only compiled again when its source is newer than its .mpy, unless the architecture or
+    the version of mpy-cross differ from the ones the build directory was compiled with, as recorded in
+    its stamp file, in which case every module is compiled again
+    """
+    os.makedirs(build_dir, exist_ok=True)
+    version = subprocess.check_output([mpy_cross, "--version"], universal_newlines=True).strip()
+    stamp = "march={}\n{}\n".format(march, version)
+    stamp_path = os.path.join(build_dir, MPY_STAMP)
+    try:
+        with open(stamp_path) as f:
+            rebuild = f.read() != stamp
+    except OSError:
+        rebuild = True
+    if rebuild and os.path.exists(stamp_path):
+        # Forget the old settings first, so that they aren't trusted if compiling fails part way
+        os.remove(stamp_path)
+
+    result = []
+    for src in srcs:
+        if not src.endswith(".py"):
+            result.append(src)
+            continue
+        name = os.path.basename(src)
+        mpy = os.path.join(build_dir, name[: -len(".py")] + ".mpy")
+        if rebuild or not os.path.exists(mpy) or os.path.getmtime(mpy) < os.path.getmtime(src):
+            subprocess.check_call([mpy_cross, "-march=" + march, "-s", name, "-o", mpy, src])
+        result.append(mpy)
+
+    if rebuild:
+        with open(stamp_path, "w") as f:
+            f.write(stamp)
+    return result
+
+
+def discover_devices():
+    """
+    Returns the serial devices of all attached badges, the badge's USB serial port identifies itself
+    with Espressif's USB vendor ID
+    """
+    try:
+        from serial.tools import list_ports
+    except ImportError:
+        import glob
+
+        return sorted(glob.glob("/dev/ttyACM*"))
+    return sorted(p.device for p in list_ports.comports() if p.vid == ESPRESSIF_VID)
+
+
+def deploy(
+    device,
+    dest_dir,
+    srcs,
+    baudrate=115200,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    force=False,
+    verify=False,
+    progress_callback=None,
+    log=print,
+):
+    """
+    Opens the given device and synchronises the given files with the destination directory on it,
+    optionally verifying the hashes of all the files afterwards; returns the lists of copied and
+    skipped files, raises PyboardError if anything goes wrong
+    """
+    pyb = pyboard.Pyboard(device, baudrate)
+    try:
+        pyb.enter_raw_repl(soft_reset=False)
+        deployer = Deployer(pyb, dest_dir, chunk_size)
+        copied, skipped = deployer.sync(
+            srcs, force=force, progress_callback=progress_callback, log=log
+        )
+        if verify:
+            bad = deployer.verify(srcs)
+            if bad:
+                raise pyboard.PyboardError("verification failed: " + ", ".join(bad))
+        pyb.exit_raw_repl()
+    finally:
+        pyb.close()
+    return copied, skipped
+
+
+def error_message(er):
+    # Errors from commands executed on the device carry the device's traceback
+    if len(er.args) == 3:
+        return str(er.args[2], "ascii").strip()
+    return str(er)
+
+
+def deploy_all(devices, dest_dir, srcs, max_workers=None, **kwargs):
+    """
+    Deploys to all the given devices concurrently, each from its own worker thread, reporting
+    progress prefixed by the name of the device; returns a dict mapping each device to either
+    the (copied, skipped) lists or the error that stopped its deployment
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import threading
+
+    print_lock = threading.Lock()
+
+    def device_log(device):
+        def log(msg):
+            with print_lock:
+                print("{}: {}".format(device, msg))
+
+        return log
+
+    def device_progress(log):
+        # Report each quarter of a file as it is reached, a progress bar per device would be
+        # unreadable when output from several devices is interleaved
+        reported = [0]
+
+        def progress(size, total_size):
+            quarter = size * 4 // total_size
+            if size >= total_size:
+                reported[0] = 0
+            elif quarter > reported[0]:
+                reported[0] = quarter
+                log("{}%".format(quarter * 25))
+
+        return progress
+
+    def worker(device):
+        log = device_log(device)
+        try:
+            result = deploy(
+                device, dest_dir, srcs, progress_callback=device_progress(log), log=log, **kwargs
+            )
+            log("done")
+            return result
+        except pyboard.PyboardError as er:
+            log("FAILED: " + error_message(er))
+            return er
+        except Exception as er:
+            log("FAILED: {!r}".format(er))
+            return er
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(devices) or 1) as pool:
+        return dict(zip(devices, pool.map(worker, devices)))
+
+
+def show_progress_bar(size, total_size):
+    if not sys.stdout.isatty():
+        return
+    verbose_size = 2048
+    bar_length = 20
+    if total_size < verbose_size:
+        return
+    elif size >= total_size:
+        # Clear progress bar when copy completes
+        print("\r" + " " * (20 + bar_length) + "\r", end="")
+    else:
+        progress = size / total_size
+        bar = round(progress * bar_length)
+        print(
+            "\rprogress: [{}{}] {:.0f}%".format("#" * bar, "-" * (bar_length - bar), progress * 100),
+            end="",
+        )
+    sys.stdout.flush()
+
+
+def main():
+    cmd_parser = argparse.ArgumentParser(description="Incrementally deploy files to badges.")
+    cmd_parser.add_argument(
+        "-d",
+        "--device",
+        action="append",
+        help="the serial device or other device specification understood by pyboard, may be "
+        "given more than once to deploy to several devices at once",
+    )
+    cmd_parser.add_argument(
+        "-a",
+        "--all",
+        action="store_true",
+        help="deploy to all attached badges at once",
+    )
+    cmd_parser.add_argument(
+        "-b",
+        "--baudrate",
+        default=os.environ.get("PYBOARD_BAUDRATE", "115200"),
+        help="the baud rate of the serial device",
+    )
+    cmd_parser.add_argument(
+        "--chunk-size",
+        default=DEFAULT_CHUNK_SIZE,
+        type=int,
+        help="number of bytes of file data to send per command",
+    )
+    cmd_parser.add_argument(
+        "--force", action="store_true", help="copy all files even if they are unchanged"
+    )
+    cmd_parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="check the hashes of all files after copying [default when deploying to several devices]",
+    )
+    cmd_parser.add_argument(
+        "--mpy",
+        action="store_true",
+        help="deploy Python modules as bytecode cross-compiled with mpy-cross",
+    )
+    cmd_parser.add_argument(
+        "--mpy-cross",
+        default=os.environ.get("MPY_CROSS", "mpy-cross"),
+        help="the mpy-cross executable, which must match the firmware's version of MicroPython",
+    )
+    cmd_parser.add_argument(
+        "--march",
+        default=DEFAULT_MARCH,
+        help="architecture for native code emitted by mpy-cross",
+    )
+    cmd_parser.add_argument(
+        "--build-dir", default="build", help="directory to write compiled modules into"
+    )
+    cmd_parser.add_argument("dest", help="destination directory on the device")
+    cmd_parser.add_argument("files", nargs="+", help="local files to deploy")
+    args = cmd_parser.parse_args()
+
+    files = args.files
+    if args.mpy:
+        try:
+            files = compile_modules(files, args.build_dir, args.mpy_cross, args.march)
+        except (OSError, subprocess.CalledProcessError) as er:
+            print("mpy-cross failed: {}".format(er))
+            sys.exit(1)
+
+    devices = list(args.device or [])
+    if args.all:
+        devices += [d for d in discover_devices() if d not in devices]
+        if not devices:
+            print("no badges found")
+            sys.exit(1)
+    if not devices:
+        devices = [os.environ.get("PYBOARD_DEVICE", "/dev/ttyACM0")]
+
+    kwargs = {
+        "baudrate": args.baudrate,
+        "chunk_size": args.chunk_size,
+        "force": args.force,
+    }
+
+    if len(devices) == 1:
+        try:
+            copied, skipped = deploy(
+                devices[0],
+                args.dest,
+                files,
+                verify=args.verify,
+                progress_callback=show_progress_bar,
+                **kwargs
+            )
+        except pyboard.PyboardError as er:
+            print(error_message(er))
+            sys.exit(1)
+        print("{} copied, {} unchanged".format(len(copied), len(skipped)))
+        return
+
+    results = deploy_all(devices, args.dest, files, verify=True, **kwargs)
+    failed = 0
+    print()
+    for device, result in results.items():
+        if isinstance(result, Exception):
+            failed += 1
+            print("{}: FAILED".format(device))
+        else:
+            copied, skipped = result
+            print("{}: {} copied, {} unchanged, verified".format(device, len(copied), len(skipped)))
+    if failed:
+        print("{} of {} devices failed".format(failed, len(devices)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
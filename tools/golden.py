@@ -0,0 +1,242 @@
+"""
+Golden image and timing regression harness for the renderer
+
+Renders every bundled model in every render mode at a set of fixed orientations through the renderer's
+real render_scene method, compares the contents of the framebuffer against stored golden images and
+shows how long each frame took to render alongside any differences, so that optimisations can be
+checked for both correctness and speed
+
+This runs off the badge, on either the unix port of MicroPython (which will use the Python fallback of
+the tidal3d module, unless it was built into the unix port) or on CPython, using the stand-ins for the
+badge's modules in tools/shims; run it from the top of the repository:
+
+    python tools/golden.py
+    micropython tools/golden.py
+
+Options:
+
+    --update          write the rendered frames as the new golden images
+    --tolerance N     allow each colour channel of a pixel to differ by up to N steps (default 0)
+    --max-pixels N    allow up to N pixels to differ by more than the tolerance (default 0)
+    --repeat N        render each frame N times and show the average time (default 1)
+    --model NAME      only render the given model, may be given more than once
+
+Golden images are kept in tools/golden/, run-length encoded as pairs of little-endian 16-bit words, a
+count and a pixel value; frames that don't match are written to build/golden/failed/ in the same format
+"""
+
+from array import array
+import gc
+import os
+import sys
+import time
+
+CPYTHON = sys.implementation.name == "cpython"
+
+# Orientations to render each model at, as rotations in degrees around an axis
+ORIENTATIONS = [
+    (0, (0, 1, 0)),
+    (30, (0, 1, 0)),
+    (60, (1, 0, 0)),
+    (135, (0.6, 0.8, 0)),
+]
+
+GOLDEN_DIR = "tools/golden"
+BUILD_DIR = "build/golden"
+
+
+def makedirs(path):
+    # Neither os.makedirs nor os.path are available on MicroPython
+    current = ""
+    for part in path.split("/"):
+        current = current + "/" + part if current or not part else part
+        if not part:
+            continue
+        try:
+            os.mkdir(current)
+        except OSError:
+            pass
+
+
+def stage_app(root, dest):
+    """
+    Copies the app to where the renderer expects to load its models from, relative to the current
+    directory, which is also somewhere it can be imported from as a package with the right name
+    """
+    makedirs(dest)
+    for name in os.listdir(root + "/app"):
+        if name.endswith((".py", ".obj", ".mtl")):
+            with open(root + "/app/" + name, "rb") as src:
+                data = src.read()
+            with open(dest + "/" + name, "wb") as out:
+                out.write(data)
+
+
+def setup(root):
+    sys.path.insert(0, root + "/tools/shims")
+    if CPYTHON:
+        sys.path.insert(0, root + "/tools/shims/cpython")
+        if not hasattr(time, "ticks_us"):
+            time.ticks_us = lambda: time.perf_counter_ns() // 1000
+            time.ticks_ms = lambda: time.perf_counter_ns() // 1000000
+            time.ticks_diff = lambda a, b: a - b
+        if not hasattr(gc, "mem_free"):
+            gc.mem_free = lambda: 0
+            gc.mem_alloc = lambda: 0
+
+    makedirs(root + "/" + BUILD_DIR)
+    stage_app(root, root + "/" + BUILD_DIR + "/apps/tidal_3d")
+    sys.path.insert(0, root + "/" + BUILD_DIR + "/apps")
+    os.chdir(root + "/" + BUILD_DIR)
+
+
+def encode(buffer):
+    pixels = array("H", buffer)
+    out = array("H")
+    i = 0
+    n = len(pixels)
+    while i < n:
+        value = pixels[i]
+        run = 1
+        while i + run < n and run < 0xFFFF and pixels[i + run] == value:
+            run += 1
+        out.append(run)
+        out.append(value)
+        i += run
+    return out
+
+
+def decode(data):
+    words = array("H", data)
+    pixels = array("H")
+    for i in range(0, len(words), 2):
+        pixels.extend(array("H", [words[i + 1]]) * words[i])
+    return pixels
+
+
+def compare(expected, actual, tolerance):
+    """
+    Returns the number of pixels where any colour channel differs by more than the tolerance, and the
+    largest difference in any channel
+    """
+    over = 0
+    largest = 0
+    for i in range(len(actual)):
+        a = actual[i]
+        b = expected[i] if i < len(expected) else 0
+        if a == b:
+            continue
+        # Pixels are RGB565 with their bytes swapped for the display
+        a = ((a & 0xFF) << 8) | (a >> 8)
+        b = ((b & 0xFF) << 8) | (b >> 8)
+        diff = max(abs((a >> 11) - (b >> 11)), abs(((a >> 5) & 0x3F) - ((b >> 5) & 0x3F)))
+        diff = max(diff, abs((a & 0x1F) - (b & 0x1F)))
+        largest = max(largest, diff)
+        if diff > tolerance:
+            over += 1
+    if len(expected) != len(actual):
+        over += abs(len(expected) - len(actual))
+    return over, largest
+
+
+def parse_args(argv):
+    options = {"update": False, "tolerance": 0, "max-pixels": 0, "repeat": 1, "model": []}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "--update":
+            options["update"] = True
+        elif arg in ("--tolerance", "--max-pixels", "--repeat"):
+            i += 1
+            options[arg[2:]] = int(argv[i])
+        elif arg == "--model":
+            i += 1
+            options["model"].append(argv[i])
+        else:
+            print("unknown option: " + arg)
+            sys.exit(2)
+        i += 1
+    return options
+
+
+def main():
+    options = parse_args(sys.argv[1:])
+    root = os.getcwd()
+    setup(root)
+
+    import tidal_3d
+
+    golden_dir = root + "/" + GOLDEN_DIR
+    failed_dir = root + "/" + BUILD_DIR + "/failed"
+    makedirs(golden_dir)
+    makedirs(failed_dir)
+    for name in os.listdir(failed_dir):
+        os.remove(failed_dir + "/" + name)
+
+    models = options["model"] or sorted(n for n in os.listdir("apps/tidal_3d") if n.endswith(".obj"))
+    modes = [
+        tidal_3d.MODE_POINT_CLOUD,
+        tidal_3d.MODE_WIREFRAME_FULL,
+        tidal_3d.MODE_WIREFRAME_BACK_FACE_CULLING,
+        tidal_3d.MODE_SOLID,
+        tidal_3d.MODE_SOLID_SHADED,
+    ]
+
+    renderer = tidal_3d.Renderer()
+    fb = renderer.fb
+    failures = 0
+    total_t = 0
+    print("{:<28}{:>8}{:>8}{:>12}".format("frame", "pixels", "max", "time"))
+    for model in models:
+        renderer.render_object = model
+        renderer.load_mesh()
+        mesh = renderer.mesh
+        for o, (degrees, axis) in enumerate(ORIENTATIONS):
+            for mode in modes:
+                name = "{}_{}_{}".format(model[:-4], o, mode)
+
+                # Render from the same starting point each time
+                render_t = 0
+                for _ in range(options["repeat"]):
+                    mesh.orientation[0] = 1
+                    mesh.orientation[1] = 0
+                    mesh.orientation[2] = 0
+                    mesh.orientation[3] = 0
+                    tidal_3d.q_rotate(mesh.orientation, degrees, array("f", axis))
+                    renderer.bodies.update(0)
+                    fb.fill(0)
+                    start_t = time.ticks_us()
+                    renderer.render_scene(mode)
+                    render_t += time.ticks_diff(time.ticks_us(), start_t)
+                render_t //= options["repeat"]
+                total_t += render_t
+
+                filename = golden_dir + "/" + name + ".rle"
+                if options["update"]:
+                    with open(filename, "wb") as f:
+                        f.write(encode(fb.buffer))
+                    print("{:<28}{:>8}{:>8}{:>9,} us".format(name, "-", "-", render_t))
+                    continue
+
+                try:
+                    with open(filename, "rb") as f:
+                        expected = decode(f.read())
+                except OSError:
+                    expected = array("H")
+                actual = array("H", fb.buffer)
+                over, largest = compare(expected, actual, options["tolerance"])
+                status = ""
+                if over > options["max-pixels"]:
+                    status = "  FAILED" if len(expected) else "  MISSING"
+                    failures += 1
+                    with open(failed_dir + "/" + name + ".rle", "wb") as f:
+                        f.write(encode(fb.buffer))
+                print("{:<28}{:>8}{:>8}{:>9,} us{}".format(name, over, largest, render_t, status))
+
+    print("total render time {:,} us".format(total_t))
+    if failures:
+        print("{} frames did not match".format(failures))
+        sys.exit(1)
+
+
+main()
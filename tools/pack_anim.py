@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Packs a vertex animation for the renderer
+
+Takes a sequence of Wavefront object files, one for each keyframe, which must all have the same
+vertices in the same order (as Blender's OBJ exporter writes when exporting an animation with
+"Animation" ticked) and writes them into a single file that the app streams keyframes from, see
+app/animation.py; alternatively, takes a single object file and generates a wobbling animation of it,
+which is handy for trying out animation without having to make one
+
+The animation is played on the mesh with the same name, so it must be uploaded alongside the mesh's own
+object file, which is also the pose used before the animation starts
+
+Example usage:
+
+    python tools/pack_anim.py -o app/robot.anim --fps 24 robot_000001.obj robot_000002.obj ...
+    python tools/pack_anim.py -o app/dodeca.anim --wobble 32 app/dodeca.obj
+    ./upload.sh app/dodeca.anim
+"""
+
+import argparse
+import array
+import math
+import struct
+import sys
+
+# These must match the definitions in app/animation.py
+MAGIC = b"T3DA"
+VERSION = 1
+HEADER = "<4sHHHHffff"
+
+
+def read_vertices(filename):
+    vertices = []
+    with open(filename) as f:
+        for line in f:
+            tokens = line.split()
+            if tokens and tokens[0] == "v":
+                vertices.append([float(v) for v in tokens[1:4]])
+    return vertices
+
+
+def wobble(vertices, num_frames):
+    """
+    Generates keyframes where the mesh swells and shrinks in a wave that travels up it, the first
+    keyframe is the mesh as it is so that the animation starts from the mesh's own pose
+    """
+    lo = min(v[1] for v in vertices)
+    hi = max(v[1] for v in vertices)
+    height = hi - lo or 1
+    frames = []
+    for k in range(num_frames):
+        phase = 2 * math.pi * k / num_frames
+        frame = []
+        for x, y, z in vertices:
+            scale = 1 + 0.15 * math.sin(phase) * math.cos(math.pi * (y - lo) / height + phase)
+            frame.append([x * scale, y, z * scale])
+        frames.append(frame)
+    return frames
+
+
+def bounding_sphere(frames):
+    # The same method as Mesh.bounding_sphere() in app/object.py, over the vertices of every keyframe
+    points = [v for frame in frames for v in frame]
+    lo = [min(v[i] for v in points) for i in range(3)]
+    hi = [max(v[i] for v in points) for i in range(3)]
+    centre = [(lo[i] + hi[i]) / 2 for i in range(3)]
+    radius = max(math.dist(v, centre) for v in points)
+    return centre + [radius]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packs a vertex animation for the renderer")
+    parser.add_argument("-o", "--output", required=True, help="animation file to write")
+    parser.add_argument("--fps", type=int, default=8, help="keyframes per second (default 8)")
+    parser.add_argument(
+        "--wobble", type=int, metavar="N", help="generate N keyframes of a wobble from a single object file"
+    )
+    parser.add_argument("objects", nargs="+", help="object files for each keyframe")
+    args = parser.parse_args()
+
+    if args.wobble:
+        if len(args.objects) != 1:
+            parser.error("--wobble takes a single object file")
+        frames = wobble(read_vertices(args.objects[0]), args.wobble)
+    else:
+        frames = [read_vertices(filename) for filename in args.objects]
+    num_vertices = len(frames[0])
+    for filename, frame in zip(args.objects, frames):
+        if len(frame) != num_vertices:
+            sys.exit("{} has {} vertices, the first keyframe has {}".format(filename, len(frame), num_vertices))
+
+    x, y, z, r = bounding_sphere(frames)
+    with open(args.output, "wb") as f:
+        f.write(struct.pack(HEADER, MAGIC, VERSION, num_vertices, len(frames), args.fps, x, y, z, r))
+        for frame in frames:
+            data = array.array("f", [c for v in frame for c in v])
+            if sys.byteorder == "big":
+                data.byteswap()
+            f.write(data.tobytes())
+    size = struct.calcsize(HEADER) + len(frames) * num_vertices * 12
+    print("{}: {} keyframes of {} vertices, {:,} bytes".format(args.output, len(frames), num_vertices, size))
+
+
+if __name__ == "__main__":
+    main()
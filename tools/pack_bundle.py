@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Packs models into a bundle for the renderer
+
+Takes Wavefront object files, along with their material libraries and any vertex animations alongside
+them, and writes them into a single file of named sections that the app keeps open and loads models
+from, see app/bundle.py; everything the app would otherwise work out when parsing a model's files is
+worked out here instead, with the app's own code, so that loading a model from the bundle is just a
+matter of reading arrays
+
+Each model is an entry in the bundle named after its object file, with these sections:
+
+    verts      x, y, z of each vertex
+    sizes      number of vertices of each face
+    faces      vertex indices of every face, one face after another
+    normals    x, y, z of each face's normal
+    planes     distance of each face's plane from the origin along its normal
+    colours    r, g, b of each material
+    materials  material index of each face
+    flags      bits that say what kind of mesh it is, such as whether it is convex
+    anim       the model's vertex animation file, if it has one, see tools/pack_anim.py
+    bsp        nodes of a BSP tree of the model's faces, if it was asked for, see bsp_traverse() in
+               module/tidal3d.c
+    bvh        nodes of a bounding volume hierarchy of the model's triangles, for picking faces and
+               finding collisions, see app/bvh.py
+    boxes      low and high corners of the box around each node of the bounding volume hierarchy
+    tris       vertex indices and face index of each triangle of the bounding volume hierarchy
+
+A BSP tree lets the app draw a model's faces in the right order without sorting them, and it gets the
+order right where sorting faces by the depths of their centres doesn't; building one splits any faces
+that cross the planes of other faces and puts the faces in the order of the tree's nodes, so the model
+in the bundle has more faces than its object file; convex and animated models don't get one, because
+convex models don't need sorting and a tree only holds for the vertices it was built from; animated
+models don't get a bounding volume hierarchy for the same reason, the app makes one that tests every
+triangle when it loads them
+
+Example usage:
+
+    python tools/pack_bundle.py -o app/models.bundle app/cube.obj app/dodeca.obj app/teapot.obj
+    python tools/pack_bundle.py -o app/models.bundle --bsp app/cube.obj app/dodeca.obj app/teapot.obj
+    ./upload.sh app/*.py app/models.bundle
+"""
+
+import argparse
+import array
+import os
+import struct
+import sys
+import types
+
+from appmodules import import_app
+
+# These must match the definitions in app/bundle.py
+MAGIC = b"T3DB"
+VERSION = 1
+HEADER = "<4sHH"
+ENTRY = "<23s1sII"
+MAX_NAME = 23
+
+# These must match the definitions in module/tidal3d.c, node indices must be less than BSP_EMIT
+BSP_EMIT = 0x8000
+BSP_NO_NODE = 0xFFFF
+BSP_MAX_DEPTH = 128
+
+# How far a vertex can be from the plane of a face, as a fraction of the radius of the mesh, and still be
+# taken to be in the plane, to allow for rounding errors
+PLANE_TOLERANCE = 0.0001
+
+# Most faces to try the planes of when choosing how to split the faces at each node of a BSP tree, and
+# how many faces out of balance between the two sides of a split is as bad as splitting a face
+BSP_CANDIDATES = 32
+SPLIT_COST = 8
+
+
+class BSPBuilder:
+    """
+    Builds a BSP tree of a mesh's faces, in which each node has the faces that lie in one plane, a front
+    child with the faces in front of that plane and a back child with the faces behind it; faces that
+    cross the plane are split in two, into triangles, as the app only draws triangles
+
+    Each face is a tuple of its vertex indices and the index of the mesh face it came from, whose normal
+    and plane the face keeps even if it is split, so the plane of a node is exactly the plane its faces
+    were split by; new vertices where faces are split are added to the vertices, and are shared by the
+    faces either side of the edge that was split
+    """
+
+    def __init__(self, vertices, normals, plane_dists, tolerance):
+        self.vertices = [array.array("f", v) for v in vertices]
+        self.normals = normals
+        self.plane_dists = plane_dists
+        self.tolerance = tolerance
+
+        # Faces in the order of the nodes they are in, and four unsigned shorts for each node: the index
+        # of its first face, its number of faces, and its front and back children
+        self.faces = []
+        self.nodes = array.array("H")
+        self.depth = 0
+        self.num_split = 0
+
+        # Vertex added where the edge between a pair of vertices crosses the plane of a face
+        self.edge_splits = {}
+
+    def distances(self, indices, plane):
+        # Returns how far in front of the plane of the given mesh face each of the given vertices is
+        n = self.normals[plane]
+        d = self.plane_dists[plane]
+        return [n[0] * v[0] + n[1] * v[1] + n[2] * v[2] - d for v in (self.vertices[i] for i in indices)]
+
+    def sides(self, dists):
+        # Returns 1, -1 or 0 for each of the given distances for in front of, behind, or in a plane
+        t = self.tolerance
+        return [1 if d > t else -1 if d < -t else 0 for d in dists]
+
+    def choose_plane(self, faces):
+        # Returns the face whose plane splits the fewest faces and divides the rest most evenly, out of a
+        # spread of the given faces
+        best = None
+        best_cost = None
+        for candidate in faces[:: max(1, len(faces) // BSP_CANDIDATES)]:
+            front = back = split = 0
+            for indices, _ in faces:
+                sides = self.sides(self.distances(indices, candidate[1]))
+                if 1 in sides and -1 in sides:
+                    split += 1
+                elif 1 in sides:
+                    front += 1
+                elif -1 in sides:
+                    back += 1
+            cost = split * SPLIT_COST + abs(front - back)
+            if best_cost is None or cost < best_cost:
+                best = candidate
+                best_cost = cost
+        return best
+
+    def split_edge(self, a, b, dist_a, dist_b, plane):
+        # Returns the vertex where the edge between the given vertices crosses the plane of the given mesh
+        # face, working it out from the lower vertex index so it is the same from either face of the edge
+        key = (min(a, b), max(a, b), plane)
+        if key not in self.edge_splits:
+            if a > b:
+                a, b, dist_a, dist_b = b, a, dist_b, dist_a
+            t = dist_a / (dist_a - dist_b)
+            va = self.vertices[a]
+            vb = self.vertices[b]
+            self.edge_splits[key] = len(self.vertices)
+            self.vertices.append(array.array("f", [va[i] + (vb[i] - va[i]) * t for i in range(3)]))
+        return self.edge_splits[key]
+
+    def split(self, face, plane, dists, sides):
+        # Returns the triangles of the given face that are in front of and behind the plane of the given
+        # mesh face, vertices in the plane belong to both sides
+        indices, source = face
+        front = []
+        back = []
+        for i in range(len(indices)):
+            j = (i + 1) % len(indices)
+            if sides[i] >= 0:
+                front.append(indices[i])
+            if sides[i] <= 0:
+                back.append(indices[i])
+            if sides[i] * sides[j] < 0:
+                v = self.split_edge(indices[i], indices[j], dists[i], dists[j], plane)
+                front.append(v)
+                back.append(v)
+        self.num_split += 1
+        return (
+            [((front[0], front[i], front[i + 1]), source) for i in range(1, len(front) - 1)],
+            [((back[0], back[i], back[i + 1]), source) for i in range(1, len(back) - 1)],
+        )
+
+    def build(self, faces, depth=1):
+        """
+        Adds a node for the given faces, and nodes for its children, and returns the node's index
+        """
+        if depth > BSP_MAX_DEPTH:
+            raise ValueError("BSP tree is deeper than {} nodes".format(BSP_MAX_DEPTH))
+        self.depth = max(self.depth, depth)
+
+        # The face whose plane is chosen comes first, as the app tests which side of a node's plane the
+        # camera is on against the node's first face
+        chosen = self.choose_plane(faces)
+        plane = chosen[1]
+        node = len(self.nodes) // 4
+        self.nodes.extend([len(self.faces), 0, BSP_NO_NODE, BSP_NO_NODE])
+        self.faces.append(chosen)
+        front = []
+        back = []
+        for face in faces:
+            if face is chosen:
+                continue
+            dists = self.distances(face[0], plane)
+            sides = self.sides(dists)
+            if 1 in sides and -1 in sides:
+                front_faces, back_faces = self.split(face, plane, dists, sides)
+                front.extend(front_faces)
+                back.extend(back_faces)
+            elif 1 in sides:
+                front.append(face)
+            elif -1 in sides:
+                back.append(face)
+            else:
+                self.faces.append(face)
+        self.nodes[node * 4 + 1] = len(self.faces) - self.nodes[node * 4]
+
+        if front:
+            self.nodes[node * 4 + 2] = self.build(front, depth + 1)
+        if back:
+            self.nodes[node * 4 + 3] = self.build(back, depth + 1)
+        return node
+
+
+def mesh_sections(app, filename, bsp=False):
+    """
+    Returns a list of (section name, array) pairs for the model in the given object file, loaded in the
+    same way as Mesh._load() in app/object.py loads it, along with a BSP tree of its faces if asked for,
+    and a bounding volume hierarchy of its triangles
+    """
+    op = app.object.ObjectParser()
+    op.parse(filename)
+    vertices = op.vertices
+    vert_indices = [f["indices"] for f in op.faces]
+    anim = filename[: filename.rfind(".")] + ".anim"
+
+    # Work out the normals with the app's own code, which only needs these attributes of the mesh
+    normals = [array.array("f", [0, 0, 0]) for _ in vert_indices]
+    mesh = types.SimpleNamespace(
+        vertices=vertices,
+        vert_indices=vert_indices,
+        normals=normals,
+        norm_indices=list(range(len(normals))),
+        plane_dists=array.array("f", [0] * len(vert_indices)),
+    )
+    app.object.Mesh._face_normals(mesh)
+    plane_dists = mesh.plane_dists
+    radius = app.object.Mesh.bounding_sphere(vertices)[3]
+    flags = 0
+    if app.object.Mesh.is_convex(vertices, normals, plane_dists, radius):
+        flags |= app.object.FLAG_CONVEX
+
+    colours = []
+    col_indices = [0] * len(vert_indices)
+    mp = app.object.MaterialParser()
+    if op.mat_lib:
+        mp.parse(os.path.join(os.path.dirname(filename), op.mat_lib))
+        for material in mp.materials:
+            colours.append(material["diffuse"])
+            for i in range(len(op.faces)):
+                if op.faces[i]["material"] == material["name"]:
+                    col_indices[i] = len(colours) - 1
+    if not op.mat_lib or not mp.materials:
+        colours = [[255, 255, 255]]
+
+    # The faces of the tree replace the mesh's faces, each taking the normal, plane and material of the
+    # face it came from
+    nodes = None
+    if bsp and not flags & app.object.FLAG_CONVEX and not os.path.exists(anim):
+        builder = BSPBuilder(vertices, normals, plane_dists, radius * PLANE_TOLERANCE)
+        builder.build([(tuple(face), i) for i, face in enumerate(vert_indices)])
+        num_nodes = len(builder.nodes) // 4
+        if num_nodes > BSP_EMIT or len(builder.vertices) > 0xFFFF or len(builder.faces) >= 0xFFFF:
+            raise ValueError("BSP tree has too many nodes, vertices or faces")
+        nodes = builder.nodes
+        vertices = builder.vertices
+        vert_indices = [indices for indices, _ in builder.faces]
+        sources = [source for _, source in builder.faces]
+        normals = [normals[i] for i in sources]
+        plane_dists = array.array("f", [plane_dists[i] for i in sources])
+        col_indices = [col_indices[i] for i in sources]
+
+    sections = [
+        ("verts", array.array("f", [c for v in vertices for c in v])),
+        ("sizes", array.array("B", [len(face) for face in vert_indices])),
+        ("faces", array.array("H", [i for face in vert_indices for i in face])),
+        ("normals", array.array("f", [c for n in normals for c in n])),
+        ("planes", plane_dists),
+        ("colours", array.array("f", [c for colour in colours for c in colour])),
+        ("materials", array.array("B", col_indices)),
+        ("flags", array.array("B", [flags])),
+    ]
+    if nodes is not None:
+        sections.append(("bsp", nodes))
+    if not os.path.exists(anim):
+        bvh = app.bvh.BVH.build(sections[0][1], vert_indices)
+        sections.extend([("bvh", bvh.nodes), ("boxes", bvh.boxes), ("tris", bvh.triangles)])
+    if os.path.exists(anim):
+        with open(anim, "rb") as f:
+            sections.append(("anim", array.array("B", f.read())))
+    return sections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packs models into a bundle for the renderer")
+    parser.add_argument("-o", "--output", required=True, help="bundle file to write")
+    parser.add_argument(
+        "--bsp", action="store_true", help="build BSP trees for models that are neither convex nor animated"
+    )
+    parser.add_argument("objects", nargs="+", help="object files of the models to pack")
+    args = parser.parse_args()
+
+    app = import_app()
+    sections = []
+    for filename in args.objects:
+        entry = os.path.basename(filename)
+        try:
+            model = mesh_sections(app, filename, args.bsp)
+        except ValueError as e:
+            sys.exit("{}: {}".format(filename, e))
+        for name, data in model:
+            name = entry + "/" + name
+            if len(name) > MAX_NAME:
+                sys.exit("{}: section name {} is longer than {} characters".format(filename, name, MAX_NAME))
+            sections.append((name, data))
+        model = dict(model)
+        print(
+            "{}: {} vertices, {} faces{}{}{}{}".format(
+                entry,
+                len(model["verts"]) // 3,
+                len(model["sizes"]),
+                ", convex" if model["flags"][0] & app.object.FLAG_CONVEX else "",
+                ", animated" if "anim" in model else "",
+                ", BSP tree of {} nodes".format(len(model["bsp"]) // 4) if "bsp" in model else "",
+                ", BVH of {} nodes".format(len(model["bvh"]) // 4) if "bvh" in model else "",
+            )
+        )
+
+    # Section data follows the index, each section starting on a 4-byte boundary
+    offset = struct.calcsize(HEADER) + len(sections) * struct.calcsize(ENTRY)
+    index = []
+    for name, data in sections:
+        offset = (offset + 3) & ~3
+        index.append((name, data.typecode, offset, len(data) * data.itemsize))
+        offset += len(data) * data.itemsize
+
+    with open(args.output, "wb") as f:
+        f.write(struct.pack(HEADER, MAGIC, VERSION, len(sections)))
+        for name, typecode, offset, size in index:
+            f.write(struct.pack(ENTRY, name.encode(), typecode.encode(), offset, size))
+        for (name, data), (_, _, offset, _) in zip(sections, index):
+            f.write(bytes(offset - f.tell()))
+            if sys.byteorder == "big":
+                data.byteswap()
+            f.write(data.tobytes())
+        size = f.tell()
+    print("{}: {} models, {} sections, {:,} bytes".format(args.output, len(args.objects), len(sections), size))
+
+
+if __name__ == "__main__":
+    main()
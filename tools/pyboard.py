@@ -71,6 +71,8 @@ import sys
 import time
 import os
 import ast
+import struct
+import binascii
 
 try:
     stdout = sys.stdout.buffer
@@ -89,6 +91,57 @@ class PyboardError(Exception):
     pass
 
 
+# Streaming download protocol used by Pyboard.fs_get_stream.  Each frame is a
+# header of kind, flags, length and CRC32 followed by length bytes of payload,
+# where the kind is the byte value of one of the following characters:
+#   "S": start of file, length is the total file size, no payload
+#   "D": a chunk of file data, the CRC32 covers the payload
+#   "E": end of file, no payload
+# The CRC32 is only valid if the frame has the _STREAM_CRC flag, devices
+# without binascii.crc32 send data frames without it.  In base64 mode each
+# whole frame is base64 encoded and sent as a text line.  Raw binary frames
+# need both sys.stdout.buffer, as the text stream may translate newlines, and
+# binascii.crc32, so base64 mode is used instead on devices missing either.
+_STREAM_HEADER = "<BBII"
+_STREAM_HEADER_SIZE = struct.calcsize(_STREAM_HEADER)
+_STREAM_CRC = 1
+
+_stream_get_code = """\
+import sys, struct, binascii
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+_t3d_binary = crc32 is not None and hasattr(sys.stdout, "buffer")
+def _t3d_stream(src, chunk_size, b64):
+    if not (b64 or _t3d_binary):
+        raise OSError("binary stream needs sys.stdout.buffer and binascii.crc32")
+    o = getattr(sys.stdout, "buffer", sys.stdout)
+    h = lambda k, c, n, v: struct.pack("<BBII", k, c, n, v)
+    e = binascii.b2a_base64 if b64 else None
+    w = (lambda d: o.write(e(d))) if b64 else o.write
+    f = open(src, "rb")
+    f.seek(0, 2)
+    w(h(83, 0, f.tell(), 0))
+    f.seek(0)
+    b = bytearray(chunk_size)
+    m = memoryview(b)
+    while True:
+        n = f.readinto(b)
+        if not n:
+            break
+        d = m[:n]
+        c = h(68, 1, n, crc32(d)) if crc32 else h(68, 0, n, 0)
+        if b64:
+            w(c + d)
+        else:
+            w(c)
+            w(d)
+    f.close()
+    w(h(69, 0, 0, 0))
+"""
+
+
 class TelnetToSerial:
     def __init__(self, ip, user, password, read_timeout=None):
         self.tn = None
@@ -515,6 +568,86 @@ class Pyboard:
                     progress_callback(written, src_size)
         self.exec_("f.close()")
 
+    def _read_exact(self, n):
+        data = b""
+        while len(data) < n:
+            new_data = self.serial.read(n - len(data))
+            if not new_data:
+                raise PyboardError("stream_get: timeout reading from device")
+            data += new_data
+        return data
+
+    def _read_stream_frame(self, base64_frames):
+        # The end of the command's normal output before a complete transfer
+        # means the device raised an exception
+        data = self._read_exact(1)
+        if data == b"\x04":
+            return None
+        if base64_frames:
+            line = data + self.read_until(1, b"\n", timeout=10)
+            if not line.endswith(b"\n"):
+                raise PyboardError("stream_get: timeout reading from device")
+            try:
+                frame = binascii.a2b_base64(line)
+            except binascii.Error as e:
+                raise PyboardError("stream_get: could not decode frame: %s" % str(e))
+            header = frame[:_STREAM_HEADER_SIZE]
+            payload = frame[_STREAM_HEADER_SIZE:]
+        else:
+            header = data + self._read_exact(_STREAM_HEADER_SIZE - 1)
+            payload = None
+        kind, flags, length, crc = struct.unpack(_STREAM_HEADER, header)
+        kind = bytes([kind])
+        if kind == b"D":
+            if payload is None:
+                payload = self._read_exact(length)
+            if len(payload) != length:
+                raise PyboardError("stream_get: short frame")
+            if flags & _STREAM_CRC and binascii.crc32(payload) != crc:
+                raise PyboardError("stream_get: CRC mismatch")
+        elif kind not in (b"S", b"E"):
+            raise PyboardError("stream_get: unexpected frame %r" % kind)
+        return kind, length, payload
+
+    def fs_get_stream(
+        self, src, dest, chunk_size=4096, progress_callback=None, base64_frames=False
+    ):
+        """Copy a file from the device, with the device streaming the data as
+        CRC checked frames in a single command rather than one command per
+        chunk.  Frames are raw binary, unless base64_frames is given for
+        connections that are not 8-bit clean, or the device can't send CRC
+        checked binary frames, see _stream_get_code."""
+        self.exec_(_stream_get_code)
+        if not base64_frames and self.eval("_t3d_binary") != b"True":
+            base64_frames = True
+        self.exec_raw_no_follow(
+            "_t3d_stream(%r, %u, %r)" % (src, chunk_size, bool(base64_frames))
+        )
+        src_size = 0
+        written = 0
+        with open(dest, "wb") as f:
+            while True:
+                frame = self._read_stream_frame(base64_frames)
+                if frame is None:
+                    data_err = self.read_until(1, b"\x04")
+                    raise PyboardError("exception", b"", data_err[:-1])
+                kind, length, payload = frame
+                if kind == b"S":
+                    src_size = length
+                elif kind == b"D":
+                    f.write(payload)
+                    written += length
+                    if progress_callback:
+                        progress_callback(written, src_size)
+                else:
+                    break
+        # Consume the end of the command's output and its (empty) error output
+        ret, ret_err = self.follow(10)
+        if ret_err:
+            raise PyboardError("exception", ret, ret_err)
+        if written != src_size:
+            raise PyboardError("stream_get: expected %u bytes, got %u" % (src_size, written))
+
     def fs_put(self, src, dest, chunk_size=256, progress_callback=None):
         if progress_callback:
             src_size = os.path.getsize(src)
@@ -558,7 +691,7 @@ def execfile(filename, device="/dev/ttyACM0", baudrate=115200, user="micro", pas
     pyb.close()
 
 
-def filesystem_command(pyb, args, progress_callback=None, verbose=False):
+def filesystem_command(pyb, args, progress_callback=None, verbose=False, stream=None):
     def fname_remote(src):
         if src.startswith(":"):
             src = src[1:]
@@ -584,6 +717,17 @@ def filesystem_command(pyb, args, progress_callback=None, verbose=False):
                 op = pyb.fs_put
                 fmt = "cp %s :%s"
                 dest = fname_remote(dest)
+            elif stream:
+
+                def op(src, dest, progress_callback):
+                    pyb.fs_get_stream(
+                        src,
+                        dest,
+                        progress_callback=progress_callback,
+                        base64_frames=stream == "base64",
+                    )
+
+                fmt = "cp :%s %s"
             else:
                 op = pyb.fs_get
                 fmt = "cp :%s %s"
@@ -712,6 +856,20 @@ def main():
         help="perform a filesystem action: "
         "cp local :device | cp :device local | cat path | ls [path] | rm path | mkdir path | rmdir path",
     )
+    group = cmd_parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--stream",
+        action="store_const",
+        const="binary",
+        help="copy files from the device using the streaming binary protocol",
+    )
+    group.add_argument(
+        "--stream-base64",
+        action="store_const",
+        const="base64",
+        dest="stream",
+        help="as --stream, but base64 encoded for connections that are not 8-bit clean",
+    )
     cmd_parser.add_argument("files", nargs="*", help="input files")
     args = cmd_parser.parse_args()
 
@@ -758,7 +916,7 @@ def main():
 
         # do filesystem commands, if given
         if args.filesystem:
-            filesystem_command(pyb, args.files, verbose=True)
+            filesystem_command(pyb, args.files, verbose=True, stream=args.stream)
             del args.files[:]
 
         # run the command, if given
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Offline renderer, for making turntable previews and thumbnails of models on a build machine
+
+Renders a model through the same pipeline as the app: the model is read with the app's own object and
+material parsers, then transformed, back faces are culled, the faces are sorted back to front, flat
+shaded and quantised to RGB565, but as NumPy array operations over every face of the model at once
+instead of face by face; frames are rendered in parallel across a pool of processes and written as PNG
+images
+
+Frames are the same, pixel for pixel, as the frames the renderer draws off the badge, which are the ones
+checked by tools/golden.py: the floating point maths is done in the same order, and rounded to single
+precision wherever the app stores a value in a float array, and triangles are filled in exactly the
+same way as MicroPython's framebuf module fills polygons; the badge itself works in single precision
+throughout, so the odd pixel along an edge can differ from what the badge shows
+
+The model turns around the given axis by the given number of degrees each frame, starting from where it
+would be on the badge at frame 0, and only the solid render modes are supported; run it from anywhere:
+
+    python tools/render_offline.py -o frames/ app/teapot.obj
+    python tools/render_offline.py -o frames/ --frames 0:360 --degrees 1 --axis 1,1,0 -j 8 app/teapot.obj
+    python tools/render_offline.py -o thumbnail/ --frames 30:31 --mode 3 app/dodeca.obj
+"""
+
+import argparse
+from array import array
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from appmodules import import_app
+from capture import write_png
+
+# Colours in the framebuffer have their bytes swapped for the display, see BufferedDisplay
+BLACK = 0x0000
+
+# The app's modules, imported by load_app(); the render modes, camera, projection and lighting are the
+# app's own, from app/scene.py
+app = None
+
+
+def load_app():
+    global app
+    if app is None:
+        app = import_app()
+
+
+def identity_matrix():
+    return array("f", [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1])
+
+
+def f32(values):
+    # Rounds to single precision, as storing a value in an array('f') does
+    return np.asarray(values, dtype=np.float64).astype(np.float32).astype(np.float64)
+
+
+def transform(points, m):
+    """
+    Transforms an (n, 3) array of points by a 4x4 matrix in the same way as v_multiply, returning
+    single precision values
+    """
+    x = points[:, 0]
+    y = points[:, 1]
+    z = points[:, 2]
+    w = x * m[3] + y * m[7] + z * m[11] + m[15]
+    dest = np.empty_like(points)
+    for c in range(3):
+        d = x * m[c] + y * m[4 + c] + z * m[8 + c] + m[12 + c]
+        dest[:, c] = np.where(w != 1, d / np.where(w != 1, w, 1), d)
+    return f32(dest)
+
+
+def dot(vectors, vector):
+    # The same order of operations as v_dot, for each row of an (n, 3) array against a single vector
+    return vectors[:, 0] * vector[0] + vectors[:, 1] * vector[1] + vectors[:, 2] * vector[2]
+
+
+def cdiv(a, b):
+    # Integer division rounding towards zero, as C does
+    q = np.abs(a) // np.abs(b)
+    return np.where((a >= 0) == (b >= 0), q, -q)
+
+
+def ranges(starts, lengths):
+    # Concatenates a range of each of the given lengths from each of the given starts
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + np.arange(offsets.size) - offsets
+
+
+def swap_colour_bytes(colours):
+    return ((colours & 0xFF) << 8) | ((colours >> 8) & 0xFF)
+
+
+def color565(r, g, b):
+    return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+
+class Model:
+    """
+    A mesh and its materials as arrays of single precision values, loaded by the app's own Mesh class,
+    along with everything it works out about the mesh when loading it
+    """
+
+    def __init__(self, filename):
+        app.object.ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(filename)), "")
+        mesh = app.object.Mesh(os.path.basename(filename))
+
+        # Only the first three vertices of a face are drawn, the same as in the app
+        self.vertices = f32([list(v) for v in mesh.vertices])
+        self.faces = np.array([list(face[:3]) for face in mesh.vert_indices], dtype=np.int64).reshape(-1, 3)
+        self.normals = f32([list(mesh.normals[i]) for i in mesh.norm_indices]).reshape(-1, 3)
+        self.plane_dists = f32(mesh.plane_dists)
+        self.colours = f32([list(c) for c in mesh.colours])
+        self.col_indices = np.array(mesh.col_indices, dtype=np.int64)
+
+        # The faces of a convex mesh aren't sorted, they are drawn in the order of the mesh's clusters
+        self.convex = mesh.convex
+        self.cluster_order = np.array(
+            [f for cluster_faces, _ in mesh.clusters for f in cluster_faces], dtype=np.int64
+        )
+
+
+class Scene:
+    """
+    Everything needed to render frames of a model that stays the same from frame to frame
+    """
+
+    def __init__(self, filename, mode, width, height):
+        load_app()
+        self.model = Model(filename)
+        self.mode = mode
+        self.width = width
+        self.height = height
+        scene = app.scene
+        self.m_proj = scene.perspective_matrix(scene.FIELD_OF_VIEW, width / height, scene.NEAR, scene.FAR)
+        self.camera = app.camera.Camera(self.m_proj, scene.CAMERA_POSITION)
+        self.m_view = self.camera.view_matrix()
+        self.v_light = array("f", scene.LIGHT)
+        app.tidal3d_viper.v_normalise(self.v_light)
+
+    def render(self, orientation):
+        """
+        Renders the model with the given orientation quaternion, returning the framebuffer as an array of
+        byte-swapped RGB565 pixel values, as the app's framebuffer holds them
+        """
+        native = app.tidal3d_viper
+        model = self.model
+        m_view = self.m_view
+
+        # The model matrix, and the light vector and camera position in the model's object space, are
+        # only worked out once per frame, see Renderer.build_display_list()
+        position = array("f", [0, 0, 0])
+        m_model = identity_matrix()
+        native.m_rotate(m_model, orientation)
+        native.m_translate(m_model, position)
+        m_inverse = identity_matrix()
+        native.m_rotate(
+            m_inverse, array("f", [orientation[0], -orientation[1], -orientation[2], -orientation[3]])
+        )
+        light = array("f", [0, 0, 0])
+        native.v_multiply(self.v_light, m_inverse, light)
+        camera_obj = array("f", [0, 0, 0])
+        native.v_subtract(self.camera.position, position, camera_obj)
+        native.v_multiply(camera_obj, m_inverse)
+
+        # Cull back faces, then sort the rest by the depth of their centres, ties are broken by face
+        # index in the same way as z_sort's sort of (depth, index) pairs; the app doesn't sort the faces
+        # of convex meshes, except in the first frame after loading one
+        world = transform(model.vertices, m_model)
+        if model.convex:
+            faces = model.cluster_order
+            faces = faces[dot(model.normals[faces], camera_obj) >= model.plane_dists[faces]]
+        else:
+            visible = np.nonzero(dot(model.normals, camera_obj) >= model.plane_dists)[0]
+            corners = world[model.faces[visible]]
+            centres = f32((corners[:, 0] + corners[:, 1] + corners[:, 2]) / 3)
+            depths = transform(centres, m_view)[:, 2]
+            faces = visible[np.lexsort((visible, depths))]
+
+        colours = self._colours(faces, light)
+        triangles, triangle_faces = self._project(transform(world, m_view), faces)
+        return self._fill(triangles, colours[triangle_faces])
+
+    def _colours(self, faces, light):
+        # The colour of each face, in the order given
+        model = self.model
+        rgb = model.colours[model.col_indices[faces]]
+        if self.mode == app.scene.MODE_SOLID_SHADED:
+            # Scale the colour by the angle of incidence of the light, but no lower than a minimum
+            rgb = f32(rgb * -dot(model.normals[faces], light)[:, None])
+            rgb = np.maximum(np.trunc(rgb), 8)
+        rgb = rgb.astype(np.int64)
+        return swap_colour_bytes(color565(rgb[:, 0], rgb[:, 1], rgb[:, 2]))
+
+    def _project(self, view, faces):
+        """
+        Projects the given faces, in the order given, returning an (n, 6) array of screen coordinates of
+        the triangles to draw, in drawing order, and which of the given faces each triangle belongs to
+        """
+        m = self.m_proj
+        guard = app.scene.GUARD_BAND
+        corners = view[self.model.faces[faces]]
+        x = corners[..., 0]
+        y = corners[..., 1]
+        z = corners[..., 2]
+        cx, cy, cz, cw = (x * m[c] + y * m[4 + c] + z * m[8 + c] + m[12 + c] for c in range(4))
+
+        # Which of the clip planes each vertex is outside of, as in v_clip_to_screen
+        distances = [cz, cx + guard * cw, guard * cw - cx, cy + cw, cw - cy]
+        outside = [d < 0 for d in distances]
+        outside_all = np.zeros(len(faces), dtype=bool)
+        outside_any = np.zeros(len(faces), dtype=bool)
+        for o in outside:
+            outside_all |= o.all(axis=1)
+            outside_any |= o.any(axis=1)
+
+        # Faces that don't cross any clip plane are projected all at once, the rest are worked out too,
+        # but are thrown away, so dividing by zero doesn't matter
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ndc_x = f32(np.where(cw != 1, cx / cw, cx))
+            ndc_y = f32(np.where(cw != 1, cy / cw, cy))
+            coords = np.empty((len(faces), 6), dtype=np.int64)
+            coords[:, 0::2] = np.trunc((ndc_x + 1) * (0.5 * self.width))
+            coords[:, 1::2] = np.trunc((1 - (ndc_y + 1) * 0.5) * self.height)
+        simple = ~outside_any
+
+        # Faces that cross a clip plane can become a fan of several triangles, these are rare enough that
+        # they are clipped one at a time by the app's own code
+        max_triangles = app.scene.CLIP_MAX_TRIANGLES
+        triangles = [coords[simple]]
+        owners = [np.nonzero(simple)[0]]
+        positions = [owners[0] * max_triangles]
+        scratch = array("h", [0] * 6 * max_triangles)
+        for i in np.nonzero(outside_any & ~outside_all)[0]:
+            face_verts = [array("f", view[j]) for j in self.model.faces[faces[i]]]
+            n = app.tidal3d_viper.v_clip_to_screen(face_verts, m, scratch, 0, self.width, self.height, guard)
+            if n:
+                triangles.append(np.array(scratch[: n * 6], dtype=np.int64).reshape(n, 6))
+                owners.append(np.full(n, i))
+                positions.append(i * max_triangles + np.arange(n))
+        order = np.argsort(np.concatenate(positions), kind="stable")
+        return np.concatenate(triangles)[order], np.concatenate(owners)[order]
+
+    def _fill(self, triangles, colours):
+        """
+        Fills the given triangles, later triangles drawing over earlier ones, returning the framebuffer
+
+        Each triangle is filled the same way as framebuf's poly() method: a span between the edges of
+        the triangle on each row it covers, rounded the same way, and then a pixel at the lower end of
+        each edge and any horizontal edges drawn as lines; rather than filling triangles one after the
+        other, every pixel is tagged with the last triangle to cover it
+        """
+        width = self.width
+        height = self.height
+        px = triangles[:, 0::2]
+        py = triangles[:, 1::2]
+
+        # Spans; the edges are taken in the same order as poly() does, from the first point backwards
+        y_min = py.min(axis=1)
+        y_max = py.max(axis=1)
+        rows = y_max - y_min + 1
+        tri = np.repeat(np.arange(len(triangles)), rows)
+        row = ranges(y_min, rows)
+        left = np.full(len(tri), np.iinfo(np.int64).max)
+        right = np.full(len(tri), np.iinfo(np.int64).min)
+        for a, b in ((0, 2), (2, 1), (1, 0)):
+            px1 = px[tri, a]
+            py1 = py[tri, a]
+            px2 = px[tri, b]
+            py2 = py[tri, b]
+            crosses = (py1 != py2) & (((py1 > row) & (py2 <= row)) | ((py1 <= row) & (py2 > row)))
+            step = np.where(crosses, py2 - py1, 1)
+            node = cdiv(32 * px1 + cdiv(32 * (px2 - px1) * (row - py1), step) + 16, 32)
+            left = np.where(crosses, np.minimum(left, node), left)
+            right = np.where(crosses, np.maximum(right, node), right)
+        spans = (left <= right) & (row >= 0) & (row < height)
+        tri = tri[spans]
+        row = row[spans]
+        left = np.maximum(left[spans], 0)
+        right = np.minimum(right[spans], width - 1)
+        spans = left <= right
+        tri, row, left, right = tri[spans], row[spans], left[spans], right[spans]
+        lengths = right - left + 1
+        pixel_tri = [np.repeat(tri, lengths)]
+        pixel_x = [ranges(left, lengths)]
+        pixel_y = [np.repeat(row, lengths)]
+
+        # The lower end of each sloping edge, and every pixel of each horizontal edge
+        for a, b in ((0, 2), (2, 1), (1, 0)):
+            sloping = py[:, a] != py[:, b]
+            lower = np.where(py[:, a] > py[:, b], a, b)
+            index = np.nonzero(sloping)[0]
+            pixel_tri.append(index)
+            pixel_x.append(px[index, lower[index]])
+            pixel_y.append(py[index, lower[index]])
+            index = np.nonzero(~sloping)[0]
+            x1 = np.minimum(px[index, a], px[index, b])
+            lengths = np.abs(px[index, a] - px[index, b]) + 1
+            pixel_tri.append(np.repeat(index, lengths))
+            pixel_x.append(ranges(x1, lengths))
+            pixel_y.append(np.repeat(py[index, a], lengths))
+
+        pixel_tri = np.concatenate(pixel_tri)
+        pixel_x = np.concatenate(pixel_x)
+        pixel_y = np.concatenate(pixel_y)
+        inside = (pixel_x >= 0) & (pixel_x < width) & (pixel_y >= 0) & (pixel_y < height)
+        last = np.full(width * height, -1)
+        np.maximum.at(last, pixel_y[inside] * width + pixel_x[inside], pixel_tri[inside])
+
+        # Pixels that no triangle covers are left as the background, the last of the colours
+        colours = np.append(colours, BLACK)
+        return colours[last].astype(np.uint16)
+
+
+def rgb565_to_rgb888(pixels):
+    # The same as the function of the same name in tools/capture.py, but for a whole frame at once
+    c = swap_colour_bytes(pixels.astype(np.uint32))
+    r = (c >> 11) & 0x1F
+    g = (c >> 5) & 0x3F
+    b = c & 0x1F
+    rgb = np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1)
+    return rgb.astype(np.uint8).tobytes()
+
+
+def frame_orientation(frame, degrees, axis):
+    # Turn from the starting orientation in a single step, so rounding doesn't build up over frames
+    orientation = array("f", [1, 0, 0, 0])
+    app.tidal3d_viper.q_rotate(orientation, frame * degrees, axis)
+    return orientation
+
+
+# Each worker process sets up its own scene once, and then renders frames from it
+_worker = None
+
+
+def _init_worker(filename, mode, width, height, degrees, axis, output):
+    global _worker
+    scene = Scene(filename, mode, width, height)
+    axis = array("f", axis)
+    app.tidal3d_viper.v_normalise(axis)
+    _worker = (scene, degrees, axis, output)
+
+
+def _render_frame(frame):
+    scene, degrees, axis, output = _worker
+    pixels = scene.render(frame_orientation(frame, degrees, axis))
+    filename = os.path.join(output, "frame_{:05d}.png".format(frame))
+    write_png(filename, scene.width, scene.height, rgb565_to_rgb888(pixels))
+    return frame
+
+
+def parse_range(text):
+    start, _, end = text.partition(":")
+    start = int(start)
+    return range(start, int(end) if end else start + 1)
+
+
+def main():
+    load_app()
+    parser = argparse.ArgumentParser(description="Renders frames of a model the same way as the app")
+    parser.add_argument("-o", "--output", required=True, help="directory to write PNG images to")
+    parser.add_argument(
+        "--mode",
+        type=int,
+        choices=(app.scene.MODE_SOLID, app.scene.MODE_SOLID_SHADED),
+        default=app.scene.MODE_SOLID_SHADED,
+        help="render mode, as numbered in the app (default 4, solid shaded)",
+    )
+    parser.add_argument("--width", type=int, default=135, help="frame width (default 135)")
+    parser.add_argument("--height", type=int, default=240, help="frame height (default 240)")
+    parser.add_argument(
+        "--frames", type=parse_range, default=range(0, 72), help="range of frames START:END (default 0:72)"
+    )
+    parser.add_argument("--degrees", type=float, default=5, help="degrees to turn each frame (default 5)")
+    parser.add_argument(
+        "--axis",
+        type=lambda text: [float(v) for v in text.split(",")],
+        default=[0, 1, 0],
+        help="axis to turn around, x,y,z (default 0,1,0)",
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of processes")
+    parser.add_argument("model", help="Wavefront object file")
+    args = parser.parse_args()
+
+    if len(args.axis) != 3:
+        parser.error("--axis takes three values")
+    os.makedirs(args.output, exist_ok=True)
+    init_args = (args.model, args.mode, args.width, args.height, args.degrees, args.axis, args.output)
+
+    start_t = time.perf_counter()
+    if args.jobs > 1:
+        with multiprocessing.Pool(args.jobs, _init_worker, init_args) as pool:
+            for _ in pool.imap_unordered(_render_frame, args.frames, chunksize=4):
+                pass
+    else:
+        _init_worker(*init_args)
+        for frame in args.frames:
+            _render_frame(frame)
+    elapsed = time.perf_counter() - start_t
+    print(
+        "{}: {} frames in {:.2f} s, {:.1f} frames/s".format(
+            args.output, len(args.frames), elapsed, len(args.frames) / elapsed if elapsed else 0
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
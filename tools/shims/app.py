@@ -0,0 +1,29 @@
+"""
+Stand-in for the badge firmware's app module, for running the app off the badge; timers never fire,
+whatever runs the app calls its methods directly instead
+"""
+
+from buttons import Buttons
+
+
+class _Timer:
+    def cancel(self):
+        pass
+
+
+class App:
+    def __init__(self):
+        self.buttons = Buttons()
+        self.timer = None
+
+    def on_activate(self):
+        pass
+
+    def on_deactivate(self):
+        pass
+
+    def after(self, ms, callback):
+        return _Timer()
+
+    def periodic(self, ms, callback):
+        return _Timer()
@@ -0,0 +1,26 @@
+"""
+Stand-in for the badge firmware's buttons module, for running the app off the badge; no button is
+ever pressed
+"""
+
+
+def _num(pin):
+    return pin
+
+
+class _Callback:
+    def __init__(self, callback):
+        self.callback = callback
+        # Buttons are active low
+        self.state = 1
+
+
+class Buttons:
+    def __init__(self):
+        self._callbacks = {}
+
+    def on_press(self, pin, callback, autorepeat=True):
+        self._callbacks[pin] = _Callback(callback)
+
+    def on_up_down(self, pin, callback):
+        self._callbacks[pin] = _Callback(callback)
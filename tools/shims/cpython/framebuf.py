@@ -0,0 +1,181 @@
+"""
+Stand-in for MicroPython's framebuf module, for running the app under CPython
+
+This is a port of MicroPython's own implementation, so that it draws exactly the same pixels, but only
+the RGB565 and GS8 formats are supported and text is not drawn at all
+"""
+
+MONO_VLSB = 0
+RGB565 = 1
+GS4_HMSB = 2
+MONO_HLSB = 3
+MONO_HMSB = 4
+GS2_HMSB = 5
+GS8 = 6
+
+
+def _cdiv(a, b):
+    q = abs(a) // abs(b)
+    return q if (a >= 0) == (b >= 0) else -q
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        self.buf = memoryview(buffer)
+        self._w = width
+        self._h = height
+        self.format = format
+        self.stride = stride or width
+        if format == RGB565:
+            self.px = self.buf.cast("B").cast("H")
+        elif format == GS8:
+            self.px = self.buf.cast("B")
+        else:
+            raise ValueError("unsupported format")
+
+    def _set(self, x, y, c):
+        self.px[x + y * self.stride] = c
+
+    def pixel(self, x, y, c=None):
+        if 0 <= x < self._w and 0 <= y < self._h:
+            if c is None:
+                return self.px[x + y * self.stride]
+            self._set(x, y, c)
+
+    def fill_rect(self, x, y, w, h, c):
+        if h < 1 or w < 1 or x + w <= 0 or y + h <= 0 or y >= self._h or x >= self._w:
+            return
+        xend = min(self._w, x + w)
+        yend = min(self._h, y + h)
+        x = max(x, 0)
+        y = max(y, 0)
+        n = xend - x
+        px = self.px
+        if self.format == RGB565:
+            for yy in range(y, yend):
+                o = yy * self.stride
+                px[o + x:o + xend] = memoryview(bytearray(c.to_bytes(2, "little") * n)).cast("H")
+        else:
+            for yy in range(y, yend):
+                o = yy * self.stride
+                px[o + x:o + xend] = bytes([c]) * n
+
+    def fill(self, c):
+        self.fill_rect(0, 0, self._w, self._h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+        else:
+            self.fill_rect(x, y, w, 1, c)
+            self.fill_rect(x, y + h - 1, w, 1, c)
+            self.fill_rect(x, y, 1, h, c)
+            self.fill_rect(x + w - 1, y, 1, h, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        width = self._w
+        height = self._h
+        dx = x2 - x1
+        if dx > 0:
+            sx = 1
+        else:
+            dx = -dx
+            sx = -1
+        dy = y2 - y1
+        if dy > 0:
+            sy = 1
+        else:
+            dy = -dy
+            sy = -1
+        if dy > dx:
+            x1, y1 = y1, x1
+            dx, dy = dy, dx
+            sx, sy = sy, sx
+            steep = True
+        else:
+            steep = False
+        e = 2 * dy - dx
+        for _ in range(dx):
+            if steep:
+                if 0 <= y1 < width and 0 <= x1 < height:
+                    self._set(y1, x1, c)
+            else:
+                if 0 <= x1 < width and 0 <= y1 < height:
+                    self._set(x1, y1, c)
+            while e >= 0:
+                y1 += sy
+                e -= 2 * dx
+            x1 += sx
+            e += 2 * dy
+        if 0 <= x2 < width and 0 <= y2 < height:
+            self._set(x2, y2, c)
+
+    def poly(self, x, y, coords, c, fill=False):
+        n_poly = len(coords) // 2
+        if n_poly == 0:
+            return
+        if fill:
+            y_min = min(coords[i * 2 + 1] for i in range(n_poly))
+            y_max = max(coords[i * 2 + 1] for i in range(n_poly))
+            for row in range(y_min, y_max + 1):
+                nodes = []
+                px1 = coords[0]
+                py1 = coords[1]
+                i = n_poly * 2 - 1
+                while True:
+                    py2 = coords[i]
+                    i -= 1
+                    px2 = coords[i]
+                    i -= 1
+                    if py1 != py2 and ((py1 > row and py2 <= row) or (py1 <= row and py2 > row)):
+                        node = _cdiv(32 * px1 + _cdiv(32 * (px2 - px1) * (row - py1), py2 - py1) + 16, 32)
+                        nodes.append(node)
+                    elif row == max(py1, py2):
+                        if py1 < py2:
+                            self.pixel(x + px2, y + py2, c)
+                        elif py2 < py1:
+                            self.pixel(x + px1, y + py1, c)
+                        else:
+                            self.line(x + px1, y + py1, x + px2, y + py2, c)
+                    px1 = px2
+                    py1 = py2
+                    if i < 0:
+                        break
+                if not nodes:
+                    continue
+                nodes.sort()
+                for i in range(0, len(nodes) - 1, 2):
+                    self.fill_rect(x + nodes[i], y + row, nodes[i + 1] - nodes[i] + 1, 1, c)
+        else:
+            px1 = coords[0]
+            py1 = coords[1]
+            i = n_poly * 2 - 1
+            while True:
+                py2 = coords[i]
+                i -= 1
+                px2 = coords[i]
+                i -= 1
+                self.line(x + px1, y + py1, x + px2, y + py2, c)
+                px1 = px2
+                py1 = py2
+                if i < 0:
+                    break
+
+    def text(self, s, x, y, c=1):
+        # The font is not reproduced here
+        pass
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        for yy in range(fbuf._h):
+            for xx in range(fbuf._w):
+                p = fbuf.px[xx + yy * fbuf.stride]
+                if palette is not None:
+                    p = palette.pixel(p, 0)
+                if p != key:
+                    self.pixel(x + xx, y + yy, p)
@@ -0,0 +1,36 @@
+"""
+Stand-in for MicroPython's micropython module, for running the app under CPython
+
+The code emitter decorators leave functions as they are, and the viper pointer types are provided as
+views of the buffers they are given
+"""
+
+import builtins
+import sys
+
+
+def const(value):
+    return value
+
+
+def native(func):
+    return func
+
+
+viper = native
+
+
+def _ptr(typecode):
+    def ptr(buffer):
+        return memoryview(buffer).cast("B").cast(typecode)
+
+    return ptr
+
+
+# Decorators are used as @micropython.native without importing micropython, and viper's types are
+# built in, so make them available everywhere
+builtins.micropython = sys.modules[__name__]
+builtins.ptr8 = _ptr("B")
+builtins.ptr16 = _ptr("H")
+builtins.ptr32 = _ptr("I")
+builtins.uint = int
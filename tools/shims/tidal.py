@@ -0,0 +1,56 @@
+"""
+Stand-in for the badge firmware's tidal module, for running the app off the badge
+
+Only what the app uses is provided: the button names, colour constants and a display that keeps
+whatever is blitted to it in memory
+"""
+
+BUTTON_A = "A"
+BUTTON_B = "B"
+BUTTON_FRONT = "FRONT"
+JOY_UP = "UP"
+JOY_DOWN = "DOWN"
+JOY_LEFT = "LEFT"
+JOY_RIGHT = "RIGHT"
+JOY_CENTRE = "CENTRE"
+
+BLACK = 0x0000
+BLUE = 0x001F
+RED = 0xF800
+GREEN = 0x07E0
+CYAN = 0x07FF
+MAGENTA = 0xF81F
+YELLOW = 0xFFE0
+WHITE = 0xFFFF
+
+
+def color565(r, g, b):
+    return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+
+class Display:
+    def __init__(self, width=135, height=240):
+        self._width = width
+        self._height = height
+        self.screen = bytearray(2 * width * height)
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def blit_buffer(self, buffer, x, y, w, h):
+        src = memoryview(buffer)
+        for row in range(h):
+            offset = ((y + row) * self._width + x) * 2
+            self.screen[offset : offset + 2 * w] = src[row * 2 * w : (row + 1) * 2 * w]
+
+    def fill_rect(self, x, y, w, h, colour):
+        value = bytes([colour >> 8, colour & 0xFF]) * w
+        for row in range(y, y + h):
+            offset = (row * self._width + x) * 2
+            self.screen[offset : offset + 2 * w] = value
+
+
+display = Display()
@@ -2,18 +2,22 @@
 
 APP_DIR=/apps/tidal_3d
 
-# Copy files onto the device using the pyboard tool from micropython,
-# reproduced in this repo for convenience so we don't have to have
-# a local clone available of the firmware or micropython repos:
+# Copy files onto the device using the deploy tool, which is built on the pyboard tool from
+# micropython, reproduced in this repo for convenience so we don't have to have a local clone
+# available of the firmware or micropython repos:
 # https://github.com/micropython/micropython/blob/master/tools/pyboard.py
-python tools/pyboard.py --no-soft-reset -d /dev/ttyACM0 -f mkdir $APP_DIR >/dev/null
+# Only files that have changed since the last upload are copied
 APP_FILES="$@"
 if [ -z "$APP_FILES" ] ; then
 	APP_FILES="app/*.py app/*.obj app/*.mtl"
 fi
-for f in $APP_FILES ; do
-	python tools/pyboard.py --no-soft-reset -d /dev/ttyACM0 -f cp $f :$APP_DIR/$(basename $f)
-done
+# If mpy-cross is available, modules are deployed as pre-compiled bytecode so the badge doesn't have
+# to compile them every time the app is launched
+MPY=
+if command -v ${MPY_CROSS:-mpy-cross} >/dev/null ; then
+	MPY=--mpy
+fi
+python tools/deploy.py -d /dev/ttyACM0 $MPY $APP_DIR $APP_FILES || exit 1
 
 # Monitor serial console
 minicom -D /dev/ttyACM0